@@ -0,0 +1,296 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""In-process reader for ELF note sections.
+
+Only the ELF header, the section (or program) headers, and the note data are
+read, so this is much cheaper than running readelf for each file. This module
+is shared by ndk-stack and parse_elfnote.py, so it must not depend on anything
+outside the standard library.
+"""
+from __future__ import annotations
+
+import functools
+import mmap
+import os
+import struct
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+ELF_MAGIC = b"\x7fELF"
+
+SHT_NOTE = 7
+PT_NOTE = 4
+
+NT_GNU_BUILD_ID = 3
+NT_ANDROID_TYPE_IDENT = 1
+
+ANDROID_IDENT_SECTION = ".note.android.ident"
+
+
+class ElfError(Exception):
+    """The file is not a valid ELF file."""
+
+
+def round_up_to_nearest(val: int, step: int) -> int:
+    """Round an integer, val, to the next multiple of a positive integer,
+    step."""
+    return (val + (step - 1)) // step * step
+
+
+class StructParser:
+    def __init__(self, buf: bytes, byte_order: str = "<") -> None:
+        self.buf = buf
+        self.byte_order = byte_order
+        self.pos = 0
+
+    @property
+    def remaining(self) -> int:
+        return len(self.buf) - self.pos
+
+    @property
+    def empty(self) -> bool:
+        return self.remaining == 0
+
+    def read(self, read_len: int) -> bytes:
+        buf = self.buf[self.pos : read_len + self.pos]
+        self.pos += read_len
+        return buf
+
+    def read_struct(self, fmt: str, kind: str) -> tuple[object, ...]:
+        parser = struct.Struct(self.byte_order + fmt)
+        if self.remaining < parser.size:
+            raise ElfError("{} was truncated".format(kind))
+        return parser.unpack(self.read(parser.size))
+
+
+def iterate_notes(
+    sec_data: bytes,
+    byte_order: str = "<",
+    warn: Callable[[str], object] | None = None,
+) -> Iterator[tuple[bytes, int, bytes]]:
+    """Iterates over the (name, type, descriptor) of each note in sec_data.
+
+    If warn is given, it is called with a message for each note whose name is
+    malformed but still usable.
+    """
+    parser = StructParser(sec_data, byte_order)
+    while not parser.empty:
+        namesz, descsz, kind = parser.read_struct("III", "note header")
+        assert isinstance(namesz, int)
+        assert isinstance(descsz, int)
+        assert isinstance(kind, int)
+        name, desc = parser.read_struct(
+            "{}s{}s".format(
+                round_up_to_nearest(namesz, 4), round_up_to_nearest(descsz, 4)
+            ),
+            "note body",
+        )
+        assert isinstance(name, bytes)
+        assert isinstance(desc, bytes)
+        name = name[:namesz]
+        if name[-1:] == b"\0":
+            name = name[:-1]
+        elif name and warn is not None:
+            warn("note name {!r} isn't NUL-terminated".format(name))
+        yield name, kind, desc[:descsz]
+
+
+@dataclass(frozen=True)
+class ElfNotes:
+    """The notes of interest from an ELF file.
+
+    Attributes:
+      build_id: The hex encoded GNU build id, or None if there is none.
+      android_ident: The descriptor of the Android ident note, or None if there
+                     is none. See parse_elfnote.py for its layout.
+    """
+
+    build_id: str | None
+    android_ident: bytes | None
+
+
+class ElfReader:
+    """Reads the headers and notes of an ELF image in a buffer.
+
+    The image starts at offset in the buffer, which allows reading ELF files
+    that are stored uncompressed in a zip file without extracting them.
+    """
+
+    def __init__(self, buf: bytes | mmap.mmap, offset: int = 0) -> None:
+        self.buf = buf
+        self.offset = offset
+        ident = self._read(0, 16)
+        if len(ident) < 16 or ident[:4] != ELF_MAGIC:
+            raise ElfError("not an ELF file")
+        if ident[4] == 1:
+            self.is_64 = False
+        elif ident[4] == 2:
+            self.is_64 = True
+        else:
+            raise ElfError("unknown ELF class {}".format(ident[4]))
+        if ident[5] == 1:
+            self.byte_order = "<"
+        elif ident[5] == 2:
+            self.byte_order = ">"
+        else:
+            raise ElfError("unknown ELF data encoding {}".format(ident[5]))
+
+        if self.is_64:
+            phoff, shoff = self._unpack("QQ", 0x20)
+            phentsize, phnum, shentsize, shnum, shstrndx = self._unpack("HHHHH", 0x36)
+        else:
+            phoff, shoff = self._unpack("II", 0x1C)
+            phentsize, phnum, shentsize, shnum, shstrndx = self._unpack("HHHHH", 0x2A)
+        self.phoff = phoff
+        self.phentsize = phentsize
+        self.phnum = phnum
+        self.shoff = shoff
+        self.shentsize = shentsize
+        self.shnum = shnum
+        self.shstrndx = shstrndx
+
+    def _read(self, pos: int, size: int) -> bytes:
+        start = self.offset + pos
+        return bytes(self.buf[start : start + size])
+
+    def _unpack(self, fmt: str, pos: int) -> tuple[int, ...]:
+        parser = struct.Struct(self.byte_order + fmt)
+        data = self._read(pos, parser.size)
+        if len(data) != parser.size:
+            raise ElfError("ELF file is truncated")
+        return parser.unpack(data)
+
+    def iter_sections(self) -> Iterator[tuple[int, int, int, int]]:
+        """Iterates over the (name offset, type, file offset, size) of each
+        section."""
+        for i in range(self.shnum):
+            pos = self.shoff + i * self.shentsize
+            if self.is_64:
+                name, kind, _, _, offset, size = self._unpack("IIQQQQ", pos)
+            else:
+                name, kind, _, _, offset, size = self._unpack("IIIIII", pos)
+            yield name, kind, offset, size
+
+    def iter_note_segments(self) -> Iterator[bytes]:
+        """Iterates over the contents of each PT_NOTE segment."""
+        for i in range(self.phnum):
+            pos = self.phoff + i * self.phentsize
+            if self.is_64:
+                kind, _, offset, _, _, size = self._unpack("IIQQQQ", pos)
+            else:
+                kind, offset, _, _, size = self._unpack("IIIII", pos)
+            if kind == PT_NOTE:
+                yield self._read(offset, size)
+
+    def section_name(self, strtab_offset: int, name_offset: int) -> bytes:
+        name = self._read(strtab_offset + name_offset, 256)
+        return name.split(b"\0", 1)[0]
+
+    def read_section(self, section_name: str) -> bytes | None:
+        """Returns the contents of the named section, or None if it is absent."""
+        sections = list(self.iter_sections())
+        if self.shstrndx >= len(sections):
+            return None
+        strtab_offset = sections[self.shstrndx][2]
+        wanted = section_name.encode()
+        for name, _, offset, size in sections:
+            if self.section_name(strtab_offset, name) == wanted:
+                return self._read(offset, size)
+        return None
+
+    def iter_note_data(self) -> Iterator[bytes]:
+        """Iterates over the contents of each note section.
+
+        The program headers are used if the file has no section headers.
+        """
+        found_section = False
+        for _, kind, offset, size in self.iter_sections():
+            if kind == SHT_NOTE:
+                found_section = True
+                yield self._read(offset, size)
+        if not found_section:
+            yield from self.iter_note_segments()
+
+    def read_notes(self) -> ElfNotes:
+        build_id = None
+        android_ident = None
+        for data in self.iter_note_data():
+            for name, kind, desc in iterate_notes(data, self.byte_order):
+                if (name, kind) == (b"GNU", NT_GNU_BUILD_ID) and build_id is None:
+                    build_id = desc.hex()
+                elif (name, kind) == (b"Android", NT_ANDROID_TYPE_IDENT):
+                    if android_ident is None:
+                        android_ident = desc
+        return ElfNotes(build_id, android_ident)
+
+
+@contextmanager
+def _map_file(path: str) -> Iterator[mmap.mmap]:
+    with open(path, "rb") as elf_file:
+        try:
+            buf = mmap.mmap(elf_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as ex:
+            # Raised for empty files.
+            raise ElfError(str(ex)) from ex
+        with buf:
+            yield buf
+
+
+def read_section(path: str, section_name: str) -> bytes | None:
+    """Returns the contents of the named section of an ELF file, if present.
+
+    Raises:
+      ElfError: The file is not a valid ELF file.
+      OSError: The file could not be read.
+    """
+    with _map_file(path) as buf:
+        return ElfReader(buf).read_section(section_name)
+
+
+def read_notes_at(path: str, offset: int = 0) -> ElfNotes:
+    """Reads the notes of the ELF image at offset in the file at path.
+
+    Raises:
+      ElfError: The file does not contain a valid ELF image at offset.
+      OSError: The file could not be read.
+    """
+    with _map_file(path) as buf:
+        return ElfReader(buf, offset).read_notes()
+
+
+@functools.lru_cache(maxsize=4096)
+def _read_notes_cached(path: str, offset: int, _mtime_ns: int, _size: int) -> ElfNotes:
+    return read_notes_at(path, offset)
+
+
+def read_notes(path: str, offset: int = 0) -> ElfNotes:
+    """Reads the notes of an ELF file.
+
+    Results are memoized per path and modification time, so repeated queries
+    for an unchanged file are free.
+
+    Raises:
+      ElfError: The file does not contain a valid ELF image at offset.
+      OSError: The file could not be read.
+    """
+    stat = os.stat(path)
+    return _read_notes_cached(path, offset, stat.st_mtime_ns, stat.st_size)
+
+
+def get_build_id(path: str) -> str | None:
+    """Returns the hex encoded GNU build id of an ELF file, if it has one."""
+    return read_notes(path).build_id
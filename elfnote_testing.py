@@ -0,0 +1,105 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Builders for the minimal ELF files used to test readers of ELF notes.
+
+Used by the tests of ndk-stack and of the NDK build, so like elfnote this must
+not depend on anything outside the standard library.
+"""
+from __future__ import annotations
+
+import struct
+from typing import Optional
+
+from elfnote import ANDROID_IDENT_SECTION, NT_ANDROID_TYPE_IDENT, NT_GNU_BUILD_ID
+
+ET_REL = 1
+ET_DYN = 3
+EM_AARCH64 = 183
+SHT_NOTE = 7
+SHT_STRTAB = 3
+SHF_ALLOC = 2
+
+
+def make_note(name: bytes, note_type: int, desc: bytes) -> bytes:
+    """Returns a note entry. name must include its NUL terminator."""
+
+    def pad(data: bytes) -> bytes:
+        return data + bytes(-len(data) % 4)
+
+    header = struct.pack("<III", len(name), len(desc), note_type)
+    return header + pad(name) + pad(desc)
+
+
+def make_elf(e_type: int, section_name: str, notes: bytes) -> bytes:
+    """Returns a little endian AArch64 ELF64 file with one note section.
+
+    Args:
+        e_type: The ELF file type, such as ET_REL or ET_DYN.
+        section_name: Name of the note section.
+        notes: Contents of the note section. May be empty.
+    """
+    shstrtab = b"\0" + section_name.encode() + b"\0.shstrtab\0"
+    note_offset = 64
+    strtab_offset = note_offset + len(notes)
+    shoff = strtab_offset + len(shstrtab)
+    header = b"\x7fELF" + bytes([2, 1, 1]) + bytes(9)
+    header += struct.pack(
+        "<HHIQQQIHHHHHH", e_type, EM_AARCH64, 1, 0, 0, shoff, 0, 64, 0, 0, 64, 3, 2
+    )
+    section = struct.Struct("<IIQQQQIIQQ")
+    sections = section.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    sections += section.pack(
+        1, SHT_NOTE, SHF_ALLOC, 0, note_offset, len(notes), 0, 0, 4, 0
+    )
+    sections += section.pack(
+        len(section_name) + 2,
+        SHT_STRTAB,
+        0,
+        0,
+        strtab_offset,
+        len(shstrtab),
+        0,
+        0,
+        1,
+        0,
+    )
+    return header + notes + shstrtab + sections
+
+
+def make_build_id_elf(build_id: str, payload: bytes = b"") -> bytes:
+    """Returns a shared object with a GNU build ID note.
+
+    Args:
+        build_id: The build ID as a hex string.
+        payload: Appended to the note so that libraries with the same build ID
+            can still be told apart.
+    """
+    note = make_note(b"GNU\0", NT_GNU_BUILD_ID, bytes.fromhex(build_id))
+    return make_elf(ET_DYN, ".note.gnu.build-id", note + payload)
+
+
+def make_android_ident_elf(api: Optional[int]) -> bytes:
+    """Returns a relocatable object with an Android ident note.
+
+    Args:
+        api: The API level recorded in the note, or None for an empty note
+            section.
+    """
+    note = b""
+    if api is not None:
+        desc = struct.pack("<i", api) + bytes(128)
+        note = make_note(b"Android\0", NT_ANDROID_TYPE_IDENT, desc)
+    return make_elf(ET_REL, ANDROID_IDENT_SECTION, note)
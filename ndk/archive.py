@@ -13,16 +13,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-"""Helper functions for reading and writing .zip and .tar.bz2 archives."""
+"""Helper functions for reading and writing .zip and .tar.bz2 archives.
+
+The NDK packages (.zip and .tar.br) are written by this module rather than by
+zip and tar. Both are written from a single walk of the NDK, the zip entries are
+compressed in parallel, and the tar stream is compressed by brotli while the zip
+is written.
+"""
+from __future__ import annotations
+
+import collections
+import multiprocessing
 import os
 import shutil
+import stat
+import struct
 import subprocess
+import tarfile
+import time
+import zlib
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Sequence, TypeVar
 
 import ndk.paths
 from ndk.hosts import Host
 
+T = TypeVar("T")
+R = TypeVar("R")
+
 
 def make_bztar(base_name: Path, root_dir: Path, base_dir: Path) -> None:
     """Create a compressed tarball.
@@ -62,6 +82,387 @@ def make_bztar(base_name: Path, root_dir: Path, base_dir: Path) -> None:
         )
 
 
+@dataclass(frozen=True)
+class ArchiveEntry:
+    """A file, directory or symlink to add to an archive.
+
+    Attributes:
+        path: Path to the file.
+        arcname: Path of the file in the archive, using / as the separator.
+        mode: The file's st_mode. For symlinks that are not preserved this is
+            the mode of the link's target.
+        mtime: The file's modification time.
+        link_target: The target of the symlink, if this is a preserved symlink.
+    """
+
+    path: Path
+    arcname: str
+    mode: int
+    mtime: float
+    link_target: Optional[str] = None
+
+    @property
+    def is_dir(self) -> bool:
+        """True if this entry is a directory."""
+        return self.link_target is None and stat.S_ISDIR(self.mode)
+
+
+def walk_archive_entries(
+    root_dir: Path, paths: Iterable[str], preserve_symlinks: bool
+) -> List[ArchiveEntry]:
+    """Lists the entries to archive, in a deterministic order.
+
+    Args:
+        root_dir: Directory that the paths are relative to.
+        paths: Files and directories to archive, relative to root_dir.
+            Directories are archived recursively.
+        preserve_symlinks: Whether to preserve or flatten symlinks.
+    """
+    entries: List[ArchiveEntry] = []
+
+    def add(path: Path, arcname: str) -> None:
+        info = path.lstat()
+        if stat.S_ISLNK(info.st_mode):
+            if preserve_symlinks:
+                entries.append(
+                    ArchiveEntry(
+                        path, arcname, info.st_mode, info.st_mtime, os.readlink(path)
+                    )
+                )
+                return
+            info = path.stat()
+        entries.append(ArchiveEntry(path, arcname, info.st_mode, info.st_mtime))
+        if stat.S_ISDIR(info.st_mode):
+            for child in sorted(os.listdir(path)):
+                add(path / child, f"{arcname}/{child}")
+
+    for path in paths:
+        add(root_dir / path, Path(path).as_posix())
+    return entries
+
+
+def _map_in_order(
+    executor: Executor, func: Callable[[T], R], items: Iterable[T], window: int
+) -> Iterator[tuple[T, R]]:
+    """Like Executor.map, but with at most window items in flight.
+
+    This bounds the memory used by results that are waiting to be consumed.
+    """
+    pending: collections.deque[tuple[T, Future[R]]] = collections.deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= window:
+            done, future = pending.popleft()
+            yield done, future.result()
+    while pending:
+        done, future = pending.popleft()
+        yield done, future.result()
+
+
+# Sizes and offsets at or above this need zip64 extensions.
+ZIP64_LIMIT = 0xFFFFFFFF
+# Value of a size or offset field whose value is in the zip64 extra field.
+_ZIP64_MARKER = 0xFFFFFFFF
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+# Unix, zip spec version 3.0.
+ZIP_MADE_BY = (3 << 8) | 30
+# Size of the chunks files are read and compressed in.
+_CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class _ZipData:
+    """The compressed data of a zip entry."""
+
+    crc: int
+    size: int
+    method: int
+    chunks: List[bytes]
+
+    @property
+    def compressed_size(self) -> int:
+        return sum(len(c) for c in self.chunks)
+
+
+def _compress_zip_entry(entry: ArchiveEntry, level: int) -> _ZipData:
+    """Reads and compresses an entry.
+
+    This runs on a thread pool. zlib releases the GIL while compressing, so
+    entries are compressed in parallel.
+    """
+    if entry.is_dir:
+        return _ZipData(0, 0, ZIP_STORED, [])
+    if entry.link_target is not None:
+        # Symlinks are stored as their target, as done by zip --symlinks.
+        target = os.fsencode(entry.link_target)
+        return _ZipData(zlib.crc32(target), len(target), ZIP_STORED, [target])
+
+    crc = 0
+    size = 0
+    chunks = []
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    with entry.path.open("rb") as input_file:
+        while chunk := input_file.read(_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if compressed := compressor.compress(chunk):
+                chunks.append(compressed)
+    chunks.append(compressor.flush())
+    data = _ZipData(crc, size, ZIP_DEFLATED, chunks)
+    if data.compressed_size >= size:
+        # Incompressible (or empty). Store it instead.
+        return _ZipData(crc, size, ZIP_STORED, [entry.path.read_bytes()])
+    return data
+
+
+def _dos_time(mtime: float) -> tuple[int, int]:
+    """Returns the MS-DOS time and date of a timestamp, as used by zip."""
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (
+        (hour << 11) | (minute << 5) | (second // 2),
+        ((year - 1980) << 9) | (month << 5) | day,
+    )
+
+
+def _zip_headers(
+    entry: ArchiveEntry, data: _ZipData, offset: int
+) -> tuple[bytes, bytes]:
+    """Returns the local file header and central directory record of an entry."""
+    name = entry.arcname + ("/" if entry.is_dir else "")
+    try:
+        encoded_name = name.encode("ascii")
+        flags = 0
+    except UnicodeEncodeError:
+        encoded_name = name.encode("utf-8")
+        flags = 0x800
+    dos_time, dos_date = _dos_time(entry.mtime)
+    external_attr = (entry.mode & 0xFFFF) << 16
+    if entry.is_dir:
+        # The MS-DOS directory attribute.
+        external_attr |= 0x10
+
+    size = data.size
+    compressed_size = data.compressed_size
+    local_extra = b""
+    central_fields = []
+    if size >= ZIP64_LIMIT or compressed_size >= ZIP64_LIMIT:
+        local_extra = struct.pack("<HHQQ", 1, 16, size, compressed_size)
+        central_fields = [size, compressed_size]
+        size = compressed_size = _ZIP64_MARKER
+    if offset >= ZIP64_LIMIT:
+        central_fields.append(offset)
+        offset = _ZIP64_MARKER
+    central_extra = b""
+    if central_fields:
+        central_extra = struct.pack(
+            f"<HH{len(central_fields)}Q", 1, 8 * len(central_fields), *central_fields
+        )
+    version = 45 if local_extra or central_extra else 20
+
+    local_header = (
+        struct.pack(
+            "<4sHHHHHLLLHH",
+            b"PK\x03\x04",
+            version,
+            flags,
+            data.method,
+            dos_time,
+            dos_date,
+            data.crc,
+            compressed_size,
+            size,
+            len(encoded_name),
+            len(local_extra),
+        )
+        + encoded_name
+        + local_extra
+    )
+    central_record = (
+        struct.pack(
+            "<4sHHHHHHLLLHHHHHLL",
+            b"PK\x01\x02",
+            ZIP_MADE_BY,
+            version,
+            flags,
+            data.method,
+            dos_time,
+            dos_date,
+            data.crc,
+            compressed_size,
+            size,
+            len(encoded_name),
+            len(central_extra),
+            0,
+            0,
+            0,
+            external_attr,
+            offset,
+        )
+        + encoded_name
+        + central_extra
+    )
+    return local_header, central_record
+
+
+def _write_zip_end(
+    output: IO[bytes], count: int, directory_offset: int, directory_size: int
+) -> None:
+    """Writes the end of central directory record(s)."""
+    if (
+        count >= 0xFFFF
+        or directory_offset >= ZIP64_LIMIT
+        or directory_size >= ZIP64_LIMIT
+    ):
+        zip64_end_offset = output.tell()
+        output.write(
+            struct.pack(
+                "<4sQHHLLQQQQ",
+                b"PK\x06\x06",
+                44,
+                ZIP_MADE_BY,
+                45,
+                0,
+                0,
+                count,
+                count,
+                directory_size,
+                directory_offset,
+            )
+        )
+        output.write(struct.pack("<4sLQL", b"PK\x06\x07", 0, zip64_end_offset, 1))
+        # The real values are in the zip64 record.
+        count = 0xFFFF
+        directory_size = directory_offset = _ZIP64_MARKER
+    output.write(
+        struct.pack(
+            "<4sHHHHLLH",
+            b"PK\x05\x06",
+            0,
+            0,
+            count,
+            count,
+            directory_size,
+            directory_offset,
+            0,
+        )
+    )
+
+
+def write_zip(
+    zip_file: Path,
+    entries: Sequence[ArchiveEntry],
+    jobs: Optional[int] = None,
+    level: int = 9,
+) -> None:
+    """Writes a zip archive of the entries.
+
+    The archive stores Unix permissions and symlinks in the same way as
+    Info-ZIP's zip, so unzip restores them.
+
+    Args:
+        zip_file: Path to the archive to create.
+        entries: The entries to archive. See walk_archive_entries.
+        jobs: Number of entries to compress in parallel. Defaults to the
+            number of CPUs.
+        level: The zlib compression level.
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    central_directory = []
+    with zip_file.open("wb") as output, ThreadPoolExecutor(jobs) as executor:
+        for entry, data in _map_in_order(
+            executor,
+            lambda e: _compress_zip_entry(e, level),
+            entries,
+            window=jobs * 4,
+        ):
+            local_header, central_record = _zip_headers(entry, data, output.tell())
+            output.write(local_header)
+            for chunk in data.chunks:
+                output.write(chunk)
+            central_directory.append(central_record)
+        directory_offset = output.tell()
+        for record in central_directory:
+            output.write(record)
+        _write_zip_end(
+            output,
+            len(central_directory),
+            directory_offset,
+            output.tell() - directory_offset,
+        )
+
+
+def write_tar(
+    output: IO[bytes], entries: Iterable[ArchiveEntry], preserve_symlinks: bool
+) -> None:
+    """Writes an uncompressed tar stream of the entries to output."""
+    with tarfile.open(
+        fileobj=output,
+        mode="w|",
+        format=tarfile.GNU_FORMAT,
+        dereference=not preserve_symlinks,
+    ) as tar:
+        for entry in entries:
+            tarinfo = tar.gettarinfo(str(entry.path), entry.arcname)
+            if tarinfo.isreg():
+                with entry.path.open("rb") as input_file:
+                    tar.addfile(tarinfo, input_file)
+            else:
+                tar.addfile(tarinfo)
+
+
+def brotli_path() -> Path:
+    """Returns the path to the prebuilt brotli."""
+    return ndk.paths.android_path(
+        "prebuilts/build-tools/{host}-x86/bin/brotli".format(host=Host.current().value)
+    )
+
+
+def write_brtar(
+    br_file: Path, entries: Iterable[ArchiveEntry], preserve_symlinks: bool
+) -> None:
+    """Writes a Brotli-compressed tarball of the entries.
+
+    The tar stream is piped to brotli as it is written.
+    """
+    if os.name == "nt":
+        raise NotImplementedError
+    with br_file.open("wb") as output:
+        # Choice of 7 as quality parameter based on the following data:
+        #
+        # q | size (MB) | compression time relative to -q 0
+        # --+-----------+----------------------------------
+        # 0 | 622       |  0:00
+        # 2 | 514       |  0:10
+        # 5 | 447       |  1:14
+        # 6 | 435       |  1:48
+        # 7 | 401       |  3:24
+        # 8 | 393       |  5:35
+        # 9 | 388       | 10:37
+        cmd = [str(brotli_path()), "-q", "7"]
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=output) as proc:
+            assert proc.stdin is not None
+            try:
+                write_tar(proc.stdin, entries, preserve_symlinks)
+            except BaseException:
+                proc.kill()
+                raise
+            finally:
+                proc.stdin.close()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def _check_archive_dirs(root_dir: Path, base_dir: Path) -> None:
+    if not root_dir.is_dir():
+        raise RuntimeError(f"Not a directory: {root_dir}")
+    if not (root_dir / base_dir).is_dir():
+        raise RuntimeError(f"Not a directory: {root_dir}/{base_dir}")
+
+
 def make_brtar(
     base_name: Path, root_dir: Path, base_dir: Path, preserve_symlinks: bool
 ) -> Path:
@@ -74,53 +475,59 @@ def make_brtar(
         root_dir: Directory that's the root of the archive.
         base_dir: Directory relative to root_dir to archive.
     """
-    if not root_dir.is_dir():
-        raise RuntimeError(f"Not a directory: {root_dir}")
-    if not (root_dir / base_dir).is_dir():
-        raise RuntimeError(f"Not a directory: {root_dir}/{base_dir}")
-
+    _check_archive_dirs(root_dir, base_dir)
     br_file = base_name.with_suffix(".tar.br")
-
-    if os.name == "nt":
-        raise NotImplementedError
-    cmd = ["tar"]
-    if not preserve_symlinks:
-        cmd.append("--dereference")
-    cmd.extend(
-        [
-            "--use-compress-program",
-            str(
-                ndk.paths.android_path(
-                    "prebuilts/build-tools/{host}-x86/bin/brotli".format(
-                        host=Host.current().value
-                    )
-                )
-            )
-            # Choice of 7 as quality parameter based on the following data:
-            #
-            # q | size (MB) | compression time relative to -q 0
-            # --+-----------+----------------------------------
-            # 0 | 622       |  0:00
-            # 2 | 514       |  0:10
-            # 5 | 447       |  1:14
-            # 6 | 435       |  1:48
-            # 7 | 401       |  3:24
-            # 8 | 393       |  5:35
-            # 9 | 388       | 10:37
-            + " -q 7",
-            "-cf",
-            str(br_file),
-            "-C",
-            str(root_dir),
-            str(base_dir),
-        ]
+    write_brtar(
+        br_file,
+        walk_archive_entries(root_dir, [str(base_dir)], preserve_symlinks),
+        preserve_symlinks,
     )
-    subprocess.check_call(cmd)
     return br_file
 
 
-# For (un)zipping archives on Unix-like systems, the "zip" and "unzip" commands
-# are pretty universally available.
+def make_packages(
+    base_name: Path,
+    root_dir: Path,
+    base_dir: Path,
+    preserve_symlinks: bool,
+    jobs: Optional[int] = None,
+    entries: Optional[Sequence[ArchiveEntry]] = None,
+) -> tuple[Path, Path]:
+    """Creates the .zip and .tar.br packages of a directory.
+
+    The directory is only walked once, or not at all if the caller already
+    has its entries. The tarball is compressed by brotli in the background
+    while the zip is written.
+
+    Args:
+        base_name: Path (without extension) to the output archives.
+        root_dir: Directory that's the root of the archives.
+        base_dir: Directory relative to root_dir to archive.
+        preserve_symlinks: Whether to preserve or flatten symlinks. Should be
+            false when creating packages for Windows, but otherwise true.
+        jobs: Number of zip entries to compress in parallel.
+        entries: The entries of base_dir, if already known. See
+            walk_archive_entries.
+
+    Returns:
+        The paths to the .zip and .tar.br archives.
+    """
+    _check_archive_dirs(root_dir, base_dir)
+    zip_file = base_name.with_suffix(".zip")
+    br_file = base_name.with_suffix(".tar.br")
+    if entries is None:
+        entries = walk_archive_entries(root_dir, [str(base_dir)], preserve_symlinks)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        brtar = executor.submit(write_brtar, br_file, entries, preserve_symlinks)
+        write_zip(zip_file, entries, jobs)
+        brtar.result()
+    return zip_file, br_file
+
+
+# Zip archives are written by write_zip on every host.
+#
+# For unzipping archives on Unix-like systems, the "unzip" command is pretty
+# universally available.
 #
 # For Windows, the situation is more complicated. After trying and rejecting
 # several options, the somewhat surprising best choice is the "tar"
@@ -166,29 +573,9 @@ def make_zip(
     if not root_dir.is_dir():
         raise RuntimeError(f"Not a directory: {root_dir}")
 
-    cwd = os.getcwd()
     zip_file = base_name.with_suffix(".zip")
-    if zip_file.exists():
-        zip_file.unlink()
-
-    # See comment above regarding .zip files on Windows.
-    if os.name == "nt":
-        # Explicit path, to avoid conflict with Cygwin.
-        args = ["c:/windows/system32/tar.exe", "-a"]
-        if not preserve_symlinks:
-            args.append("-L")
-        args.extend(["-cf", str(zip_file)])
-    else:
-        args = ["zip", "-9qr", str(zip_file)]
-        if preserve_symlinks:
-            args.append("--symlinks")
-    args.extend(paths)
-    os.chdir(root_dir)
-    try:
-        subprocess.check_call(args)
-        return zip_file
-    finally:
-        os.chdir(cwd)
+    write_zip(zip_file, walk_archive_entries(root_dir, paths, preserve_symlinks))
+    return zip_file
 
 
 def unzip(zip_file: Path, dest_dir: Path) -> None:
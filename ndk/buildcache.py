@@ -0,0 +1,231 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A local cache of module build outputs.
+
+Modules that declare their build inputs and outputs (see
+ndk.builds.Module.build_inputs) are keyed by a hash of those inputs, the keys
+of their dependencies, the host, and the build number. If the cache has an
+entry for that key the build phase is skipped and the outputs are restored from
+the cache instead. The install phase always runs, since install paths of
+different modules overlap.
+
+Inputs are identified by the path, size, mode and modification time of each
+file rather than by their contents. Hashing the contents of the toolchain and
+source trees would take longer than most of the builds it would save. Any
+change to a file, even one that doesn't change its contents, is treated as a
+change to the input.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional, Protocol
+
+import ndk.filecopy
+from ndk.builds import Module
+
+# Names of files and directories that are never build inputs.
+IGNORED_NAMES = {".git", "__pycache__", ".mypy_cache", ".pytest_cache"}
+
+
+def logger() -> logging.Logger:
+    """Returns the module logger."""
+    return logging.getLogger(__name__)
+
+
+class Digest(Protocol):
+    """The part of the hashlib hash object interface used to build keys."""
+
+    def update(self, data: bytes, /) -> None:
+        ...
+
+
+def _hash_path(digest: Digest, path: Path, name: str) -> None:
+    try:
+        info = path.lstat()
+    except FileNotFoundError:
+        digest.update(f"{name}\0missing\n".encode("utf-8"))
+        return
+
+    if stat.S_ISLNK(info.st_mode):
+        digest.update(f"{name}\0link\0{os.readlink(path)}\n".encode("utf-8"))
+    elif stat.S_ISDIR(info.st_mode):
+        digest.update(f"{name}\0dir\n".encode("utf-8"))
+        for child in sorted(os.listdir(path)):
+            if child not in IGNORED_NAMES:
+                _hash_path(digest, path / child, f"{name}/{child}")
+    else:
+        digest.update(
+            f"{name}\0{info.st_mode:o}\0{info.st_size}\0{info.st_mtime_ns}\n".encode(
+                "utf-8"
+            )
+        )
+
+
+def fingerprint(paths: Iterable[Path]) -> str:
+    """Returns a hash identifying the current state of the given paths.
+
+    Directories are walked recursively. Paths that do not exist are part of the
+    fingerprint too, so creating them changes it.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        _hash_path(digest, path, str(path))
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """A cache of module build outputs keyed by fingerprints of their inputs.
+
+    The fingerprints are built from the path, mode, size and modification time
+    of each input file, not from its contents (see fingerprint()). A change to
+    an input that preserves its size and modification time is not noticed, and
+    gives a stale hit. Copies that preserve modification times, such as cp -p,
+    rsync -a or extracting prebuilts from a tarball, can do this. Remove the
+    cache directory after replacing inputs that way.
+
+    Entries are stored in cache_dir/<module name>/<key>. Only the most recent
+    MAX_ENTRIES_PER_MODULE entries of each module are kept.
+
+    The cache is passed to the build workers, so the keys of the modules that
+    have already been built must be recorded with set_key() before their
+    dependents are queued.
+    """
+
+    MAX_ENTRIES_PER_MODULE = 3
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        base_inputs: Iterable[Path],
+        build_number: int,
+    ) -> None:
+        """Initializes a build cache.
+
+        Args:
+            cache_dir: Directory to store cache entries in.
+            base_inputs: Paths that are inputs to every module, such as the
+                build scripts and the toolchain used to build modules.
+            build_number: The build number, which is embedded in some outputs.
+        """
+        self.cache_dir = cache_dir
+        self.base_key = f"{fingerprint(base_inputs)}\0{build_number}"
+        self.keys: dict[str, str] = {}
+
+    def set_key(self, module: Module, key: Optional[str]) -> None:
+        """Records the cache key of a module that has finished building."""
+        if key is not None:
+            self.keys[module.name] = key
+
+    def key_for(self, module: Module) -> Optional[str]:
+        """Returns the cache key for the module.
+
+        Returns:
+            The key, or None if the module does not declare its inputs or if any
+            of its dependencies do not have a key.
+        """
+        inputs = module.build_inputs
+        if inputs is None:
+            return None
+        digest = hashlib.sha256()
+        digest.update(self.base_key.encode("utf-8"))
+        digest.update(
+            f"\0{module.name}\0{type(module).__qualname__}\0{module.host.value}\0".encode(
+                "utf-8"
+            )
+        )
+        for dep in sorted(module.deps):
+            if dep not in self.keys:
+                return None
+            digest.update(f"{dep}\0{self.keys[dep]}\n".encode("utf-8"))
+        digest.update(fingerprint(inputs).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _entry_path(self, module: Module, key: str) -> Path:
+        return self.cache_dir / module.name / key
+
+    def restore(self, module: Module, key: str) -> bool:
+        """Restores the module's build outputs from the cache.
+
+        Returns:
+            True if the outputs were restored, False if there is no entry for
+            the key.
+        """
+        entry = self._entry_path(module, key)
+        if not entry.exists():
+            return False
+        for index, output in enumerate(module.build_outputs):
+            if output.is_dir() and not output.is_symlink():
+                shutil.rmtree(output)
+            elif output.exists() or output.is_symlink():
+                output.unlink()
+            output.parent.mkdir(parents=True, exist_ok=True)
+            cached = entry / str(index)
+            if cached.is_dir():
+                ndk.filecopy.copy_tree(cached, output, symlinks=True)
+            else:
+                ndk.filecopy.copy_file(cached, output, follow_symlinks=False)
+        # Mark the entry as recently used so it isn't pruned.
+        os.utime(entry)
+        return True
+
+    def store(self, module: Module, key: str) -> None:
+        """Stores the module's build outputs in the cache.
+
+        Failing to store an entry is not an error. The module will just be
+        rebuilt next time.
+        """
+        entry = self._entry_path(module, key)
+        staging = entry.with_name(f".{key}.{uuid.uuid4().hex}")
+        try:
+            staging.mkdir(parents=True)
+            for index, output in enumerate(module.build_outputs):
+                if output.is_dir() and not output.is_symlink():
+                    ndk.filecopy.copy_tree(output, staging / str(index), symlinks=True)
+                else:
+                    ndk.filecopy.copy_file(
+                        output, staging / str(index), follow_symlinks=False
+                    )
+            try:
+                staging.rename(entry)
+            except OSError:
+                # Another build stored the same entry first.
+                if not entry.exists():
+                    raise
+        except OSError as ex:
+            logger().warning("Could not cache build of %s: %s", module, ex)
+        finally:
+            if staging.exists():
+                shutil.rmtree(staging)
+        self.prune(module)
+
+    def prune(self, module: Module) -> None:
+        """Removes all but the most recently used entries for the module."""
+        module_dir = self.cache_dir / module.name
+        if not module_dir.exists():
+            return
+        entries = sorted(
+            (p for p in module_dir.iterdir() if not p.name.startswith(".")),
+            key=lambda p: p.stat().st_mtime_ns,
+            reverse=True,
+        )
+        for entry in entries[self.MAX_ENTRIES_PER_MODULE :]:
+            shutil.rmtree(entry, ignore_errors=True)
@@ -29,6 +29,7 @@ from enum import Enum, auto, unique
 from pathlib import Path, PureWindowsPath
 from typing import Any, Dict, Iterator, List, Optional, Set
 
+import ndk.filecopy
 import ndk.paths
 from ndk.autoconf import AutoconfBuilder
 from ndk.cmake import CMakeBuilder
@@ -81,6 +82,13 @@ class Module:
     install_path: Path = Path()
     deps: Set[str] = set()
 
+    # The subset of deps whose build outputs, rather than their installed
+    # files, are all that this module's build needs. The build of this module
+    # may start as soon as these have been built, while they are still being
+    # installed. The install of this module always waits for every dependency
+    # to be installed.
+    build_output_deps: Set[str] = set()
+
     def __getattribute__(self, name: str) -> Any:
         attr = super().__getattribute__(name)
         if name in ("name", "install_path") and attr == "":
@@ -156,6 +164,8 @@ class Module:
             raise self.validate_error("install_path property not set")
         if self.notice_group not in NoticeGroup:
             raise self.validate_error("invalid notice group")
+        if not self.build_output_deps <= self.deps:
+            raise self.validate_error("build_output_deps must be a subset of deps")
         self.validate_notice()
 
     def validate_notice(self) -> None:
@@ -238,6 +248,24 @@ class Module:
         """
         raise NotImplementedError(f"{self.name} didn't implement install().")
 
+    @property
+    def build_inputs(self) -> Optional[List[Path]]:
+        """Paths read by the build phase, used to cache its outputs.
+
+        Dependencies, the host, and the build number do not need to be listed.
+        Modules that do not declare their inputs are always rebuilt.
+        """
+        return None
+
+    @property
+    def build_outputs(self) -> List[Path]:
+        """Paths written by the build phase and read by the install phase.
+
+        These are restored from the build cache instead of rebuilding the
+        module when none of its build_inputs have changed.
+        """
+        return []
+
     def get_install_path(self, host: Optional[Host] = None) -> Path:
         """Returns the install path for the given module config.
 
@@ -312,13 +340,23 @@ class AutoconfModule(Module):
             "--disable-rpath",
         ]
 
+    @property
+    def build_inputs(self) -> Optional[List[Path]]:
+        return [self.src]
+
+    @property
+    def build_outputs(self) -> List[Path]:
+        return [self.builder.install_directory]
+
     def build(self) -> None:
         self.builder.build(self.configure_args)
 
     def install(self) -> None:
         install_dir = self.get_install_path()
         install_dir.mkdir(parents=True, exist_ok=True)
-        shutil.copytree(self.builder.install_directory, install_dir, dirs_exist_ok=True)
+        ndk.filecopy.copy_tree(
+            self.builder.install_directory, install_dir, dirs_exist_ok=True
+        )
 
 
 class CMakeModule(Module):
@@ -358,13 +396,23 @@ class CMakeModule(Module):
     def defines(self) -> Dict[str, str]:
         return {}
 
+    @property
+    def build_inputs(self) -> Optional[List[Path]]:
+        return [self.src]
+
+    @property
+    def build_outputs(self) -> List[Path]:
+        return [self.builder.install_directory]
+
     def build(self) -> None:
         self.builder.build(self.defines)
 
     def install(self) -> None:
         install_dir = self.get_install_path()
         install_dir.mkdir(parents=True, exist_ok=True)
-        shutil.copytree(self.builder.install_directory, install_dir, dirs_exist_ok=True)
+        ndk.filecopy.copy_tree(
+            self.builder.install_directory, install_dir, dirs_exist_ok=True
+        )
 
 
 class PackageModule(Module):
@@ -425,6 +473,11 @@ class ScriptShortcutModule(Module):
 
     disallow_windows_install_path_with_spaces: bool = False
 
+    @property
+    def build_inputs(self) -> Optional[List[Path]]:
+        # Nothing is built, but dependents may be cached.
+        return []
+
     def validate(self) -> None:
         super().validate()
 
@@ -522,6 +575,14 @@ class PythonApplication(Module):
     copy_to_python_path: list[Path] = []
     main: str
 
+    @property
+    def build_inputs(self) -> Optional[List[Path]]:
+        return [self.package, *self.pip_dependencies, *self.copy_to_python_path]
+
+    @property
+    def build_outputs(self) -> List[Path]:
+        return [self._pyz_build_location]
+
     def build(self) -> None:
         if self._staging.exists():
             shutil.rmtree(self._staging)
@@ -670,4 +731,4 @@ def install_directory(src: Path, dst: Path) -> None:
     if dst.exists():
         shutil.rmtree(dst)
     ignore_patterns = shutil.ignore_patterns("*.pyc", "*.pyo", "*.swp", "*.git*")
-    shutil.copytree(src, dst, ignore=ignore_patterns)
+    ndk.filecopy.copy_tree(src, dst, ignore=ignore_patterns)
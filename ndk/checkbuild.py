@@ -21,6 +21,7 @@ build goals, and invokes the build scripts.
 """
 import argparse
 import collections
+import concurrent.futures
 import contextlib
 import copy
 import inspect
@@ -28,6 +29,7 @@ import json
 import logging
 import multiprocessing
 import os
+import posixpath
 import re
 import shutil
 import site
@@ -35,8 +37,10 @@ import stat
 import subprocess
 import sys
 import textwrap
+import time
 import traceback
 from collections.abc import Sequence
+from dataclasses import dataclass
 from pathlib import Path
 from typing import (
     Any,
@@ -46,6 +50,7 @@ from typing import (
     Iterable,
     Iterator,
     List,
+    Optional,
     Set,
     TextIO,
     Tuple,
@@ -55,10 +60,15 @@ import ndk.abis
 import ndk.ansi
 import ndk.archive
 import ndk.autoconf
+import ndk.buildcache
 import ndk.builds
 import ndk.cmake
 import ndk.config
 import ndk.deps
+import ndk.durations
+import ndk.filecopy
+import ndk.manifest
+import ndk.notices
 import ndk.notify
 import ndk.paths
 import ndk.test.builder
@@ -72,6 +82,7 @@ from ndk.crtobjectbuilder import CrtObjectBuilder
 from ndk.hosts import Host
 from ndk.paths import ANDROID_DIR, NDK_DIR, PREBUILT_SYSROOT
 from ndk.platforms import ALL_API_LEVELS, API_LEVEL_ALIASES, MAX_API_LEVEL
+from ndk.tasktrace import TaskTracer
 from ndk.toolchains import CLANG_VERSION, ClangToolchain
 
 from .ndkversionheadergenerator import NdkVersionHeaderGenerator
@@ -83,14 +94,11 @@ def get_version_string(build_number: int) -> str:
     return f"{ndk.config.major}.{ndk.config.hotfix}.{build_number}"
 
 
-def purge_unwanted_files(ndk_dir: Path) -> None:
+def purge_unwanted_files(manifest: ndk.manifest.InstallManifest) -> None:
     """Removes unwanted files from the NDK install path."""
-
-    for path in ndk.paths.walk(ndk_dir, directories=False):
-        if path.suffix == ".pyc":
-            path.unlink()
-        elif path.name == "Android.bp":
-            path.unlink()
+    manifest.remove(
+        lambda e: e.path.endswith(".pyc") or posixpath.basename(e.path) == "Android.bp"
+    )
 
 
 def make_symlink(src: Path, dest: Path) -> None:
@@ -212,7 +220,7 @@ def make_app_bundle(
     create_stub_entry_point(contents_dir / "MacOS" / entry_point_name)
 
     bundled_ndk = contents_dir / "NDK"
-    shutil.copytree(ndk_dir, bundled_ndk)
+    ndk.filecopy.copy_tree(ndk_dir, bundled_ndk)
 
     plist = contents_dir / "Info.plist"
     create_plist(plist, get_version_string(build_number), entry_point_name)
@@ -227,88 +235,86 @@ def make_app_bundle(
     )
 
 
-def make_brtar(
+def make_packages(
     worker: ndk.workqueue.Worker,
     base_name: Path,
     root_dir: Path,
     base_dir: Path,
     preserve_symlinks: bool,
+    entries: List[ndk.archive.ArchiveEntry],
 ) -> None:
-    worker.status = "Packaging .tar.br"
-    ndk.archive.make_brtar(
-        base_name, root_dir, base_dir, preserve_symlinks=preserve_symlinks
-    )
-
-
-def make_zip(
-    worker: ndk.workqueue.Worker,
-    base_name: Path,
-    root_dir: Path,
-    paths: List[str],
-    preserve_symlinks: bool,
-) -> None:
-    worker.status = "Packaging .zip"
-    ndk.archive.make_zip(
-        base_name, root_dir, paths, preserve_symlinks=preserve_symlinks
+    worker.status = "Packaging .zip and .tar.br"
+    ndk.archive.make_packages(
+        base_name,
+        root_dir,
+        base_dir,
+        preserve_symlinks=preserve_symlinks,
+        entries=entries,
     )
 
 
 def package_ndk(
-    ndk_dir: Path, out_dir: Path, dist_dir: Path, host: Host, build_number: int
+    manifest: ndk.manifest.InstallManifest,
+    out_dir: Path,
+    dist_dir: Path,
+    host: Host,
+    build_number: int,
+    workqueue: ndk.workqueue.AnyWorkQueue,
 ) -> Path:
     """Packages the built NDK for distribution.
 
     Args:
-        ndk_dir: Path to the built NDK.
+        manifest: Manifest of the built NDK.
         out_dir: Path to use for constructing any intermediate outputs.
         dist_dir: Path to place the built package in.
         host: Host the given NDK was built for.
         build_number: Build number to use in the package name.
+        workqueue: Work queue to run the packaging tasks on.
     """
     package_name = f"android-ndk-{build_number}-{host.tag}"
     package_path = dist_dir / package_name
+    ndk_dir = manifest.root
 
-    purge_unwanted_files(ndk_dir)
+    purge_unwanted_files(manifest)
 
-    workqueue: ndk.workqueue.WorkQueue = ndk.workqueue.WorkQueue()
-    try:
-        if host == Host.Darwin:
-            workqueue.add_task(
-                make_app_bundle,
-                dist_dir / f"android-ndk-{build_number}-app-bundle",
-                ndk_dir,
-                build_number,
-                out_dir,
-            )
+    workqueue.name = "package"
+    if host == Host.Darwin:
         workqueue.add_task(
-            make_brtar,
-            package_path,
-            ndk_dir.parent,
-            Path(ndk_dir.name),
-            preserve_symlinks=(host != Host.Windows64),
+            make_app_bundle,
+            dist_dir / f"android-ndk-{build_number}-app-bundle",
+            ndk_dir,
+            build_number,
+            out_dir,
         )
-        workqueue.add_task(
-            make_zip,
-            package_path,
-            ndk_dir.parent,
-            [ndk_dir.name],
-            preserve_symlinks=(host != Host.Windows64),
-        )
-        ndk.ui.finish_workqueue_with_ui(workqueue, ndk.ui.get_build_progress_ui)
-    finally:
-        workqueue.terminate()
-        workqueue.join()
+    # Both packages are written by the same task from the manifest, so the NDK
+    # isn't walked again. The task compresses the zip on every core.
+    preserve_symlinks = host != Host.Windows64
+    workqueue.add_task(
+        make_packages,
+        package_path,
+        ndk_dir.parent,
+        Path(ndk_dir.name),
+        preserve_symlinks,
+        manifest.archive_entries(preserve_symlinks),
+    )
+    ndk.ui.finish_workqueue_with_ui(workqueue, ndk.ui.get_build_progress_ui)
     # TODO: Treat the .tar.br archive as authoritative and return its path.
     return package_path.with_suffix(".zip")
 
 
-def build_ndk_tests(out_dir: Path, dist_dir: Path, args: argparse.Namespace) -> bool:
+def build_ndk_tests(
+    out_dir: Path,
+    dist_dir: Path,
+    args: argparse.Namespace,
+    workqueue: ndk.workqueue.AnyWorkQueue,
+) -> bool:
     """Builds the NDK tests.
 
     Args:
         out_dir: Build output directory.
         dist_dir: Preserved artifact directory.
         args: Parsed command line arguments.
+        workqueue: Work queue to build the tests with.
 
     Returns:
         True if all tests pass, else False.
@@ -330,12 +336,15 @@ def build_ndk_tests(out_dir: Path, dist_dir: Path, args: argparse.Namespace) ->
         package_path=Path(dist_dir).joinpath("ndk-tests")
         if args.package_tests
         else None,
+        build_cache_dir=out_dir / "test-build-cache" if args.build_cache else None,
     )
 
     printer = ndk.test.printers.StdoutPrinter()
 
     test_spec = ndk.test.spec.TestSpec.load(ndk.paths.ndk_path("qa_config.json"))
-    builder = ndk.test.builder.TestBuilder(test_spec, test_options, printer)
+    builder = ndk.test.builder.TestBuilder(
+        test_spec, test_options, printer, workqueue=workqueue
+    )
 
     report = builder.build()
     printer.print_summary(report)
@@ -411,6 +420,17 @@ class Clang(ndk.builds.Module):
         for host in Host:
             yield ClangToolchain.path_for_host(host) / "NOTICE"
 
+    @property
+    def build_inputs(self) -> Optional[List[Path]]:
+        # Nothing is built, but the prebuilts are inputs to the modules that
+        # depend on this one.
+        return sorted(
+            {
+                ClangToolchain.path_for_host(self.host),
+                ClangToolchain.path_for_host(Host.current()),
+            }
+        )
+
     def build(self) -> None:
         pass
 
@@ -422,24 +442,84 @@ class Clang(ndk.builds.Module):
             shutil.rmtree(install_path)
         if not install_path.parent.exists():
             install_path.parent.mkdir(parents=True)
-        shutil.copytree(
-            ClangToolchain.path_for_host(self.host),
-            install_path,
-            symlinks=not self.host.is_windows,
-        )
 
-        # The prebuilt Linux Clangs include a bazel file for some other users.
-        # We don't need or test this interface so we shouldn't ship it.
+        # Parts of the prebuilt that we don't ship are skipped while copying
+        # rather than removed afterwards, since some of them are large.
+        skipped_paths = [
+            # clang-4053586 was patched in the prebuilts directory to add the
+            # libc++ includes. These are almost certainly a different revision
+            # than the NDK libc++, and may contain local changes that the NDK's
+            # don't and vice versa. Best to just remove them for the time being
+            # since that returns to the previous behavior.
+            # https://github.com/android-ndk/ndk/issues/564#issuecomment-342307128
+            "include",
+            # For some reason the LLVM install includes CMake modules that
+            # expose its internal APIs. We want to purge these so apps don't
+            # accidentally depend on them. See http://b/142327416 for more info.
+            "lib/cmake",
+            # The Clang prebuilts have the platform toolchain libraries in
+            # lib/clang. The libraries we want are in runtimes_ndk_cxx, and are
+            # installed in their place below.
+            "lib/clang/*/lib/linux",
+        ]
         if self.host is Host.Linux:
-            (install_path / "BUILD.bazel").unlink()
+            skipped_paths.extend(
+                [
+                    # The prebuilt Linux Clangs include a bazel file for some
+                    # other users. We don't need or test this interface so we
+                    # shouldn't ship it.
+                    "BUILD.bazel",
+                    # Duplicate install locations of some runtime libraries. The
+                    # toolchain artifacts install these to a location the driver
+                    # doesn't search. We relocate these as necessary (either in
+                    # this class or in Toolchain). The Android runtimes are only
+                    # packaged in the Linux toolchain.
+                    "runtimes_ndk_cxx",
+                    "android_libc++",
+                ]
+            )
+        else:
+            # We don't build target binaries as part of the Darwin or Windows
+            # build. These toolchains need to get these from the Linux
+            # prebuilts. They're copied from there below.
+            skipped_paths.append("lib/clang")
 
-        # clang-4053586 was patched in the prebuilts directory to add the
-        # libc++ includes. These are almost certainly a different revision than
-        # the NDK libc++, and may contain local changes that the NDK's don't
-        # and vice versa. Best to just remove them for the time being since
-        # that returns to the previous behavior.
-        # https://github.com/android-ndk/ndk/issues/564#issuecomment-342307128
-        shutil.rmtree(install_path / "include")
+        if self.host.is_windows:
+            # Remove LLD duplicates. We only need ld.lld. For non-Windows these
+            # are all symlinks so we can keep them (and *need* to keep lld
+            # since that's the real binary).
+            # http://b/74250510
+            skipped_paths.extend(
+                ["bin/ld64.lld.exe", "bin/lld.exe", "bin/lld-link.exe"]
+            )
+        else:
+            # Remove unused python scripts. They are not installed for Windows.
+            skipped_paths.extend(
+                f"python3/bin/{pattern}"
+                for pattern in [
+                    "2to3*",
+                    "easy_install*",
+                    "idle*",
+                    "pip*",
+                    "pydoc*",
+                    "python*-config",
+                ]
+            )
+
+        # Remove libc++.a and libc++abi.a on Darwin. Now that these files are
+        # universal binaries, they break notarization. Maybe it is possible to
+        # fix notarization by using ditto to preserve APFS extended attributes.
+        # See https://developer.apple.com/forums/thread/126038.
+        if self.host == Host.Darwin:
+            skipped_paths.extend(["lib/libc++.a", "lib/libc++abi.a"])
+
+        prebuilt_path = ClangToolchain.path_for_host(self.host)
+        ndk.filecopy.copy_tree(
+            prebuilt_path,
+            install_path,
+            symlinks=not self.host.is_windows,
+            ignore=ndk.filecopy.ignore_paths(prebuilt_path, skipped_paths),
+        )
 
         if self.host is Host.Linux:
             # The Linux toolchain wraps the compiler to inject some behavior
@@ -460,46 +540,23 @@ class Clang(ndk.builds.Module):
             (bin_dir / "clang-tidy.real").rename(bin_dir / "clang-tidy")
             make_symlink(bin_dir / "clang++", Path("clang"))
 
-        bin_ext = ".exe" if self.host.is_windows else ""
-        if self.host.is_windows:
-            # Remove LLD duplicates. We only need ld.lld. For non-Windows these
-            # are all symlinks so we can keep them (and *need* to keep lld
-            # since that's the real binary).
-            # http://b/74250510
-            (bin_dir / f"ld64.lld{bin_ext}").unlink()
-            (bin_dir / f"lld{bin_ext}").unlink()
-            (bin_dir / f"lld-link{bin_ext}").unlink()
-
         install_clanglib = install_path / "lib/clang"
         linux_prebuilt_path = ClangToolchain.path_for_host(Host.Linux)
 
-        # Remove unused python scripts. They are not installed for Windows.
-        if self.host != Host.Windows64:
-            python_bin_dir = install_path / "python3" / "bin"
-            python_files_to_remove = [
-                "2to3*",
-                "easy_install*",
-                "idle*",
-                "pip*",
-                "pydoc*",
-                "python*-config",
-            ]
-            for file_pattern in python_files_to_remove:
-                for pyfile in python_bin_dir.glob(file_pattern):
-                    pyfile.unlink()
-
         if self.host != Host.Linux:
             # We don't build target binaries as part of the Darwin or Windows build.
             # These toolchains need to get these from the Linux prebuilts.
             #
             # The headers and libraries we care about are all in lib/clang for both
             # toolchains, and those two are intended to be identical between each host,
-            # so we can just replace them with the one from the Linux toolchain.
-            shutil.rmtree(install_clanglib)
-            shutil.copytree(
+            # so we can just use the one from the Linux toolchain.
+            ndk.filecopy.copy_tree(
                 linux_prebuilt_path / "lib/clang",
                 install_clanglib,
                 symlinks=self.host is not Host.Windows64,
+                ignore=ndk.filecopy.ignore_paths(
+                    linux_prebuilt_path / "lib/clang", ["*/lib/linux"]
+                ),
             )
 
         # The toolchain build creates a symlink to easy migration across versions in the
@@ -508,13 +565,12 @@ class Clang(ndk.builds.Module):
             if path.is_symlink():
                 path.unlink()
 
-        # The Clang prebuilts have the platform toolchain libraries in lib/clang. The
-        # libraries we want are in runtimes_ndk_cxx.
+        # Install the NDK runtimes in place of the platform toolchain libraries that
+        # were skipped above.
         ndk_runtimes = linux_prebuilt_path / "runtimes_ndk_cxx"
         for version_dir in install_clanglib.iterdir():
             dst_lib_dir = version_dir / "lib/linux"
-            shutil.rmtree(dst_lib_dir)
-            shutil.copytree(ndk_runtimes, dst_lib_dir)
+            ndk.filecopy.copy_tree(ndk_runtimes, dst_lib_dir)
 
             # Create empty libatomic.a stub libraries to keep -latomic working.
             # This is needed for backwards compatibility and might be useful if
@@ -537,28 +593,6 @@ class Clang(ndk.builds.Module):
                     )
                 )
 
-        # Remove duplicate install locations of some runtime libraries. The toolchain
-        # artifacts install these to a location the driver doesn't search. We relocate
-        # these as necessary (either in this class or in Toolchain), so clean up the
-        # excess. The Android runtimes are only packaged in the Linux toolchain.
-        if self.host == Host.Linux:
-            shutil.rmtree(install_path / "runtimes_ndk_cxx")
-            shutil.rmtree(install_path / "android_libc++")
-
-        # Remove CMake package files that should not be exposed.
-        # For some reason the LLVM install includes CMake modules that expose
-        # its internal APIs. We want to purge these so apps don't accidentally
-        # depend on them. See http://b/142327416 for more info.
-        shutil.rmtree(install_path / "lib/cmake")
-
-        # Remove libc++.a and libc++abi.a on Darwin. Now that these files are
-        # universal binaries, they break notarization. Maybe it is possible to
-        # fix notarization by using ditto to preserve APFS extended attributes.
-        # See https://developer.apple.com/forums/thread/126038.
-        if self.host == Host.Darwin:
-            (install_path / "lib/libc++.a").unlink()
-            (install_path / "lib/libc++abi.a").unlink()
-
         # Strip some large binaries and libraries. This is awkward, hand-crafted
         # logic to select most of the biggest offenders, but could be
         # greatly improved, although handling Mac, Windows, and Linux
@@ -671,6 +705,15 @@ class ShaderTools(ndk.builds.CMakeModule):
         }
         return defines
 
+    @property
+    def build_inputs(self) -> Optional[List[Path]]:
+        return [
+            self.src.parent,
+            ANDROID_DIR / "external" / "googletest",
+            ANDROID_DIR / "external" / "effcee",
+            ANDROID_DIR / "external" / "regex-re2",
+        ]
+
     @property
     def flags(self) -> List[str]:
         return super().flags + [
@@ -756,6 +799,9 @@ class Make(ndk.builds.CMakeModule):
     notice_group = ndk.builds.NoticeGroup.TOOLCHAIN
     src = ANDROID_DIR / "toolchain/make"
     deps = {"clang"}
+    # Make is built with the prebuilt toolchain, not the installed one, so the
+    # build can overlap the (slow) install of clang.
+    build_output_deps = {"clang"}
 
     @property
     def notices(self) -> Iterator[Path]:
@@ -1113,7 +1159,7 @@ class Sysroot(ndk.builds.Module):
         install_path = self.get_install_path()
         if install_path.exists():
             shutil.rmtree(install_path)
-        shutil.copytree(PREBUILT_SYSROOT, install_path)
+        skipped_paths: list[str] = []
         if self.host is not Host.Linux:
             # linux/netfilter has some headers with names that differ only
             # by case, which can't be extracted to a case-insensitive
@@ -1124,7 +1170,7 @@ class Sysroot(ndk.builds.Module):
             # different APIs, but we can't keep both. So far no one has
             # filed bugs about needing either API, so let's just dedup them
             # consistently and we can change that if we hear otherwise.
-            remove_paths = [
+            skipped_paths = [
                 "usr/include/linux/netfilter_ipv4/ipt_ECN.h",
                 "usr/include/linux/netfilter_ipv4/ipt_TTL.h",
                 "usr/include/linux/netfilter_ipv6/ip6t_HL.h",
@@ -1134,8 +1180,11 @@ class Sysroot(ndk.builds.Module):
                 "usr/include/linux/netfilter/xt_RATEEST.h",
                 "usr/include/linux/netfilter/xt_TCPMSS.h",
             ]
-            for remove_path in remove_paths:
-                os.remove(install_path / remove_path)
+        ndk.filecopy.copy_tree(
+            PREBUILT_SYSROOT,
+            install_path,
+            ignore=ndk.filecopy.ignore_paths(PREBUILT_SYSROOT, skipped_paths),
+        )
 
         assert self.context is not None
         NdkVersionHeaderGenerator(
@@ -1312,7 +1361,9 @@ class Toolchain(ndk.builds.Module):
         sysroot_dir = self.get_dep("sysroot").get_install_path()
         system_stl_dir = self.get_dep("system-stl").get_install_path()
 
-        shutil.copytree(sysroot_dir, self.sysroot_install_path, dirs_exist_ok=True)
+        ndk.filecopy.copy_tree(
+            sysroot_dir, self.sysroot_install_path, dirs_exist_ok=True
+        )
 
         exe = ".exe" if self.host.is_windows else ""
         shutil.copy2(
@@ -1346,7 +1397,7 @@ class Toolchain(ndk.builds.Module):
         system_stl_hdr_dir.mkdir(parents=True)
         system_stl_inc_src = system_stl_dir / "include"
         system_stl_inc_dst = system_stl_hdr_dir / "4.9.x"
-        shutil.copytree(system_stl_inc_src, system_stl_inc_dst)
+        ndk.filecopy.copy_tree(system_stl_inc_src, system_stl_inc_dst)
         self.relocate_libcxx()
         self.create_libcxx_linker_scripts()
 
@@ -1380,7 +1431,7 @@ class Toolchain(ndk.builds.Module):
             dest = usr_lib / ndk.abis.abi_to_triple(abi)
             src = self.toolchain_libcxx_path_for(abi) / "lib"
             for lib in src.iterdir():
-                shutil.copy2(lib, dest / lib.name)
+                ndk.filecopy.copy_file(lib, dest / lib.name)
 
         # libc++ headers for Android will currently only be found in the sysroot:
         # https://github.com/llvm/llvm-project/blob/c64f10bfe20308ebc7d5d18912cd0ba82a44eaa1/clang/lib/Driver/ToolChains/Gnu.cpp#L3080-L3084
@@ -1393,7 +1444,7 @@ class Toolchain(ndk.builds.Module):
         if dest.exists():
             shutil.rmtree(dest)
         dest.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copytree(src, dest)
+        ndk.filecopy.copy_tree(src, dest)
 
         # There's also an Android-specific __config_site header that we need to install.
         shutil.copy2(self.find_libcxx_config_site(), dest / "__config_site")
@@ -1730,6 +1781,7 @@ class NdkGdb(ndk.builds.PythonApplication):
         ANDROID_DIR / "development/python-packages/gdbrunner",
     ]
     deps = {"ndk-gdb-shortcut", "ndk-lldb-shortcut"}
+    build_output_deps = deps
 
 
 @register
@@ -1754,8 +1806,10 @@ class NdkStack(ndk.builds.PythonApplication):
     install_path = Path("prebuilt/{host}/bin/ndkstack.pyz")
     notice = NDK_DIR / "NOTICE"
     package = NDK_DIR / "ndkstack.py"
+    copy_to_python_path = [NDK_DIR / "elfnote.py"]
     main = "ndkstack:main"
     deps = {"ndk-stack-shortcut"}
+    build_output_deps = deps
 
 
 @register
@@ -1948,24 +2002,44 @@ class SourceProperties(ndk.builds.Module):
         )
 
 
-def create_notice_file(path: Path, for_group: ndk.builds.NoticeGroup) -> None:
-    # Using sets here so we can perform some amount of duplicate reduction. In
-    # a lot of cases there will be minor differences that cause lots of
-    # "duplicates", but might as well catch what we can.
+def get_notice_files(for_group: ndk.builds.NoticeGroup) -> Set[Path]:
+    """Returns the notice files of every module in the group."""
     notice_files = set()
     for module in ALL_MODULES:
         if module.notice_group == for_group:
             for notice in module.notices:
                 notice_files.add(notice)
+    return notice_files
+
 
-    licenses = set()
-    for notice_path in notice_files:
-        with open(notice_path, encoding="utf-8") as notice_file:
-            licenses.add(notice_file.read())
+def create_notice_file(
+    path: Path,
+    for_group: ndk.builds.NoticeGroup,
+    manifest: ndk.notices.NoticeManifest,
+) -> None:
+    manifest.write_notice_file(path, get_notice_files(for_group))
+
+
+@dataclass
+class ModuleTaskResult:
+    """The result of building or installing a module in a worker.
+
+    Attributes:
+        module: The module.
+        installed: False if this is the result of the build phase, True if it
+            is the result of the install phase.
+        success: False if the build failed.
+        cache_key: The module's build cache key, if it has one.
+        duration: Time taken by the phase, or None if the build outputs were
+            restored from the cache, since that says nothing about how long the
+            module takes to build.
+    """
 
-    with path.open("w", encoding="utf-8") as output_file:
-        # Sorting the contents here to try to make things deterministic.
-        output_file.write(os.linesep.join(sorted(list(licenses))))
+    module: ndk.builds.Module
+    installed: bool
+    success: bool = True
+    cache_key: Optional[str] = None
+    duration: Optional[float] = None
 
 
 def launch_build(
@@ -1973,17 +2047,64 @@ def launch_build(
     module: ndk.builds.Module,
     log_dir: Path,
     debuggable: bool,
-) -> Tuple[bool, ndk.builds.Module]:
-    result = do_build(worker, module, log_dir, debuggable)
-    if not result:
-        return result, module
-    do_install(worker, module)
-    return True, module
+    build_cache: Optional[ndk.buildcache.BuildCache],
+) -> ModuleTaskResult:
+    """Builds a module, or restores its build outputs from the cache."""
+    start = time.monotonic()
+    cache_key = None
+    if build_cache is not None:
+        worker.status = f"Hashing inputs of {module}..."
+        cache_key = build_cache.key_for(module)
+
+    if build_cache is not None and cache_key is not None:
+        worker.status = f"Restoring {module} from build cache..."
+        restored = build_cache.restore(module, cache_key)
+    else:
+        restored = False
+
+    if restored:
+        module.log_path(log_dir).write_text(
+            f"Restored build outputs of {module} from cache entry {cache_key}\n"
+        )
+    else:
+        if not do_build(worker, module, log_dir, debuggable):
+            return ModuleTaskResult(module, installed=False, success=False)
+        if build_cache is not None and cache_key is not None:
+            worker.status = f"Caching {module}..."
+            build_cache.store(module, cache_key)
+    worker.meter.describe(
+        f"build {module.name}", "build", module=module.name, restored=restored
+    )
+    duration = None if restored else time.monotonic() - start
+    return ModuleTaskResult(
+        module, installed=False, cache_key=cache_key, duration=duration
+    )
+
+
+def launch_install(
+    worker: ndk.workqueue.Worker,
+    module: ndk.builds.Module,
+    log_dir: Path,
+    debuggable: bool,
+) -> ModuleTaskResult:
+    """Installs a module that has been built.
+
+    The install may run on a different worker than the build did.
+    """
+    start = time.monotonic()
+    if debuggable:
+        cm: ContextManager[None] = contextlib.nullcontext()
+    else:
+        cm = file_logged_context(module.log_path(log_dir), mode="a")
+    with cm:
+        do_install(worker, module)
+    worker.meter.describe(f"install {module.name}", "install", module=module.name)
+    return ModuleTaskResult(module, installed=True, duration=time.monotonic() - start)
 
 
 @contextlib.contextmanager
-def file_logged_context(path: Path) -> Iterator[None]:
-    with path.open("w") as log_file:
+def file_logged_context(path: Path, mode: str = "w") -> Iterator[None]:
+    with path.open(mode) as log_file:
         os.dup2(log_file.fileno(), sys.stdout.fileno())
         os.dup2(log_file.fileno(), sys.stderr.fileno())
         yield
@@ -2168,6 +2289,34 @@ def parse_args() -> Tuple[argparse.Namespace, List[str]]:
         ),
     )
 
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Print the slowest tasks and the critical path of the build. The "
+            "trace is always written to task_trace.json in the logs directory."
+        ),
+    )
+
+    build_cache_group = parser.add_mutually_exclusive_group()
+    build_cache_group.add_argument(
+        "--build-cache",
+        action="store_true",
+        dest="build_cache",
+        default=True,
+        help=(
+            "Skip building modules and tests whose inputs have not changed since "
+            "they were last built, and reuse the cached build outputs instead "
+            "(default)."
+        ),
+    )
+    build_cache_group.add_argument(
+        "--no-build-cache",
+        action="store_false",
+        dest="build_cache",
+        help="Build every module and test, and do not update the build caches.",
+    )
+
     package_group = parser.add_mutually_exclusive_group()
     package_group.add_argument(
         "--package",
@@ -2263,7 +2412,9 @@ def launch_buildable(
     debuggable: bool,
     skip_deps: bool,
     skip_modules: Set[ndk.builds.Module],
+    build_cache: Optional[ndk.buildcache.BuildCache],
 ) -> None:
+    """Queues the builds and installs of the modules that are ready for them."""
     # If args.skip_deps is true, we could get into a case where we just
     # dequeued the only module that was still building and the only
     # items in get_buildable() are modules that will be skipped.
@@ -2278,7 +2429,23 @@ def launch_buildable(
             if skip_deps and module in skip_modules:
                 deps.complete(module)
                 continue
-            workqueue.add_task(launch_build, module, log_dir, debuggable)
+            workqueue.add_task_with_priority(
+                deps.priority(module),
+                launch_build,
+                module,
+                log_dir,
+                debuggable,
+                build_cache,
+            )
+
+    for module in deps.get_installable():
+        workqueue.add_task_with_priority(
+            deps.priority(module),
+            launch_install,
+            module,
+            log_dir,
+            debuggable,
+        )
 
 
 @contextlib.contextmanager
@@ -2300,24 +2467,45 @@ def wait_for_build(
     debuggable: bool,
     skip_deps: bool,
     skip_modules: Set[ndk.builds.Module],
+    build_cache: Optional[ndk.buildcache.BuildCache],
+    durations: ndk.durations.DurationHistory,
 ) -> None:
     console = ndk.ansi.get_console()
+    # Time taken to build the modules whose install hasn't finished.
+    build_durations: Dict[str, Optional[float]] = {}
     ui = ndk.ui.get_build_progress_ui(console, workqueue)
     with build_ui_context(debuggable):
         while not workqueue.finished():
-            result, module = workqueue.get_result()
-            if not result:
+            result: ModuleTaskResult = workqueue.get_result()
+            module = result.module
+            if not result.success:
                 ui.clear()
                 print("Build failed: {}".format(module))
                 log_build_failure(module.log_path(log_dir), dist_dir)
                 sys.exit(1)
-            elif not console.smart_console:
-                ui.clear()
-                print("Build succeeded: {}".format(module))
 
-            deps.complete(module)
+            if result.installed:
+                if not console.smart_console:
+                    ui.clear()
+                    print("Build succeeded: {}".format(module))
+                build_duration = build_durations.pop(module.name)
+                if build_duration is not None and result.duration is not None:
+                    durations.record(module.name, build_duration + result.duration)
+                deps.complete(module)
+            else:
+                if build_cache is not None:
+                    build_cache.set_key(module, result.cache_key)
+                build_durations[module.name] = result.duration
+                deps.complete_build(module)
+
             launch_buildable(
-                deps, workqueue, log_dir, debuggable, skip_deps, skip_modules
+                deps,
+                workqueue,
+                log_dir,
+                debuggable,
+                skip_deps,
+                skip_modules,
+                build_cache,
             )
 
             ui.draw()
@@ -2325,35 +2513,44 @@ def wait_for_build(
         print("Build finished")
 
 
-def check_ndk_symlink(ndk_dir: Path, src: Path, target: Path) -> None:
-    """Check that the symlink's target is relative, exists, and points within
+def check_ndk_symlinks(manifest: ndk.manifest.InstallManifest, host: Host) -> None:
+    """Check that every symlink's target is relative, exists, and points within
     the NDK installation.
     """
-    if target.is_absolute():
-        raise RuntimeError(f"Symlink {src} points to absolute path {target}")
-    ndk_dir = ndk_dir.resolve()
-    cur = src.parent.resolve()
-    for part in target.parts:
-        # (cur / part) might itself be a symlink. Its validity is checked from
-        # the top-level scan, so it doesn't need to be checked here.
-        cur = (cur / part).resolve()
-        if not cur.exists():
-            raise RuntimeError(f"Symlink {src} targets non-existent {cur}")
-        if not cur.is_relative_to(ndk_dir):
-            raise RuntimeError(f"Symlink {src} targets {cur} outside NDK {ndk_dir}")
-
-
-def check_ndk_symlinks(ndk_dir: Path, host: Host) -> None:
-    for path in ndk.paths.walk(ndk_dir):
-        if not path.is_symlink():
+    for entry in manifest:
+        if not entry.is_symlink:
             continue
         if host == Host.Windows64:
             # Symlinks aren't supported well enough on Windows. (e.g. They
             # require Developer Mode and/or special permissions. Cygwin
             # tools might create symlinks that non-Cygwin programs don't
             # recognize.)
-            raise RuntimeError(f"Symlink {path} unexpected in Windows NDK")
-        check_ndk_symlink(ndk_dir, path, path.readlink())
+            raise RuntimeError(
+                f"Symlink {manifest.path_of(entry)} unexpected in Windows NDK"
+            )
+        manifest.resolve(entry)
+
+
+def create_build_cache(
+    out_dir: Path, args: argparse.Namespace
+) -> ndk.buildcache.BuildCache:
+    """Creates the cache of module build outputs.
+
+    Changes to the build scripts or to the tools used to build modules
+    invalidate every entry.
+    """
+    toolchain = ClangToolchain(args.system)
+    return ndk.buildcache.BuildCache(
+        out_dir / "build-cache",
+        [
+            Path(ndk.__file__).parent,
+            toolchain.path / "bin",
+            toolchain.sysroot.path,
+            ndk.cmake.find_cmake(),
+            ndk.cmake.find_ninja(),
+        ],
+        args.build_number,
+    )
 
 
 def build_ndk(
@@ -2362,7 +2559,8 @@ def build_ndk(
     out_dir: Path,
     dist_dir: Path,
     args: argparse.Namespace,
-) -> Path:
+    workqueue: ndk.workqueue.AnyWorkQueue,
+) -> ndk.manifest.InstallManifest:
     build_context = ndk.builds.BuildContext(
         out_dir, dist_dir, ALL_MODULES, args.system, args.build_number
     )
@@ -2376,40 +2574,82 @@ def build_ndk(
     ndk_dir = ndk.paths.get_install_path(out_dir, args.system)
     ndk_dir.mkdir(parents=True, exist_ok=True)
 
-    deps = ndk.deps.DependencyManager(modules)
-    if args.debuggable:
-        workqueue: ndk.workqueue.AnyWorkQueue = ndk.workqueue.BasicWorkQueue()
-    else:
-        workqueue = ndk.workqueue.WorkQueue(args.jobs)
-    try:
-        launch_buildable(
-            deps, workqueue, log_dir, args.debuggable, args.skip_deps, deps_only
-        )
-        wait_for_build(
-            deps,
-            workqueue,
-            dist_dir,
-            log_dir,
-            args.debuggable,
-            args.skip_deps,
-            deps_only,
-        )
+    build_cache = create_build_cache(out_dir, args) if args.build_cache else None
 
-        if deps.get_buildable():
-            raise RuntimeError(
-                "Builder stopped early. Modules are still "
-                "buildable: {}".format(", ".join(str(deps.get_buildable())))
-            )
+    # Durations of previous builds are used to start the modules on the critical
+    # path first. Cross-compiled modules take different times, so each host has
+    # its own history.
+    durations = ndk.durations.DurationHistory.load(
+        out_dir / args.system.value / "module_durations.json"
+    )
+    deps = ndk.deps.DependencyManager(modules, durations)
+
+    # The notice files are all sources or prebuilts, so they're hashed while the
+    # modules build. That's most of the work of writing the NOTICE files.
+    notice_manifest = ndk.notices.NoticeManifest.load(
+        out_dir / args.system.value / "notice_manifest.json"
+    )
+    notice_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    notices_hashed = notice_executor.submit(
+        notice_manifest.hash_all,
+        [n for group in ndk.builds.NoticeGroup for n in get_notice_files(group)],
+    )
+    notice_executor.shutdown(wait=False)
+
+    workqueue.name = "build"
+    launch_buildable(
+        deps,
+        workqueue,
+        log_dir,
+        args.debuggable,
+        args.skip_deps,
+        deps_only,
+        build_cache,
+    )
+    wait_for_build(
+        deps,
+        workqueue,
+        dist_dir,
+        log_dir,
+        args.debuggable,
+        args.skip_deps,
+        deps_only,
+        build_cache,
+        durations,
+    )
+    durations.save()
 
-        create_notice_file(ndk_dir / "NOTICE", ndk.builds.NoticeGroup.BASE)
-        create_notice_file(
-            ndk_dir / "NOTICE.toolchain", ndk.builds.NoticeGroup.TOOLCHAIN
+    buildable = deps.get_buildable() + deps.get_installable()
+    if buildable:
+        raise RuntimeError(
+            "Builder stopped early. Modules are still "
+            "buildable: {}".format(", ".join(str(m) for m in buildable))
         )
-        check_ndk_symlinks(ndk_dir, args.system)
-        return ndk_dir
-    finally:
-        workqueue.terminate()
-        workqueue.join()
+
+    notices_hashed.result()
+    create_notice_file(ndk_dir / "NOTICE", ndk.builds.NoticeGroup.BASE, notice_manifest)
+    create_notice_file(
+        ndk_dir / "NOTICE.toolchain", ndk.builds.NoticeGroup.TOOLCHAIN, notice_manifest
+    )
+    notice_manifest.save()
+    manifest = ndk.manifest.InstallManifest.scan(ndk_dir)
+    check_ndk_symlinks(manifest, args.system)
+    return manifest
+
+
+def create_workqueue(
+    args: argparse.Namespace, tracer: Optional[TaskTracer] = None
+) -> ndk.workqueue.AnyWorkQueue:
+    """Creates the work queue for the build.
+
+    The same work queue is used for every phase of the build so that the
+    worker processes are only started once. The workers are forked when the
+    work queue is created, so tasks must not depend on changes made to the
+    parent process after that.
+    """
+    if args.debuggable:
+        return ndk.workqueue.BasicWorkQueue(tracer=tracer)
+    return ndk.workqueue.WorkQueue(args.jobs, tracer=tracer)
 
 
 def build_ndk_for_cross_compile(out_dir: Path, args: argparse.Namespace) -> None:
@@ -2420,7 +2660,12 @@ def build_ndk_for_cross_compile(out_dir: Path, args: argparse.Namespace) -> None
     module_names = NAMES_TO_MODULES.keys()
     modules, deps_only = get_modules_to_build(module_names)
     print("Building Linux modules: {}".format(" ".join([str(m) for m in modules])))
-    build_ndk(modules, deps_only, out_dir, out_dir, args)
+    workqueue = create_workqueue(args)
+    try:
+        build_ndk(modules, deps_only, out_dir, out_dir, args, workqueue)
+    finally:
+        workqueue.terminate()
+        workqueue.join()
 
 
 def create_ndk_symlink(out_dir: Path) -> None:
@@ -2430,15 +2675,6 @@ def create_ndk_symlink(out_dir: Path) -> None:
         os.symlink(this_host_ndk, ndk_symlink)
 
 
-def get_directory_size(path: Path) -> int:
-    du_str = subprocess.check_output(["du", "-sm", str(path)])
-    match = re.match(r"^(\d+)", du_str.decode("utf-8"))
-    if match is None:
-        raise RuntimeError(f"Could not determine the size of {path}")
-    size_str = match.group(1)
-    return int(size_str)
-
-
 def main() -> None:
     total_timer = ndk.timer.Timer()
     total_timer.start()
@@ -2508,40 +2744,62 @@ def main() -> None:
         )
     )
 
-    build_timer = ndk.timer.Timer()
-    with build_timer:
-        ndk_dir = build_ndk(modules, deps_only, out_dir, dist_dir, args)
-    installed_size = get_directory_size(ndk_dir)
-
-    # Create a symlink to the NDK usable by this host in the root of the out
-    # directory for convenience.
-    create_ndk_symlink(out_dir)
-
-    package_timer = ndk.timer.Timer()
-    with package_timer:
-        if args.package:
-            print("Packaging NDK...")
-            # NB: Purging of unwanted files (.pyc, Android.bp, etc) happens as
-            # part of packaging. If testing is ever moved to happen before
-            # packaging, ensure that the directory is purged before and after
-            # building the tests.
-            package_path = package_ndk(
-                ndk_dir, out_dir, dist_dir, args.system, args.build_number
-            )
-            packaged_size_bytes = package_path.stat().st_size
-            packaged_size = packaged_size_bytes // (2**20)
-
-    good = True
-    test_timer = ndk.timer.Timer()
-    with test_timer:
-        if args.build_tests:
-            print("Building tests...")
-            purge_unwanted_files(ndk_dir)
-            good = build_ndk_tests(out_dir, dist_dir, args)
-            print()  # Blank line between test results and timing data.
+    tracer = TaskTracer()
+    # The worker processes are shared by the build, packaging and test build
+    # phases.
+    workqueue = create_workqueue(args, tracer)
+    try:
+        build_timer = ndk.timer.Timer()
+        with build_timer:
+            manifest = build_ndk(modules, deps_only, out_dir, dist_dir, args, workqueue)
+        installed_size = manifest.disk_usage_mib()
+
+        # Create a symlink to the NDK usable by this host in the root of the out
+        # directory for convenience.
+        create_ndk_symlink(out_dir)
+
+        package_timer = ndk.timer.Timer()
+        with package_timer:
+            if args.package:
+                print("Packaging NDK...")
+                # NB: Purging of unwanted files (.pyc, Android.bp, etc) happens as
+                # part of packaging. If testing is ever moved to happen before
+                # packaging, ensure that the directory is purged before and after
+                # building the tests.
+                package_path = package_ndk(
+                    manifest,
+                    out_dir,
+                    dist_dir,
+                    args.system,
+                    args.build_number,
+                    workqueue,
+                )
+                packaged_size_bytes = package_path.stat().st_size
+                packaged_size = packaged_size_bytes // (2**20)
+
+        # Keep a record of exactly what was installed (and packaged, since the
+        # unwanted files have been purged if the NDK was packaged).
+        manifest.write(dist_dir / "install_manifest.json")
+
+        good = True
+        test_timer = ndk.timer.Timer()
+        with test_timer:
+            if args.build_tests:
+                print("Building tests...")
+                purge_unwanted_files(manifest)
+                good = build_ndk_tests(out_dir, dist_dir, args, workqueue)
+                print()  # Blank line between test results and timing data.
+    finally:
+        workqueue.terminate()
+        workqueue.join()
 
     total_timer.finish()
 
+    log_dir = dist_dir / "logs"
+    tracer.write_chrome_trace(log_dir / "task_trace.json")
+    trace_summary = tracer.write_summary(log_dir / "task_trace.txt")
+    logging.info("Task trace summary:\n%s", trace_summary.format())
+
     print("")
     print("Installed size: {} MiB".format(installed_size))
     if args.package:
@@ -2551,6 +2809,15 @@ def main() -> None:
     print("Packaging: {}".format(package_timer.duration))
     print("Testing: {}".format(test_timer.duration))
     print("Total: {}".format(total_timer.duration))
+    if trace_summary.queues:
+        print(
+            "Worker utilization: {}".format(
+                ", ".join(f"{q.name} {q.utilization:.0%}" for q in trace_summary.queues)
+            )
+        )
+    if args.profile:
+        print(trace_summary.format())
+    print("Task trace: {}".format(log_dir / "task_trace.json"))
 
     subject = "NDK Build {}!".format("Passed" if good else "Failed")
     body = "Build finished in {}".format(total_timer.duration)
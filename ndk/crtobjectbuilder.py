@@ -14,11 +14,17 @@
 # limitations under the License.
 #
 """Helper class for building CRT objects."""
+import multiprocessing
 import shlex
 import shutil
+import struct
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterator, Optional
 
+import elfnote
 import ndk.config
 from ndk.platforms import ALL_API_LEVELS
 
@@ -26,15 +32,37 @@ from .abis import Abi, abi_to_triple, clang_target, iter_abis_for_api
 from .paths import ANDROID_DIR, NDK_DIR
 
 
+@dataclass
+class CrtObject:
+    """A CRT object to be built for an ABI and API level."""
+
+    dst: Path
+    srcs: list[Path]
+    api: int
+    abi: Abi
+    defines: list[str]
+
+
 class CrtObjectBuilder:
-    """Builder for NDK CRT objects."""
+    """Builder for NDK CRT objects.
+
+    The objects are independent of each other, so they're built in parallel.
+    Each build is a clang process, so threads are enough to keep the CPUs busy.
+    """
 
     PREBUILTS_PATH = ANDROID_DIR / "prebuilts/ndk/platform"
 
-    def __init__(self, llvm_path: Path, build_dir: Path, build_id: int) -> None:
+    def __init__(
+        self,
+        llvm_path: Path,
+        build_dir: Path,
+        build_id: int,
+        jobs: Optional[int] = None,
+    ) -> None:
         self.llvm_path = llvm_path
         self.build_dir = build_dir
         self.build_id = build_id
+        self.jobs = jobs if jobs is not None else multiprocessing.cpu_count()
         self.artifacts: list[tuple[Abi, int, Path]] = []
 
     def llvm_tool(self, tool: str) -> Path:
@@ -83,15 +111,19 @@ class CrtObjectBuilder:
 
         return args
 
-    def check_elf_note(self, obj_file: Path) -> None:
+    @staticmethod
+    def check_elf_note(obj_file: Path, api: int) -> None:
         """Verifies that the object file contains the expected note."""
-        # readelf is a cross platform tool, so arch doesn't matter.
-        readelf = self.llvm_tool("llvm-readelf")
-        out = subprocess.run(
-            [readelf, "--notes", obj_file], check=True, text=True, capture_output=True
-        ).stdout
-        if "Android" not in out:
+        ident = elfnote.read_notes_at(str(obj_file)).android_ident
+        if ident is None:
             raise RuntimeError(f"{obj_file} does not contain NDK ELF note")
+        # The note begins with the API level as an int32. All Android targets
+        # are little endian.
+        (note_api,) = struct.unpack_from("<i", ident)
+        if note_api != api:
+            raise RuntimeError(
+                f"{obj_file} has NDK ELF note for API {note_api}, expected {api}"
+            )
 
     def build_crt_object(
         self,
@@ -108,13 +140,8 @@ class CrtObjectBuilder:
         print(f"Running: {shlex.join(cc_args)}")
         subprocess.check_call(cc_args)
 
-    def build_crt_objects(
-        self,
-        dst_dir: Path,
-        api: int,
-        abi: Abi,
-        build_number: int,
-    ) -> None:
+    def crt_objects(self, dst_dir: Path, api: int, abi: Abi) -> Iterator[CrtObject]:
+        """Yields the CRT objects to build for an ABI and API level."""
         src_dir = ANDROID_DIR / "bionic/libc/arch-common/bionic"
         crt_brand = NDK_DIR / "sources/crt/crtbrand.S"
 
@@ -140,24 +167,35 @@ class CrtObjectBuilder:
         }
 
         for name, srcs in objects.items():
-            dst_path = dst_dir / name
             defs = []
             if name == "crtbegin_static.o":
                 # libc.a is always the latest version, so ignore the API level
                 # setting for crtbegin_static.
                 defs.append("-D_FORCE_CRT_ATFORK")
-            self.build_crt_object(dst_path, srcs, api, abi, build_number, defs)
-            if name.startswith("crtbegin"):
-                self.check_elf_note(dst_path)
-            self.artifacts.append((abi, api, dst_path))
+            yield CrtObject(dst_dir / name, srcs, api, abi, defs)
+
+    def build_object(self, obj: CrtObject) -> None:
+        """Builds a CRT object and verifies it."""
+        self.build_crt_object(
+            obj.dst, obj.srcs, obj.api, obj.abi, self.build_id, obj.defines
+        )
+        if obj.dst.name.startswith("crtbegin"):
+            self.check_elf_note(obj.dst, obj.api)
 
     def build(self) -> None:
         self.artifacts = []
         if self.build_dir.exists():
             shutil.rmtree(self.build_dir)
 
+        objects: list[CrtObject] = []
         for api in ALL_API_LEVELS:
             for abi in iter_abis_for_api(api):
                 dst_dir = self.build_dir / abi_to_triple(abi) / str(api)
                 dst_dir.mkdir(parents=True, exist_ok=True)
-                self.build_crt_objects(dst_dir, api, abi, self.build_id)
+                objects.extend(self.crt_objects(dst_dir, api, abi))
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            # Consume the results so the first failure is raised.
+            list(executor.map(self.build_object, objects))
+
+        self.artifacts = [(obj.abi, obj.api, obj.dst) for obj in objects]
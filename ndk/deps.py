@@ -14,10 +14,11 @@
 # limitations under the License.
 #
 """Performs dependency tracking for ndk.builds modules."""
-from typing import Dict, Iterable, List, Set
+from typing import Dict, Iterable, List, Optional, Set
 
 import ndk.graph
 from ndk.builds import Module
+from ndk.durations import DurationHistory
 
 
 class CyclicDependencyError(RuntimeError):
@@ -59,10 +60,32 @@ class DependencyManager:
     that are no longer waiting on their dependencies. This is updated whenever
     the DependencyManager is informated of a module build being completed via
     DependencyManager.complete().
+
+    A module's install may be tracked separately from its build. When the
+    caller reports the end of a module's build with complete_build(), the
+    dependents that list it in their build_output_deps become buildable, and
+    the module itself is handed out by get_installable() once all of its
+    dependencies have been installed. complete() reports the end of the
+    install, or of both phases for callers that don't separate them.
+
+    Buildable modules are handed out in order of the length of the longest
+    chain of builds that depends on them (the critical path), using the
+    durations of previous builds. Starting the modules at the head of long
+    chains first shortens the build as a whole.
     """
 
-    def __init__(self, all_modules: Iterable[Module]) -> None:
-        """Initializes a DependencyManager."""
+    def __init__(
+        self,
+        all_modules: Iterable[Module],
+        durations: Optional[DurationHistory] = None,
+    ) -> None:
+        """Initializes a DependencyManager.
+
+        Args:
+            all_modules: The modules to build.
+            durations: Build durations of previous runs, keyed by module name.
+                If not given, every module is assumed to take the same time.
+        """
         if not all_modules:
             raise ValueError
         prove_acyclic(all_modules)
@@ -74,6 +97,14 @@ class DependencyManager:
         # dict. An empty value indicates that the module is now buildable.
         self.blocked_modules = {m: set(m.deps) for m in all_modules if m.deps}
 
+        # Modules that have been built but are still waiting for some of their
+        # dependencies to be installed before they can be installed, by name.
+        # The module objects are the ones passed to complete_build(), since
+        # those may hold state from the build that the install needs.
+        self.install_blocked_modules: Dict[str, Module] = {}
+        self.installable_modules: Set[Module] = set()
+        self.installed: Set[str] = set()
+
         # Reverse map from a module to all of its dependents used to speed up
         # lookups.
         self.deps_to_modules: Dict[str, List[Module]] = {
@@ -83,31 +114,102 @@ class DependencyManager:
             for dep in module.deps:
                 self.deps_to_modules[dep].append(module)
 
-    def get_buildable(self) -> Set[Module]:
-        """Returns a set of modules that are ready to be built.
+        self.priorities: Dict[Module, float] = {}
+        for module in all_modules:
+            self._compute_priority(module, durations)
+
+    def _compute_priority(
+        self, module: Module, durations: Optional[DurationHistory]
+    ) -> float:
+        if module in self.priorities:
+            return self.priorities[module]
+        duration = 1.0 if durations is None else durations.estimate(module.name)
+        downstream = [
+            self._compute_priority(m, durations)
+            for m in self.deps_to_modules[module.name]
+        ]
+        priority = duration + max(downstream, default=0.0)
+        self.priorities[module] = priority
+        return priority
+
+    def priority(self, module: Module) -> float:
+        """Returns the length of the critical path that starts at module.
+
+        This is the estimated time from the start of the module's build to the
+        end of the slowest chain of modules that depends on it.
+        """
+        return self.priorities[module]
+
+    def get_buildable(self) -> List[Module]:
+        """Returns the modules that are ready to be built.
+
+        The modules are sorted by priority, highest first.
 
         Retrieving the list of buildable modules removes them from the
         buildable_modules set. This is done because it is assumed that the
         caller will use the retrieved set to start those builds and the
         buildable set should not include active builds.
         """
-        buildable = self.buildable_modules
+        buildable = sorted(
+            self.buildable_modules, key=lambda m: (-self.priorities[m], m.name)
+        )
         self.buildable_modules = set()
         return buildable
 
+    def get_installable(self) -> List[Module]:
+        """Returns the built modules that are ready to be installed.
+
+        As with get_buildable(), the modules are sorted by priority and are
+        removed from the installable_modules set.
+        """
+        installable = sorted(
+            self.installable_modules, key=lambda m: (-self.priorities[m], m.name)
+        )
+        self.installable_modules = set()
+        return installable
+
+    def _unblock(self, dependent: Module, name: str) -> None:
+        blocked = self.blocked_modules.get(dependent)
+        if blocked is None or name not in blocked:
+            return
+        blocked.remove(name)
+        if blocked:
+            # Still blocked on other dependencies.
+            return
+        del self.blocked_modules[dependent]
+        self.buildable_modules.add(dependent)
+
+    def complete_build(self, module: Module) -> None:
+        """Signals that the given module has been built but not installed.
+
+        Updates the list of now buildable modules, and the list of
+        installable modules.
+
+        Args:
+            module: The module that has finished building.
+        """
+        for dependent in self.deps_to_modules[module.name]:
+            if module.name in dependent.build_output_deps:
+                self._unblock(dependent, module.name)
+        if module.deps <= self.installed:
+            self.installable_modules.add(module)
+        else:
+            self.install_blocked_modules[module.name] = module
+
     def complete(self, module: Module) -> None:
         """Signals that the given module has complete building.
 
         Removes the module from the list of buildable modules and updates the
-        list of now buildable modules.
+        lists of now buildable and installable modules.
 
         Args:
-            module: The module that has finished building.
+            module: The module that has finished building and installing.
         """
-        for dependent in self.deps_to_modules[module.name]:
-            self.blocked_modules[dependent].remove(module.name)
-            if self.blocked_modules[dependent]:
-                # Still blocked on other dependencies.
-                continue
-            del self.blocked_modules[dependent]
-            self.buildable_modules.add(dependent)
+        dependents = self.deps_to_modules[module.name]
+        self.installed.add(module.name)
+        for dependent in dependents:
+            self._unblock(dependent, module.name)
+            built = self.install_blocked_modules.get(dependent.name)
+            if built is not None and built.deps <= self.installed:
+                del self.install_blocked_modules[dependent.name]
+                self.installable_modules.add(built)
@@ -0,0 +1,104 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Historical task durations for cost-aware scheduling."""
+from __future__ import annotations
+
+import statistics
+from pathlib import Path
+from typing import Optional
+
+import ndk.jsonfile
+
+
+class DurationHistory:
+    """Durations of previous runs of named tasks.
+
+    The durations are used as work queue priorities so that the slowest tasks
+    are started first. Each recorded duration is blended with the previous one
+    so that a single slow or fast run does not reorder everything.
+    """
+
+    VERSION = 1
+
+    # Weight given to the newest sample when updating a duration.
+    SMOOTHING = 0.5
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path
+        self.durations: dict[str, float] = {}
+        self._default: Optional[float] = None
+
+    @classmethod
+    def load(cls, path: Path) -> DurationHistory:
+        """Loads the history at path.
+
+        A missing or unreadable file results in an empty history, since the
+        history is only used to improve scheduling.
+        """
+        history = cls(path)
+        data = ndk.jsonfile.load_versioned(path, cls.VERSION, "duration history")
+        if data is None:
+            return history
+        durations = data.get("durations", {})
+        if isinstance(durations, dict):
+            history.durations = {
+                str(k): float(v)
+                for k, v in durations.items()
+                if isinstance(v, (int, float))
+            }
+        return history
+
+    def save(self) -> None:
+        """Writes the history back to the file it was loaded from."""
+        if self.path is None:
+            return
+        ndk.jsonfile.save_versioned(
+            self.path,
+            self.VERSION,
+            {"durations": self.durations},
+            indent=0,
+            sort_keys=True,
+        )
+
+    def get(self, key: str) -> Optional[float]:
+        """Returns the recorded duration for the task, if any."""
+        return self.durations.get(key)
+
+    def estimate(self, key: str) -> float:
+        """Returns the expected duration of the task in seconds.
+
+        Tasks that have never been recorded are assumed to take the median of
+        the recorded durations. If nothing has been recorded every task is
+        assumed to take one second, so that priorities that add up durations
+        (such as critical path lengths) still count tasks.
+        """
+        duration = self.durations.get(key)
+        if duration is not None:
+            return duration
+        if self._default is None:
+            if self.durations:
+                self._default = statistics.median(self.durations.values())
+            else:
+                self._default = 1.0
+        return self._default
+
+    def record(self, key: str, duration: float) -> None:
+        """Records a new duration for the task."""
+        previous = self.durations.get(key)
+        if previous is not None:
+            duration = self.SMOOTHING * duration + (1 - self.SMOOTHING) * previous
+        self.durations[key] = duration
+        self._default = None
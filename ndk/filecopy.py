@@ -0,0 +1,137 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Copies install trees using copy-on-write clones where possible.
+
+Installing the NDK copies several GB of prebuilts into the out directory. When
+the source and destination are on a filesystem that supports reflinks (btrfs,
+XFS, bcachefs, ...), copy_file() clones the file instead, which shares the data
+blocks until either copy is modified. Otherwise it falls back to a normal copy.
+
+Hard links are deliberately not used. Several modules modify installed files in
+place (strip, generated headers), which would silently modify the prebuilts too.
+"""
+from __future__ import annotations
+
+import errno
+import fnmatch
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+
+StrPath = Union[str, "os.PathLike[str]"]
+IgnoreFunction = Callable[[str, list[str]], set[str]]
+
+# _IOW(0x94, 9, int) from linux/fs.h.
+FICLONE = 0x40049409
+
+# Errors from FICLONE that mean no file can be cloned between the two devices.
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOSYS}
+
+# (source device, destination device) pairs that can't be cloned between.
+_no_reflink_devices: set[tuple[int, int]] = set()
+
+
+def reflink(src: StrPath, dst: StrPath) -> bool:
+    """Creates dst as a copy-on-write clone of src.
+
+    Only new files are cloned. If dst already exists it is left alone.
+
+    Returns:
+        True if dst was created, False if the file could not be cloned.
+    """
+    if sys.platform != "linux":
+        return False
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    devices = (os.stat(src).st_dev, os.stat(os.path.dirname(dst) or ".").st_dev)
+    if devices in _no_reflink_devices:
+        return False
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return False
+    try:
+        with open(src, "rb") as src_file:
+            fcntl.ioctl(dst_fd, FICLONE, src_file.fileno())
+    except OSError as ex:
+        os.close(dst_fd)
+        os.unlink(dst)
+        if ex.errno in _UNSUPPORTED_ERRNOS:
+            _no_reflink_devices.add(devices)
+        return False
+    os.close(dst_fd)
+    return True
+
+
+def copy_file(src: StrPath, dst: StrPath, *, follow_symlinks: bool = True) -> StrPath:
+    """Copies a file like shutil.copy2, cloning it if possible.
+
+    This can be used as the copy_function of shutil.copytree.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if (not follow_symlinks and os.path.islink(src)) or not reflink(src, dst):
+        return shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def copy_tree(
+    src: Path,
+    dst: Path,
+    *,
+    symlinks: bool = False,
+    ignore: Optional[IgnoreFunction] = None,
+    dirs_exist_ok: bool = False,
+) -> Path:
+    """Copies a directory like shutil.copytree, cloning files if possible."""
+    shutil.copytree(
+        src,
+        dst,
+        symlinks=symlinks,
+        ignore=ignore,
+        copy_function=copy_file,
+        dirs_exist_ok=dirs_exist_ok,
+    )
+    return dst
+
+
+def ignore_paths(root: Path, patterns: Iterable[str]) -> IgnoreFunction:
+    """Returns a shutil.copytree ignore function that skips the given paths.
+
+    Unlike shutil.ignore_patterns, the patterns match the path relative to the
+    root of the copy, so "lib/cmake" skips only that directory, and
+    "lib/clang/*/lib/linux" skips that directory of every clang version.
+
+    Args:
+        root: The source directory of the copy.
+        patterns: fnmatch patterns of the paths to skip, relative to root and
+            using / as the separator.
+    """
+    patterns = list(patterns)
+
+    def ignore(directory: str, names: list[str]) -> set[str]:
+        parent = Path(directory).relative_to(root)
+        ignored = set()
+        for name in names:
+            path = (parent / name).as_posix()
+            if any(fnmatch.fnmatchcase(path, p) for p in patterns):
+                ignored.add(name)
+        return ignored
+
+    return ignore
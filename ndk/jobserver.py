@@ -0,0 +1,171 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A GNU make jobserver shared by many concurrent builds.
+
+The jobserver is a pool of tokens, one per job that may run at once. A process
+must hold a token for each job it runs, and returns the tokens when the jobs
+finish. Make implements the client side of this protocol: given the file
+descriptors of the pool in MAKEFLAGS, make (and every make it runs) takes a
+token from the pool before starting each job after the first.
+
+The pool is a named pipe rather than an anonymous one so that processes that
+weren't forked from the one that created it, such as work queue workers started
+earlier, can open it too. Each client holds one token for as long as it is open,
+which stands for make's implicit token. That way the number of jobs running
+across all clients never exceeds the number of tokens, however many clients
+there are.
+
+Tools that can't be jobserver clients, such as ninja, are given a job count for
+their whole run instead. So that one such build can't starve the others, it is
+only given its fair share of the free tokens: the number of tokens divided by
+the number of connected clients.
+
+Named pipes are not available on Windows, so the jobserver is POSIX only.
+"""
+from __future__ import annotations
+
+import math
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Mapping, Optional
+
+TOKEN = b"+"
+
+# The directory next to the pipe that has a file for each connected client.
+CLIENTS_DIR = "clients"
+
+
+class JobServerClient:
+    """A connection to a jobserver, holding at least one token."""
+
+    def __init__(self, path: Path, jobs: int) -> None:
+        """Connects to the jobserver whose pipe is at path.
+
+        Args:
+            path: The jobserver's named pipe.
+            jobs: The number of tokens in the jobserver.
+        """
+        self.jobs = jobs
+        # Opening the read end first would block until there is a writer, but
+        # the jobserver always has the pipe open for writing.
+        self.read_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        os.set_blocking(self.read_fd, True)
+        self.write_fd = os.open(path, os.O_WRONLY)
+        self.tokens = 0
+        fd, client_file = tempfile.mkstemp(dir=path.parent / CLIENTS_DIR)
+        os.close(fd)
+        self.client_file = Path(client_file)
+
+    @property
+    def pass_fds(self) -> tuple[int, int]:
+        """The file descriptors that must be passed to make."""
+        return self.read_fd, self.write_fd
+
+    def env(self, base: Optional[Mapping[str, str]] = None) -> dict[str, str]:
+        """Returns an environment that makes make a client of the jobserver.
+
+        Make must not also be given a -j argument, or it ignores the jobserver.
+        """
+        env = dict(os.environ if base is None else base)
+        env["MAKEFLAGS"] = f"-j --jobserver-auth={self.read_fd},{self.write_fd}"
+        return env
+
+    def acquire(self) -> None:
+        """Waits for a token."""
+        if os.read(self.read_fd, 1):
+            self.tokens += 1
+
+    def fair_share(self) -> int:
+        """Returns the most tokens acquire_available will hold."""
+        clients = max(1, len(os.listdir(self.client_file.parent)))
+        return max(1, math.ceil(self.jobs / clients))
+
+    def acquire_available(self) -> int:
+        """Takes the tokens that are free now, without waiting.
+
+        This is for tools that can't be jobserver clients. They are given a job
+        count for their whole run instead. At most fair_share() tokens are
+        held, so that the other clients can still get tokens while the tool
+        runs.
+
+        Returns:
+            The number of tokens held.
+        """
+        wanted = self.fair_share() - self.tokens
+        if wanted <= 0:
+            return self.tokens
+        os.set_blocking(self.read_fd, False)
+        try:
+            self.tokens += len(os.read(self.read_fd, wanted))
+        except BlockingIOError:
+            pass
+        finally:
+            os.set_blocking(self.read_fd, True)
+        return self.tokens
+
+    def close(self) -> None:
+        """Returns the tokens held and disconnects from the jobserver."""
+        if self.tokens:
+            os.write(self.write_fd, TOKEN * self.tokens)
+            self.tokens = 0
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        self.client_file.unlink()
+
+
+class JobServer:
+    """A jobserver with a fixed number of tokens.
+
+    The jobserver is a context manager: the pool exists from when the context is
+    entered until it is exited. The object may be passed to other processes
+    while it exists.
+    """
+
+    def __init__(self, jobs: int) -> None:
+        self.jobs = jobs
+        self.path: Optional[Path] = None
+        # Keeps the pipe, and so the tokens in it, alive. Only valid in the
+        # process that entered the context.
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> JobServer:
+        self.path = Path(tempfile.mkdtemp(prefix="ndk-jobserver-")) / "fifo"
+        os.mkfifo(self.path, 0o600)
+        (self.path.parent / CLIENTS_DIR).mkdir()
+        self._fd = os.open(self.path, os.O_RDWR)
+        os.write(self._fd, TOKEN * self.jobs)
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        assert self.path is not None and self._fd is not None
+        os.close(self._fd)
+        shutil.rmtree(self.path.parent)
+        self.path = None
+        self._fd = None
+
+    @contextmanager
+    def client(self) -> Iterator[JobServerClient]:
+        """Connects to the jobserver, waiting for a token first."""
+        assert self.path is not None
+        client = JobServerClient(self.path, self.jobs)
+        try:
+            client.acquire()
+            yield client
+        finally:
+            client.close()
@@ -0,0 +1,109 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Reading and writing the JSON files that the build keeps between runs.
+
+Files are written to a temporary file that then replaces the original, so an
+interrupted build never leaves a truncated file behind. Versioned files record
+the format version they were written with, and a file with a different version
+is treated like a missing one.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Iterator, Optional, TextIO
+
+
+def logger() -> logging.Logger:
+    """Returns the module logger."""
+    return logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def atomic_write(path: Path) -> Iterator[TextIO]:
+    """Opens a text file that replaces path once it has been written.
+
+    The parent directory of path is created if needed. Each write uses its own
+    temporary file, so processes may write the same path concurrently. The last
+    one to finish wins. If the caller raises, path is left unchanged.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with tmp_path.open("w", encoding="utf-8") as output_file:
+            yield output_file
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def write_json(path: Path, data: Any, **kwargs: Any) -> None:
+    """Atomically writes data to path as JSON.
+
+    Args:
+        path: The file to write.
+        data: The JSON serializable data.
+        kwargs: Passed to json.dump.
+    """
+    with atomic_write(path) as output_file:
+        json.dump(data, output_file, **kwargs)
+
+
+def load_versioned(
+    path: Path, version: int, description: str
+) -> Optional[dict[str, Any]]:
+    """Loads a JSON object that was written by save_versioned.
+
+    Args:
+        path: The file to load.
+        version: The format version the caller understands.
+        description: What the file is, for the warning logged if it can't be
+            read.
+
+    Returns:
+        The object, or None if the file is missing, unreadable, not an object,
+        or has a different version. The caller must still validate the fields
+        it uses.
+    """
+    try:
+        with path.open(encoding="utf-8") as input_file:
+            data = json.load(input_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as ex:
+        logger().warning("Ignoring unreadable %s %s: %s", description, path, ex)
+        return None
+    if not isinstance(data, dict) or data.get("version") != version:
+        return None
+    return data
+
+
+def save_versioned(
+    path: Path, version: int, data: dict[str, Any], **kwargs: Any
+) -> None:
+    """Atomically writes a JSON object tagged with its format version.
+
+    Args:
+        path: The file to write.
+        version: The format version of data.
+        data: The fields of the object.
+        kwargs: Passed to json.dump.
+    """
+    write_json(path, {"version": version, **data}, **kwargs)
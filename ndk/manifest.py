@@ -0,0 +1,276 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""The manifest of an installed NDK.
+
+The installed NDK is walked once after the build. The size report, symlink
+validation, purging of unwanted files and packaging all use the manifest rather
+than walking the tree again, and the manifest is kept as a build artifact.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import multiprocessing
+import os
+import posixpath
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+import ndk.jsonfile
+from ndk.archive import ArchiveEntry, walk_archive_entries
+
+# Maximum number of symlinks followed while resolving a path, as for ELOOP.
+MAX_SYMLINK_DEPTH = 40
+
+
+class ManifestError(RuntimeError):
+    """A symlink in the manifest can't be resolved within it."""
+
+
+@dataclass
+class ManifestEntry:
+    """A file, directory or symlink in the manifest.
+
+    Attributes:
+        path: Path relative to the root of the manifest, using / as the
+            separator.
+        mode: The st_mode of the file (not of a symlink's target).
+        size: Size of the file in bytes.
+        mtime: Modification time of the file.
+        link_target: Target of the symlink, or None if this isn't a symlink.
+        sha256: Hash of the file's contents, if it has been computed.
+        allocated: Bytes of storage used by the file, as reported by du.
+        inode: (device, inode) of the file, to count hard links once.
+    """
+
+    path: str
+    mode: int
+    size: int
+    mtime: float
+    link_target: Optional[str] = None
+    sha256: Optional[str] = None
+    allocated: int = field(default=0, repr=False)
+    inode: tuple[int, int] = field(default=(0, 0), repr=False)
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self) -> bool:
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_symlink(self) -> bool:
+        return stat.S_ISLNK(self.mode)
+
+    def to_json(self) -> dict[str, object]:
+        data: dict[str, object] = {
+            "path": self.path,
+            "mode": f"{self.mode:o}",
+            "size": self.size,
+        }
+        if self.link_target is not None:
+            data["target"] = self.link_target
+        if self.sha256 is not None:
+            data["sha256"] = self.sha256
+        return data
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as input_file:
+        while chunk := input_file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InstallManifest:
+    """Every file, directory and symlink in an installed NDK."""
+
+    VERSION = 1
+
+    def __init__(self, root: Path, entries: List[ManifestEntry]) -> None:
+        self.root = root
+        self.entries = {e.path: e for e in entries}
+
+    @classmethod
+    def scan(cls, root: Path) -> InstallManifest:
+        """Walks the directory tree at root.
+
+        Entries are listed top down, with the entries of each directory sorted
+        by name. Symlinks are not followed.
+        """
+        entries: List[ManifestEntry] = []
+
+        def scan_dir(directory: Path, prefix: str) -> None:
+            with os.scandir(directory) as it:
+                dir_entries = sorted(it, key=lambda e: e.name)
+            for dir_entry in dir_entries:
+                info = dir_entry.stat(follow_symlinks=False)
+                path = prefix + dir_entry.name
+                link_target = None
+                if stat.S_ISLNK(info.st_mode):
+                    link_target = os.readlink(dir_entry.path)
+                entries.append(
+                    ManifestEntry(
+                        path,
+                        info.st_mode,
+                        info.st_size,
+                        info.st_mtime,
+                        link_target,
+                        allocated=getattr(info, "st_blocks", 0) * 512 or info.st_size,
+                        inode=(info.st_dev, info.st_ino),
+                    )
+                )
+                if stat.S_ISDIR(info.st_mode):
+                    scan_dir(Path(dir_entry.path), path + "/")
+
+        scan_dir(root, "")
+        return cls(root, entries)
+
+    def __iter__(self) -> Iterator[ManifestEntry]:
+        return iter(self.entries.values())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def path_of(self, entry: ManifestEntry) -> Path:
+        """Returns the path of an entry."""
+        return self.root / entry.path
+
+    def disk_usage_mib(self) -> int:
+        """Returns the storage used by the tree in MiB, as du -sm would."""
+        allocated = 0
+        seen = set()
+        for entry in self:
+            if entry.inode in seen:
+                continue
+            seen.add(entry.inode)
+            allocated += entry.allocated
+        return math.ceil(allocated / 2**20)
+
+    def remove(self, predicate: Callable[[ManifestEntry], bool]) -> List[str]:
+        """Deletes the files (not directories) that match the predicate.
+
+        Returns:
+            The paths of the removed entries.
+        """
+        removed = [e.path for e in self if not e.is_dir and predicate(e)]
+        for path in removed:
+            (self.root / path).unlink()
+            del self.entries[path]
+        return removed
+
+    def resolve(self, entry: ManifestEntry) -> str:
+        """Resolves a symlink within the manifest.
+
+        Like Path.resolve(), each component of the target is resolved in turn,
+        and components that are themselves symlinks are followed.
+
+        Returns:
+            The path of the entry the symlink resolves to, relative to the root.
+            The root itself is "".
+
+        Raises:
+            ManifestError: The target is absolute, does not exist or is not
+                inside the root.
+        """
+        assert entry.link_target is not None
+        return self._resolve_link(entry, 0)
+
+    def _resolve_link(self, entry: ManifestEntry, depth: int) -> str:
+        assert entry.link_target is not None
+        if depth > MAX_SYMLINK_DEPTH:
+            raise ManifestError(f"Symlink {self.path_of(entry)} has a symlink loop")
+        if posixpath.isabs(entry.link_target):
+            raise ManifestError(
+                f"Symlink {self.path_of(entry)} points to absolute path "
+                f"{entry.link_target}"
+            )
+        current = posixpath.dirname(entry.path)
+        for part in entry.link_target.split("/"):
+            if part in ("", "."):
+                continue
+            if part == "..":
+                if not current:
+                    raise ManifestError(
+                        f"Symlink {self.path_of(entry)} targets "
+                        f"{entry.link_target} outside NDK {self.root}"
+                    )
+                current = posixpath.dirname(current)
+                continue
+            current = posixpath.join(current, part)
+            target = self.entries.get(current)
+            if target is None:
+                raise ManifestError(
+                    f"Symlink {self.path_of(entry)} targets non-existent "
+                    f"{self.root / current}"
+                )
+            if target.is_symlink:
+                current = self._resolve_link(target, depth + 1)
+        return current
+
+    def archive_entries(self, preserve_symlinks: bool) -> List[ArchiveEntry]:
+        """Returns the entries for archiving the root directory.
+
+        The archive paths start with the name of the root directory.
+        """
+        name = self.root.name
+        info = self.root.stat()
+        entries = [ArchiveEntry(self.root, name, info.st_mode, info.st_mtime)]
+        for entry in self:
+            arcname = f"{name}/{entry.path}"
+            if entry.is_symlink and not preserve_symlinks:
+                # The target might be a directory, so walk it.
+                entries.extend(walk_archive_entries(self.root.parent, [arcname], False))
+                continue
+            entries.append(
+                ArchiveEntry(
+                    self.path_of(entry),
+                    arcname,
+                    entry.mode,
+                    entry.mtime,
+                    entry.link_target if preserve_symlinks else None,
+                )
+            )
+        return entries
+
+    def hash_files(self, jobs: Optional[int] = None) -> None:
+        """Computes the hash of every file that doesn't have one yet."""
+        files = [e for e in self if e.is_file and e.sha256 is None]
+        with ThreadPoolExecutor(jobs or multiprocessing.cpu_count()) as executor:
+            for entry, digest in zip(
+                files, executor.map(lambda e: _hash_file(self.path_of(e)), files)
+            ):
+                entry.sha256 = digest
+
+    def write(self, path: Path) -> None:
+        """Writes the manifest as JSON, hashing the files first."""
+        self.hash_files()
+        ndk.jsonfile.save_versioned(
+            path,
+            self.VERSION,
+            {
+                "root": self.root.name,
+                "disk_usage_mib": self.disk_usage_mib(),
+                "entries": [e.to_json() for e in self],
+            },
+            indent=0,
+        )
@@ -20,6 +20,7 @@ import os
 import subprocess
 from pathlib import Path
 from subprocess import CompletedProcess
+from typing import Collection, Mapping, Optional
 
 
 def make_build_command(ndk_path: Path, build_flags: list[str]) -> list[str]:
@@ -30,12 +31,27 @@ def make_build_command(ndk_path: Path, build_flags: list[str]) -> list[str]:
     return cmd
 
 
-def build(ndk_path: Path, build_flags: list[str]) -> CompletedProcess[str]:
-    """Invokes ndk-build with the given arguments."""
+def build(
+    ndk_path: Path,
+    build_flags: list[str],
+    env: Optional[Mapping[str, str]] = None,
+    pass_fds: Collection[int] = (),
+) -> CompletedProcess[str]:
+    """Invokes ndk-build with the given arguments.
+
+    Args:
+        ndk_path: Path to the NDK.
+        build_flags: Arguments to ndk-build.
+        env: Environment for ndk-build, if not the current one.
+        pass_fds: File descriptors to keep open in ndk-build, such as those of
+            a jobserver.
+    """
     return subprocess.run(
         make_build_command(ndk_path, build_flags),
         check=False,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         encoding="utf-8",
+        env=env,
+        pass_fds=pass_fds,
     )
@@ -0,0 +1,147 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Incremental generation of the NDK's NOTICE files.
+
+A NOTICE file is the sorted concatenation of the distinct license texts of a set
+of notice files. The manifest records the hash of each notice file along with
+its size and modification time, so unchanged files are not read again, and the
+set of hashes each NOTICE file was written from, so it is only rewritten when
+that set changes.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+import ndk.jsonfile
+
+
+def _stat_key(path: Path) -> tuple[int, int]:
+    info = path.stat()
+    return info.st_mtime_ns, info.st_size
+
+
+class NoticeManifest:
+    """Hashes of notice files and of the NOTICE files written from them.
+
+    Notice files may be hashed from one thread while the build runs and the
+    NOTICE files written from another afterwards.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path
+        # Maps notice file paths to [mtime_ns, size, digest].
+        self.files: dict[str, list[Any]] = {}
+        # Maps NOTICE file paths to [mtime_ns, size, key].
+        self.outputs: dict[str, list[Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> NoticeManifest:
+        """Loads the manifest at path.
+
+        A missing or unreadable file results in an empty manifest, which just
+        means that every notice is read again.
+        """
+        manifest = cls(path)
+        data = ndk.jsonfile.load_versioned(path, cls.VERSION, "notice manifest")
+        if data is None:
+            return manifest
+        for attr in ("files", "outputs"):
+            entries = data.get(attr, {})
+            if isinstance(entries, dict):
+                setattr(
+                    manifest,
+                    attr,
+                    {
+                        str(k): v
+                        for k, v in entries.items()
+                        if isinstance(v, list) and len(v) == 3
+                    },
+                )
+        return manifest
+
+    def save(self) -> None:
+        """Writes the manifest back to the file it was loaded from."""
+        if self.path is None:
+            return
+        with self._lock:
+            ndk.jsonfile.save_versioned(
+                self.path,
+                self.VERSION,
+                {"files": self.files, "outputs": self.outputs},
+                indent=0,
+                sort_keys=True,
+            )
+
+    def digest(self, notice: Path) -> str:
+        """Returns the hash of the text of a notice file.
+
+        The file is only read if it changed since it was last hashed.
+        """
+        mtime_ns, size = _stat_key(notice)
+        with self._lock:
+            entry = self.files.get(str(notice))
+        if entry is not None and entry[:2] == [mtime_ns, size]:
+            return str(entry[2])
+        # Hash the decoded text so that files which only differ in line
+        # endings are still considered duplicates.
+        text = notice.read_text(encoding="utf-8")
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            self.files[str(notice)] = [mtime_ns, size, digest]
+        return digest
+
+    def hash_all(self, notices: Iterable[Path]) -> None:
+        """Hashes every notice file so writing NOTICE files later is cheap."""
+        for notice in notices:
+            self.digest(notice)
+
+    def write_notice_file(self, path: Path, notices: Iterable[Path]) -> bool:
+        """Writes a NOTICE file containing each distinct license text once.
+
+        Returns:
+            True if the file was written, False if it was already up to date.
+        """
+        # Using the hashes here so we can perform some amount of duplicate
+        # reduction. In a lot of cases there will be minor differences that
+        # cause lots of "duplicates", but might as well catch what we can.
+        unique: dict[str, Path] = {}
+        for notice in sorted(set(notices)):
+            unique.setdefault(self.digest(notice), notice)
+        key = hashlib.sha256("\n".join(sorted(unique)).encode("utf-8")).hexdigest()
+
+        with self._lock:
+            recorded = self.outputs.get(str(path))
+        if recorded is not None and recorded[2] == key:
+            try:
+                if list(_stat_key(path)) == recorded[:2]:
+                    return False
+            except FileNotFoundError:
+                pass
+
+        licenses = [p.read_text(encoding="utf-8") for p in unique.values()]
+        with ndk.jsonfile.atomic_write(path) as output_file:
+            # Sorting the contents here to try to make things deterministic.
+            output_file.write(os.linesep.join(sorted(licenses)))
+        with self._lock:
+            self.outputs[str(path)] = [*_stat_key(path), key]
+        return True
@@ -41,6 +41,8 @@ import ndk.test.builder
 import ndk.test.buildtest.case
 import ndk.test.ui
 import ndk.ui
+from ndk.durations import DurationHistory
+from ndk.tasktrace import TaskTracer
 from ndk.test.devices import (
     Device,
     DeviceConfig,
@@ -211,9 +213,15 @@ def push_tests_to_devices(
 
 
 def run_test(worker: Worker, test: TestRun) -> TestResult:
-    device = worker.data[0]
+    device, group = worker.data
+    # Runs queued with --any-capable-device are taken by whichever capable
+    # device group is free first.
+    test.device_group = group
     worker.status = f"Running {test.name}"
-    return test.run(device)
+    start_time = time.monotonic()
+    result = test.run(device)
+    result.duration = time.monotonic() - start_time
+    return result
 
 
 def print_test_stats(
@@ -272,15 +280,24 @@ def pair_test_runs(
     groups_for_config: Mapping[BuildConfiguration, Iterable[DeviceShardingGroup]],
     report: Report[DeviceShardingGroup],
     fleet: DeviceFleet,
+    any_capable_device: bool = False,
 ) -> List[TestRun]:
-    """Creates a TestRun object for each device/test case pairing."""
+    """Creates a TestRun object for each device/test case pairing.
+
+    If any_capable_device is True, only one TestRun is created for each test
+    case. It is paired with the first capable device group, but may be run by
+    any of them.
+    """
     test_runs = []
     for config, test_cases in test_groups.items():
         if not test_cases:
             continue
 
         report_skipped_tests_for_missing_devices(report, config, fleet, test_cases)
-        for group in groups_for_config[config]:
+        groups = sorted(groups_for_config[config], key=str)
+        if any_capable_device:
+            groups = groups[:1]
+        for group in groups:
             test_runs.extend([TestRun(tc, group) for tc in test_cases])
     return test_runs
 
@@ -308,6 +325,7 @@ def wait_for_results(
     report: Report[DeviceShardingGroup],
     workqueue: ShardingWorkQueue[TestResult, Device],
     printer: Printer,
+    durations: Optional[DurationHistory] = None,
 ) -> None:
     console = ndk.ansi.get_console()
     ui = ndk.test.ui.get_test_progress_ui(console, workqueue)
@@ -321,6 +339,8 @@ def wait_for_results(
                 for result in results:
                     suite = result.test.build_system
                     report.add_result(suite, result)
+                    if durations is not None and result.duration is not None:
+                        durations.record(str(result.test), result.duration)
                     if verbose or result.failed():
                         printer.print_result(result)
                 ui.draw()
@@ -488,6 +508,16 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Package the built tests. Requires --rebuild or --build-only.",
     )
+    build_options.add_argument(
+        "--no-build-cache",
+        action="store_false",
+        dest="build_cache",
+        help=(
+            "Build every test. By default, tests that have not changed since "
+            "they were last built with the same NDK are restored from the test "
+            "build cache next to TEST_DIR instead."
+        ),
+    )
 
     run_options = parser.add_argument_group("Test Run Options")
     run_options.add_argument(
@@ -500,6 +530,16 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Abort if any devices specified by the config are not available.",
     )
+    run_options.add_argument(
+        "--any-capable-device",
+        action="store_true",
+        help=(
+            "Run each test once, on whichever device group that can run it is "
+            "free first, rather than once on every device group that can run "
+            "it. Finishes sooner on a fleet of mixed devices, but each test is "
+            "only run on one of them."
+        ),
+    )
 
     display_options = parser.add_argument_group("Display Options")
     display_options.add_argument(
@@ -612,8 +652,18 @@ def unzip_ndk(ndk_path: Path) -> Path:
         shutil.rmtree(ndk_dir)
 
 
+def write_task_trace(tracer: TaskTracer, test_dir: Path) -> None:
+    """Writes the task trace and its summary to the test directory."""
+    tracer.write_chrome_trace(test_dir / "task_trace.json")
+    summary = tracer.write_summary(test_dir / "task_trace.txt")
+    logger().info("Task trace summary:\n%s", summary.format())
+
+
 def rebuild_tests(
-    args: argparse.Namespace, results: Results, test_spec: TestSpec
+    args: argparse.Namespace,
+    results: Results,
+    test_spec: TestSpec,
+    workqueue: WorkQueue,
 ) -> bool:
     build_printer = StdoutPrinter(
         show_all=args.show_all,
@@ -627,8 +677,13 @@ def rebuild_tests(
             test_filter=args.filter,
             clean=args.clean,
             package_path=args.dist_dir / "ndk-tests" if args.package else None,
+            build_cache_dir=args.test_dir.parent / "test-build-cache"
+            if args.build_cache
+            else None,
+        )
+        builder = ndk.test.builder.TestBuilder(
+            test_spec, test_options, build_printer, workqueue=workqueue
         )
-        builder = ndk.test.builder.TestBuilder(test_spec, test_options, build_printer)
         report = builder.build()
 
     if report.num_tests == 0:
@@ -644,6 +699,21 @@ def rebuild_tests(
 
 
 def run_tests(args: argparse.Namespace) -> Results:
+    tracer = TaskTracer()
+    # The worker processes are shared by the build, device discovery and push
+    # phases. The test runs need a pool of workers for each device, so those
+    # can't be taken from this work queue.
+    workqueue = WorkQueue(tracer=tracer)
+    try:
+        return run_tests_with_workqueue(args, workqueue, tracer)
+    finally:
+        workqueue.terminate()
+        workqueue.join()
+
+
+def run_tests_with_workqueue(
+    args: argparse.Namespace, workqueue: WorkQueue, tracer: TaskTracer
+) -> Results:
     results = Results()
 
     if not args.test_dir.exists():
@@ -658,6 +728,9 @@ def run_tests(args: argparse.Namespace) -> Results:
 
     test_spec = TestSpec.load(args.config, abis=args.abi)
 
+    # Loaded before the tests are rebuilt, which may clean the test directory.
+    run_durations = DurationHistory.load(args.test_dir / "run_durations.json")
+
     printer = StdoutPrinter(show_all=args.show_all)
 
     if args.ndk.is_file():
@@ -665,10 +738,11 @@ def run_tests(args: argparse.Namespace) -> Results:
 
     test_dist_dir = args.test_dir / "dist"
     if args.build_only or args.rebuild:
-        if not rebuild_tests(args, results, test_spec):
+        if not rebuild_tests(args, results, test_spec, workqueue):
             return results
 
     if args.build_only:
+        write_task_trace(tracer, args.test_dir)
         results.passed()
         return results
 
@@ -716,53 +790,72 @@ def run_tests(args: argparse.Namespace) -> Results:
     # a warning. Then compare that list of devices against all our tests and
     # make sure each test is claimed by at least one device. For each
     # configuration that is unclaimed, print a warning.
-    workqueue = WorkQueue()
-    try:
-        with results.timed("Device discovery"):
-            fleet = find_devices(test_spec.devices, workqueue)
+    workqueue.name = "device setup"
+    with results.timed("Device discovery"):
+        fleet = find_devices(test_spec.devices, workqueue)
 
-        have_all_devices = verify_have_all_requested_devices(fleet)
-        if args.require_all_devices and not have_all_devices:
-            results.failed("Some requested devices were not available.")
-            return results
+    have_all_devices = verify_have_all_requested_devices(fleet)
+    if args.require_all_devices and not have_all_devices:
+        results.failed("Some requested devices were not available.")
+        return results
 
-        groups_for_config = match_configs_to_device_groups(fleet, test_groups.keys())
-        for config in find_configs_with_no_device(groups_for_config):
-            logger().warning("No device found for %s.", config)
+    groups_for_config = match_configs_to_device_groups(fleet, test_groups.keys())
+    for config in find_configs_with_no_device(groups_for_config):
+        logger().warning("No device found for %s.", config)
 
-        if args.clean_device:
-            with results.timed("Clean device"):
-                clear_test_directories(workqueue, fleet)
+    if args.clean_device:
+        with results.timed("Clean device"):
+            clear_test_directories(workqueue, fleet)
 
-        can_use_sync = adb_has_feature("push_sync")
-        with results.timed("Push"):
-            push_tests_to_devices(
-                workqueue, test_dist_dir, groups_for_config, can_use_sync
-            )
-    finally:
-        workqueue.terminate()
-        workqueue.join()
+    can_use_sync = adb_has_feature("push_sync")
+    with results.timed("Push"):
+        push_tests_to_devices(workqueue, test_dist_dir, groups_for_config, can_use_sync)
+
+    # Nothing else runs on the shared workers, so stop them before starting
+    # the per-device workers.
+    workqueue.terminate()
+    workqueue.join()
 
     report = Report[DeviceShardingGroup]()
     shard_queue: ShardingWorkQueue[TestResult, Device] = ShardingWorkQueue(
-        fleet.get_unique_device_groups(), 4
+        fleet.get_unique_device_groups(), 4, tracer=tracer
     )
     try:
         # Need an input queue per device group, a single result queue, and a
         # pool of threads per device.
 
-        # Shuffle the test runs to distribute the load more evenly. These are
-        # ordered by (build config, device, test), so most of the tests running
-        # at any given point in time are all running on the same device.
-        test_runs = pair_test_runs(test_groups, groups_for_config, report, fleet)
+        # The slowest test runs (based on the previous run) are started first.
+        # Test runs with no history all get the same estimate, so shuffle to
+        # break those ties and distribute the load more evenly. These are
+        # ordered by (build config, device, test), so otherwise most of the
+        # tests running at any given point in time would be running on the
+        # same device.
+        test_runs = pair_test_runs(
+            test_groups, groups_for_config, report, fleet, args.any_capable_device
+        )
         random.shuffle(test_runs)
         with results.timed("Run"):
             for test_run in test_runs:
-                shard_queue.add_task(test_run.device_group, run_test, test_run)
-
-            wait_for_results(report, shard_queue, printer)
+                if args.any_capable_device:
+                    shard_queue.add_task_for_any_group(
+                        groups_for_config[test_run.config],
+                        run_durations.estimate(str(test_run)),
+                        run_test,
+                        test_run,
+                    )
+                else:
+                    shard_queue.add_task_with_priority(
+                        test_run.device_group,
+                        run_durations.estimate(str(test_run)),
+                        run_test,
+                        test_run,
+                    )
+
+            wait_for_results(report, shard_queue, printer, run_durations)
             restart_flaky_tests(report, shard_queue)
-            wait_for_results(report, shard_queue, printer)
+            wait_for_results(report, shard_queue, printer, run_durations)
+        run_durations.save()
+        write_task_trace(tracer, args.test_dir)
     finally:
         shard_queue.terminate()
         shard_queue.join()
@@ -0,0 +1,444 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Timing telemetry for work queue tasks.
+
+A TaskTracer records when each task was queued, when a worker started it and
+when it finished. A TaskMeter in the worker also measures how much memory the
+task used and how much it wrote to disk, and lets the task say what it was
+doing, such as which phase of which module it built. The records can be written
+as a Chrome trace event file, which can be loaded in chrome://tracing or
+https://ui.perfetto.dev, and summarized to show worker utilization, the slowest
+tasks and the critical path of the run.
+
+All times are time.monotonic() values, which are comparable between the
+processes of a work queue.
+"""
+from __future__ import annotations
+
+import bisect
+import os
+import resource
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+import ndk.jsonfile
+
+
+def peak_rss_kib() -> int:
+    """Returns the peak RSS of this process or any of its reaped children."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    if sys.platform == "darwin":
+        # Darwin reports bytes rather than KiB.
+        return peak // 1024
+    return peak
+
+
+def bytes_written() -> Optional[int]:
+    """Returns the bytes written to storage by this process and its children.
+
+    Only Linux provides this. The count includes reaped children.
+
+    Returns:
+        The number of bytes written, or None if it is not available.
+    """
+    try:
+        with open("/proc/self/io", encoding="utf-8") as io_file:
+            for line in io_file:
+                key, _, value = line.partition(":")
+                if key == "write_bytes":
+                    return int(value)
+    except OSError:
+        pass
+    return None
+
+
+@dataclass(frozen=True)
+class TaskTiming:
+    """The part of a task's timing that is measured by the worker.
+
+    Attributes:
+        worker: PID of the worker process that ran the task.
+        name: Description of the task.
+        started: Time the worker started the task.
+        finished: Time the worker finished the task.
+        category: The kind of work the task did, such as the build or install
+            phase of a module.
+        peak_rss_kib: Peak RSS of the task in KiB. Workers are long-lived, and
+            the kernel only tracks the peak RSS of a process's children as a
+            high-water mark, so this is only known when the task raised that
+            mark. It is None for tasks that used less.
+        bytes_written: Bytes written to storage by the task, or None if this is
+            not available on this host.
+        args: Details the task gave about itself, shown with its trace event.
+    """
+
+    worker: int
+    name: str
+    started: float
+    finished: float
+    category: str = "task"
+    peak_rss_kib: Optional[int] = None
+    bytes_written: Optional[int] = None
+    args: dict[str, Any] = field(default_factory=dict)
+
+
+class TaskMeter:
+    """Measures a task in the process that runs it.
+
+    The worker creates a meter when it starts each task. The task may use
+    describe() to say what it did.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.name: Optional[str] = None
+        self.category = "task"
+        self.args: dict[str, Any] = {}
+        self._start_rss = peak_rss_kib()
+        self._start_written = bytes_written()
+
+    def describe(self, name: str, category: str, **args: Any) -> None:
+        """Names the task and its category in traces.
+
+        Args:
+            name: Description of the task.
+            category: The kind of work the task did.
+            args: Details shown with the task's trace event.
+        """
+        self.name = name
+        self.category = category
+        self.args.update(args)
+
+    def finish(self, name: str) -> TaskTiming:
+        """Records the end of the task and returns its timing.
+
+        Args:
+            name: Description of the task if it did not describe itself.
+        """
+        finished = time.monotonic()
+        rss = peak_rss_kib()
+        written = bytes_written()
+        return TaskTiming(
+            os.getpid(),
+            self.name if self.name is not None else name,
+            self.started,
+            finished,
+            self.category,
+            peak_rss_kib=rss if rss > self._start_rss else None,
+            bytes_written=(
+                None
+                if written is None or self._start_written is None
+                else written - self._start_written
+            ),
+            args=self.args,
+        )
+
+
+@dataclass
+class TaskRecord:
+    """Timing information for a single task.
+
+    Attributes:
+        task_id: The work queue's ID for the task.
+        queue: Name of the work queue the task was added to.
+        queued: Time the task was added to the work queue.
+        timing: Timing reported by the worker, or None if the task has not
+            finished.
+    """
+
+    task_id: int
+    queue: str
+    queued: float
+    timing: Optional[TaskTiming] = None
+
+    @property
+    def wait(self) -> float:
+        """Time the task spent waiting for a worker."""
+        assert self.timing is not None
+        return self.timing.started - self.queued
+
+    @property
+    def duration(self) -> float:
+        """Time the task spent running."""
+        assert self.timing is not None
+        return self.timing.finished - self.timing.started
+
+
+@dataclass
+class QueueSummary:
+    """Utilization of the workers of a single work queue."""
+
+    name: str
+    num_workers: int
+    num_tasks: int
+    wall_time: float
+    busy_time: float
+    mean_wait: float
+    max_wait: float
+
+    @property
+    def utilization(self) -> float:
+        """Fraction of the available worker time that was spent running tasks."""
+        available = self.num_workers * self.wall_time
+        if available <= 0:
+            return 0.0
+        return self.busy_time / available
+
+
+def describe_record(record: TaskRecord) -> str:
+    """Returns a line describing a finished task for a TraceSummary."""
+    assert record.timing is not None
+    text = f"  {record.duration:8.1f}s {record.timing.name} (waited {record.wait:.1f}s"
+    if record.timing.peak_rss_kib is not None:
+        text += f", peak RSS {record.timing.peak_rss_kib // 1024} MiB"
+    if record.timing.bytes_written is not None:
+        text += f", wrote {record.timing.bytes_written // 2**20} MiB"
+    return text + ")"
+
+
+@dataclass
+class TraceSummary:
+    """Summary of a TaskTracer's records."""
+
+    wall_time: float
+    queues: list[QueueSummary] = field(default_factory=list)
+    slowest: list[TaskRecord] = field(default_factory=list)
+    critical_path: list[TaskRecord] = field(default_factory=list)
+
+    def format(self) -> str:
+        lines = [f"Wall time: {self.wall_time:.1f}s"]
+        for queue in self.queues:
+            lines.append(
+                f"{queue.name}: {queue.num_tasks} tasks on {queue.num_workers} "
+                f"workers in {queue.wall_time:.1f}s, "
+                f"{queue.utilization:.0%} utilization, "
+                f"mean wait {queue.mean_wait:.1f}s, max wait {queue.max_wait:.1f}s"
+            )
+        if self.slowest:
+            lines.append("Slowest tasks:")
+            lines.extend(describe_record(r) for r in self.slowest)
+        if self.critical_path:
+            length = sum(r.wait + r.duration for r in self.critical_path)
+            lines.append(f"Critical path ({length:.1f}s):")
+            lines.extend(describe_record(r) for r in self.critical_path)
+        return "\n".join(lines)
+
+
+class TaskTracer:
+    """Records the timing of work queue tasks.
+
+    A single tracer may be shared by several work queues. Task IDs are unique
+    across all work queues in a process.
+    """
+
+    def __init__(self) -> None:
+        self.records: dict[int, TaskRecord] = {}
+        # Maps the name of each work queue to the PIDs of its workers. A
+        # worker may belong to several queues if a work queue was renamed.
+        self.workers: dict[str, set[int]] = {}
+
+    def add_worker(self, pid: int, queue: str) -> None:
+        """Registers a worker of the named work queue."""
+        self.workers.setdefault(queue, set()).add(pid)
+
+    def task_queued(self, task_id: int, queue: str, now: float) -> None:
+        """Records that a task was added to a work queue."""
+        self.records[task_id] = TaskRecord(task_id, queue, now)
+
+    def task_finished(self, task_id: int, timing: TaskTiming) -> None:
+        """Records the worker's timing for a finished task."""
+        record = self.records.get(task_id)
+        if record is not None:
+            record.timing = timing
+
+    @property
+    def finished_records(self) -> list[TaskRecord]:
+        """The records of every finished task, in the order they started."""
+        records = [r for r in self.records.values() if r.timing is not None]
+        return sorted(records, key=lambda r: (r.timing.started if r.timing else 0.0))
+
+    def critical_path(self) -> list[TaskRecord]:
+        """Returns the chain of tasks that determined when the run finished.
+
+        Work queues don't know about dependencies between tasks, but callers
+        only add a task once the tasks it depends on have finished. Starting
+        from the task that finished last, the task each step depends on is
+        taken to be the last task to finish before it was queued.
+        """
+        records = self.finished_records
+        if not records:
+            return []
+        by_finish = sorted(records, key=lambda r: r.timing.finished if r.timing else 0)
+        finish_times = [r.timing.finished for r in by_finish if r.timing is not None]
+        path = [by_finish[-1]]
+        while True:
+            index = bisect.bisect_right(finish_times, path[-1].queued) - 1
+            if index < 0:
+                break
+            path.append(by_finish[index])
+        path.reverse()
+        return path
+
+    def summarize(self, num_slowest: int = 10) -> TraceSummary:
+        """Summarizes utilization, the slowest tasks and the critical path.
+
+        Args:
+            num_slowest: The number of slowest tasks to include.
+        """
+        records = self.finished_records
+        if not records:
+            return TraceSummary(0.0)
+        start = min(r.queued for r in records)
+        end = max(r.timing.finished for r in records if r.timing is not None)
+        summary = TraceSummary(
+            end - start,
+            slowest=sorted(records, key=lambda r: r.duration, reverse=True)[
+                :num_slowest
+            ],
+            critical_path=self.critical_path(),
+        )
+
+        queue_names = sorted(
+            {r.queue for r in records},
+            key=lambda n: min(r.queued for r in records if r.queue == n),
+        )
+        for name in queue_names:
+            queue_records = [r for r in records if r.queue == name]
+            queue_start = min(r.queued for r in queue_records)
+            queue_end = max(
+                r.timing.finished for r in queue_records if r.timing is not None
+            )
+            workers = set(self.workers.get(name, set()))
+            workers.update(r.timing.worker for r in queue_records if r.timing)
+            waits = [r.wait for r in queue_records]
+            summary.queues.append(
+                QueueSummary(
+                    name,
+                    num_workers=len(workers),
+                    num_tasks=len(queue_records),
+                    wall_time=queue_end - queue_start,
+                    busy_time=sum(r.duration for r in queue_records),
+                    mean_wait=sum(waits) / len(waits),
+                    max_wait=max(waits),
+                )
+            )
+        return summary
+
+    def to_chrome_trace(self) -> dict[str, Any]:
+        """Returns the records in the Chrome trace event format.
+
+        Each work queue is shown as a process and each of its workers as a
+        thread. A counter track for each work queue shows how many tasks were
+        waiting for a worker.
+        """
+        records = self.finished_records
+        if not records:
+            return {"traceEvents": [], "displayTimeUnit": "ms"}
+        start = min(r.queued for r in records)
+        critical = {r.task_id for r in self.critical_path()}
+
+        def micros(time: float) -> int:
+            return int((time - start) * 1e6)
+
+        queue_ids: dict[str, int] = {}
+        events: list[dict[str, Any]] = []
+        for record in records:
+            if record.queue not in queue_ids:
+                pid = len(queue_ids) + 1
+                queue_ids[record.queue] = pid
+                events.append(
+                    {
+                        "name": "process_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "args": {"name": record.queue},
+                    }
+                )
+
+        workers_seen: set[tuple[int, int]] = set()
+        waiting: dict[str, list[tuple[float, int]]] = {q: [] for q in queue_ids}
+        for record in records:
+            assert record.timing is not None
+            pid = queue_ids[record.queue]
+            tid = record.timing.worker
+            if (pid, tid) not in workers_seen:
+                workers_seen.add((pid, tid))
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": tid,
+                        "args": {"name": f"worker {tid}"},
+                    }
+                )
+            args = {
+                "task_id": record.task_id,
+                "wait_ms": round(record.wait * 1000, 3),
+                "critical_path": record.task_id in critical,
+                "peak_rss_kib": record.timing.peak_rss_kib,
+                "bytes_written": record.timing.bytes_written,
+            }
+            args.update(record.timing.args)
+            events.append(
+                {
+                    "name": record.timing.name,
+                    "cat": record.timing.category,
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": micros(record.timing.started),
+                    "dur": micros(record.timing.finished)
+                    - micros(record.timing.started),
+                    "args": args,
+                }
+            )
+            waiting[record.queue].append((record.queued, 1))
+            waiting[record.queue].append((record.timing.started, -1))
+
+        for queue, changes in waiting.items():
+            count = 0
+            # Tasks queued and started at the same time must be counted as
+            # queued first.
+            for time, delta in sorted(changes, key=lambda c: (c[0], -c[1])):
+                count += delta
+                events.append(
+                    {
+                        "name": "waiting tasks",
+                        "ph": "C",
+                        "pid": queue_ids[queue],
+                        "ts": micros(time),
+                        "args": {"waiting": count},
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: Path) -> None:
+        """Writes the records to path as a Chrome trace event file."""
+        ndk.jsonfile.write_json(path, self.to_chrome_trace())
+
+    def write_summary(self, path: Path) -> TraceSummary:
+        """Writes a human readable summary of the records to path."""
+        summary = self.summarize()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(summary.format() + "\n", encoding="utf-8")
+        return summary
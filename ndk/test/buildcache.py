@@ -0,0 +1,243 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A local cache of test build results.
+
+Each build of a test is keyed by the contents of the test's source directory,
+its build configuration and extra build flags, and a fingerprint of the NDK the
+test is built with. If the cache has an entry for that key the test is not
+built again. Its result is reported from the cache, and the build outputs that
+are needed after the build (the files that are pushed to devices) are restored.
+
+Unlike the module build cache (see ndk.buildcache), the NDK under test is
+identified by the contents of its files rather than their modification times.
+Every build of the NDK rewrites most of its files, but usually doesn't change
+most of them, and it is the contents that tests depend on.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional
+
+import ndk.buildcache
+import ndk.filecopy
+from ndk.manifest import InstallManifest
+from ndk.test.buildtest.case import BuildTest
+from ndk.test.result import Failure, Success, TestResult
+
+
+def logger() -> logging.Logger:
+    """Returns the module logger."""
+    return logging.getLogger(__name__)
+
+
+def _is_ignored(path: str) -> bool:
+    return any(
+        part in ndk.buildcache.IGNORED_NAMES or part.endswith(".pyc")
+        for part in path.split("/")
+    )
+
+
+def _hash_tree(
+    digest: ndk.buildcache.Digest, root: Path, jobs: Optional[int] = None
+) -> None:
+    manifest = InstallManifest.scan(root)
+    manifest = InstallManifest(root, [e for e in manifest if not _is_ignored(e.path)])
+    manifest.hash_files(jobs)
+    for entry in manifest:
+        digest.update(json.dumps(entry.to_json(), sort_keys=True).encode("utf-8"))
+        digest.update(b"\n")
+
+
+def ndk_fingerprint(ndk_path: Path) -> str:
+    """Returns a hash of the contents of the NDK at ndk_path.
+
+    Python bytecode caches, which running the NDK's scripts may create, are not
+    part of the fingerprint.
+    """
+    digest = hashlib.sha256()
+    _hash_tree(digest, ndk_path)
+    return digest.hexdigest()
+
+
+class TestBuildCache:
+    """A cache of test build results and outputs.
+
+    Entries are stored in cache_dir/<test build dir>/<key>. Only the most recent
+    MAX_ENTRIES_PER_TEST entries of each test build are kept.
+
+    Only results that passed (including expected failures and negative tests
+    that failed to build) are cached, so a failing test is always rebuilt.
+    """
+
+    # Needed to shut up warnings about `Test*` looking like a unittest test case.
+    __test__ = False
+
+    MAX_ENTRIES_PER_TEST = 2
+
+    RESULT_FILE = "result.json"
+
+    def __init__(
+        self, cache_dir: Path, ndk_path: Path, base_inputs: Iterable[Path]
+    ) -> None:
+        """Initializes a test build cache.
+
+        Fingerprinting the NDK reads all of it, so this should be done once
+        per test build.
+
+        Args:
+            cache_dir: Directory to store cache entries in.
+            ndk_path: Path to the NDK the tests are built with.
+            base_inputs: Paths that are inputs to every test build, such as the
+                test runner and the CMake used to build tests. These are
+                identified by modification time, as in ndk.buildcache.
+        """
+        self.cache_dir = cache_dir
+        self.base_key = "\0".join(
+            [
+                ndk_fingerprint(ndk_path),
+                str(ndk_path),
+                ndk.buildcache.fingerprint(base_inputs),
+            ]
+        )
+
+    def key_for(self, test: BuildTest) -> str:
+        """Returns the cache key for the test."""
+        digest = hashlib.sha256()
+        digest.update(self.base_key.encode("utf-8"))
+        digest.update(
+            json.dumps(
+                [
+                    type(test).__qualname__,
+                    test.name,
+                    str(test.config),
+                    test.ndk_build_flags,
+                    test.cmake_flags,
+                ]
+            ).encode("utf-8")
+        )
+        # Test directories are small, and many are hashed at once by the build
+        # workers.
+        _hash_tree(digest, test.test_dir, jobs=1)
+        return digest.hexdigest()
+
+    def _entry_path(self, test: BuildTest, key: str) -> Path:
+        return self.cache_dir / test.get_build_dir(Path()) / key
+
+    def restore(
+        self, test: BuildTest, key: str, obj_dir: Path, dist_dir: Path
+    ) -> Optional[TestResult]:
+        """Restores the result and build outputs of a test from the cache.
+
+        Returns:
+            The cached result, or None if there is no entry for the key.
+        """
+        entry = self._entry_path(test, key)
+        try:
+            with (entry / self.RESULT_FILE).open(encoding="utf-8") as result_file:
+                data = json.load(result_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as ex:
+            logger().warning("Ignoring unreadable cache entry %s: %s", entry, ex)
+            return None
+
+        for index, output in enumerate(test.get_build_outputs(obj_dir, dist_dir)):
+            if output.exists():
+                shutil.rmtree(output)
+            cached = entry / str(index)
+            if cached.exists():
+                output.parent.mkdir(parents=True, exist_ok=True)
+                ndk.filecopy.copy_tree(cached, output, symlinks=True)
+
+        result: TestResult
+        if data["passed"]:
+            result = Success(test)
+        else:
+            result = Failure(test, data["message"])
+        result.cached = True
+        # Mark the entry as recently used so it isn't pruned.
+        os.utime(entry)
+        return result
+
+    def store(
+        self,
+        test: BuildTest,
+        key: str,
+        result: TestResult,
+        obj_dir: Path,
+        dist_dir: Path,
+    ) -> None:
+        """Stores the result and build outputs of a test in the cache.
+
+        Args:
+            test: The test that was built.
+            key: The cache key of the test.
+            result: The result of building the test, before it was adjusted for
+                negative tests or known failures.
+            obj_dir: Out directory for intermediate build artifacts.
+            dist_dir: Out directory for build artifacts needed for running.
+        """
+        assert isinstance(result, (Success, Failure))
+        entry = self._entry_path(test, key)
+        staging = entry.with_name(f".{key}.{uuid.uuid4().hex}")
+        try:
+            staging.mkdir(parents=True)
+            outputs = test.get_build_outputs(obj_dir, dist_dir)
+            for index, output in enumerate(outputs):
+                if output.exists():
+                    ndk.filecopy.copy_tree(output, staging / str(index), symlinks=True)
+            with (staging / self.RESULT_FILE).open(
+                "w", encoding="utf-8"
+            ) as result_file:
+                json.dump(
+                    {
+                        "passed": result.passed(),
+                        "message": getattr(result, "message", None),
+                    },
+                    result_file,
+                )
+            try:
+                staging.rename(entry)
+            except OSError:
+                # A previous build stored the same entry, but it couldn't be
+                # restored.
+                if not entry.exists():
+                    raise
+        except OSError as ex:
+            logger().warning("Could not cache build of %s: %s", test, ex)
+        finally:
+            if staging.exists():
+                shutil.rmtree(staging)
+        self.prune(test)
+
+    def prune(self, test: BuildTest) -> None:
+        """Removes all but the most recently used entries for the test."""
+        test_dir = self.cache_dir / test.get_build_dir(Path())
+        if not test_dir.exists():
+            return
+        entries = sorted(
+            (p for p in test_dir.iterdir() if not p.name.startswith(".")),
+            key=lambda p: p.stat().st_mtime_ns,
+            reverse=True,
+        )
+        for entry in entries[self.MAX_ENTRIES_PER_TEST :]:
+            shutil.rmtree(entry, ignore_errors=True)
@@ -18,24 +18,30 @@ from __future__ import absolute_import
 
 import json
 import logging
+import multiprocessing
 import os
 import pickle
 import random
 import shutil
 import sys
+import time
 import traceback
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import ndk.abis
 import ndk.archive
+import ndk.cmake
+import ndk.durations
 import ndk.paths
 import ndk.test.devicetest.scanner
 import ndk.test.spec
 import ndk.test.suites
 import ndk.test.ui
 import ndk.ui
-from ndk.test.buildtest.case import Test
+from ndk.jobserver import JobServer
+from ndk.test.buildcache import TestBuildCache
+from ndk.test.buildtest.case import BuildTest, Test
 from ndk.test.buildtest.scanner import TestScanner
 from ndk.test.devices import DeviceConfig
 from ndk.test.filters import TestFilter
@@ -96,6 +102,8 @@ def _run_test(
     obj_dir: Path,
     dist_dir: Path,
     test_filters: TestFilter,
+    build_cache: Optional[TestBuildCache],
+    job_server: Optional[JobServer],
 ) -> RunTestResult:
     """Runs a given test according to the given filters.
 
@@ -106,6 +114,8 @@ def _run_test(
         obj_dir: Out directory for intermediate build artifacts.
         dist_dir: Out directory for build artifacts needed for running.
         test_filters: Filters to apply when running tests.
+        build_cache: The cache of test build results, if it should be used.
+        job_server: The jobserver shared by all test builds, if there is one.
 
     Returns: Tuple of (suite, TestResult, [Test]). The [Test] element is a list
              of additional tests to be run.
@@ -117,8 +127,28 @@ def _run_test(
         message = "test unsupported for {}".format(config)
         return suite, ndk.test.result.Skipped(test, message), []
 
+    start_time = time.monotonic()
     try:
-        result, additional_tests = test.run(obj_dir, dist_dir, test_filters)
+        cache_key = None
+        cached_result = None
+        if build_cache is not None and isinstance(test, BuildTest):
+            cache_key = build_cache.key_for(test)
+            cached_result = build_cache.restore(test, cache_key, obj_dir, dist_dir)
+        additional_tests: list[Test] = []
+        if cached_result is not None:
+            result = cached_result
+        elif job_server is not None:
+            worker.status = f"Waiting for a job slot for {test}"
+            with job_server.client() as jobs:
+                # Waiting for the job slot isn't part of the build.
+                start_time = time.monotonic()
+                worker.status = f"Building {test}"
+                result, additional_tests = test.run(
+                    obj_dir, dist_dir, test_filters, jobs
+                )
+        else:
+            result, additional_tests = test.run(obj_dir, dist_dir, test_filters)
+        build_result = result
         if test.is_negative_test():
             result = _fixup_negative_test(result)
         config, bug = test.check_broken()
@@ -127,9 +157,21 @@ def _run_test(
             # ExpectedFailure or an UnexpectedSuccess as necessary.
             assert bug is not None
             result = _fixup_expected_failure(result, config, bug)
+        if cached_result is not None:
+            result.cached = True
+        elif (
+            build_cache is not None
+            and cache_key is not None
+            and result.passed()
+            and not additional_tests
+        ):
+            assert isinstance(test, BuildTest)
+            worker.status = f"Caching {test}"
+            build_cache.store(test, cache_key, build_result, obj_dir, dist_dir)
     except Exception:  # pylint: disable=broad-except
         result = ndk.test.result.Failure(test, traceback.format_exc())
         additional_tests = []
+    result.duration = time.monotonic() - start_time
     return suite, result, additional_tests
 
 
@@ -139,16 +181,37 @@ class TestBuilder:
         test_spec: ndk.test.spec.TestSpec,
         test_options: ndk.test.spec.TestOptions,
         printer: Printer,
+        workqueue: Optional[AnyWorkQueue] = None,
     ) -> None:
+        """Creates a TestBuilder.
+
+        Args:
+            test_spec: The test configurations to build.
+            test_options: Options for the build.
+            printer: Printer for test results.
+            workqueue: Work queue to build the tests with. The work queue is
+                left running after the build so that it can be reused. If
+                None, a work queue is created for the build and terminated
+                after.
+        """
         self.printer = printer
+        self.workqueue = workqueue
         self.tests: Dict[str, List[Test]] = {}
         self.build_dirs: Dict[Path, Tuple[str, Test]] = {}
 
         self.test_options = test_options
+        self.build_cache: Optional[TestBuildCache] = None
+        self.job_server: Optional[JobServer] = None
+        self.num_cached = 0
 
         self.obj_dir = self.test_options.out_dir / "obj"
         self.dist_dir = self.test_options.out_dir / "dist"
 
+        # Loaded now since the out directory may be cleaned before building.
+        self.durations = ndk.durations.DurationHistory.load(
+            self.test_options.out_dir / "build_durations.json"
+        )
+
         self.test_spec = test_spec
         self.find_tests()
 
@@ -213,44 +276,99 @@ class TestBuilder:
         if self.test_options.clean:
             self.clean_out_dir()
         self.make_out_dirs()
+        if self.test_options.build_cache_dir is not None:
+            self.build_cache = self.create_build_cache(
+                self.test_options.build_cache_dir
+            )
 
         test_filters = TestFilter.from_string(self.test_options.test_filter)
         result = self.do_build(test_filters)
+        self.durations.save()
+        if self.build_cache is not None:
+            print(
+                f"{self.num_cached} of {result.num_tests} test builds were "
+                "restored from the build cache."
+            )
         if self.test_options.build_report:
             write_build_report(self.test_options.build_report, result)
         if result.successful and self.test_options.package_path is not None:
             self.package()
         return result
 
+    def create_build_cache(self, cache_dir: Path) -> TestBuildCache:
+        """Creates the cache of test build results.
+
+        Changes to the NDK under test, to the test runner or to the tools used
+        to build tests invalidate every entry.
+        """
+        return TestBuildCache(
+            cache_dir,
+            self.test_options.ndk_path,
+            [
+                Path(ndk.__file__).parent,
+                ndk.cmake.find_cmake(),
+                ndk.cmake.find_ninja(),
+            ],
+        )
+
     def do_build(self, test_filters: TestFilter) -> Report[None]:
+        if os.name == "nt":
+            return self.do_build_with_workqueue(test_filters)
+
+        # Each test builds with as many jobs as it can get from a jobserver with
+        # a job per CPU, rather than with a job per CPU of its own, so that the
+        # builds neither oversubscribe the machine while many tests are
+        # building nor leave it idle while the last few are.
+        with JobServer(multiprocessing.cpu_count()) as job_server:
+            self.job_server = job_server
+            try:
+                return self.do_build_with_workqueue(test_filters)
+            finally:
+                self.job_server = None
+
+    def do_build_with_workqueue(self, test_filters: TestFilter) -> Report[None]:
+        if self.workqueue is not None:
+            self.workqueue.name = "test build"
+            return self.build_with_workqueue(self.workqueue, test_filters)
+
         workqueue = WorkQueue()
         try:
-            for suite, tests in self.tests.items():
-                # Each test configuration was expanded when each test was
-                # discovered, so the current order has all the largest tests
-                # right next to each other. Spread them out to try to avoid
-                # having too many heavy builds happening simultaneously.
-                random.shuffle(tests)
-                for test in tests:
-                    if not test_filters.filter(test.name):
-                        continue
-                    workqueue.add_task(
-                        _run_test,
-                        suite,
-                        test,
-                        self.obj_dir,
-                        self.dist_dir,
-                        test_filters,
-                    )
-
-            report = Report[None]()
-            self.wait_for_results(report, workqueue, test_filters)
-
-            return report
+            return self.build_with_workqueue(workqueue, test_filters)
         finally:
             workqueue.terminate()
             workqueue.join()
 
+    def build_with_workqueue(
+        self, workqueue: AnyWorkQueue, test_filters: TestFilter
+    ) -> Report[None]:
+        for suite, tests in self.tests.items():
+            # Tests are started longest first based on how long they took
+            # to build last time. Tests with no history all get the same
+            # estimate, and since each test configuration was expanded when
+            # each test was discovered, the current order has all the
+            # largest tests right next to each other. Shuffle to break the
+            # ties so that too many heavy builds don't run simultaneously.
+            random.shuffle(tests)
+            for test in tests:
+                if not test_filters.filter(test.name):
+                    continue
+                workqueue.add_task_with_priority(
+                    self.durations.estimate(str(test)),
+                    _run_test,
+                    suite,
+                    test,
+                    self.obj_dir,
+                    self.dist_dir,
+                    test_filters,
+                    self.build_cache,
+                    self.job_server,
+                )
+
+        report = Report[None]()
+        self.wait_for_results(report, workqueue, test_filters)
+
+        return report
+
     def wait_for_results(
         self,
         report: Report[None],
@@ -264,14 +382,23 @@ class TestBuilder:
                 while not workqueue.finished():
                     for suite, result, additional_tests in workqueue.get_results():
                         assert result.passed() or not additional_tests
+                        if result.cached:
+                            # How long it took to restore the result says
+                            # nothing about how long the build will take.
+                            self.num_cached += 1
+                        elif result.duration is not None:
+                            self.durations.record(str(result.test), result.duration)
                         for test in additional_tests:
-                            workqueue.add_task(
+                            workqueue.add_task_with_priority(
+                                self.durations.estimate(str(test)),
                                 _run_test,
                                 suite,
                                 test,
                                 self.obj_dir,
                                 self.dist_dir,
                                 test_filters,
+                                self.build_cache,
+                                self.job_server,
                             )
                         if logger().isEnabledFor(logging.INFO):
                             ui.clear()
@@ -26,16 +26,19 @@ from abc import ABC, abstractmethod
 from importlib.abc import Loader
 from pathlib import Path
 from subprocess import CompletedProcess
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import ndk.ansi
 import ndk.ext.os
 import ndk.ext.subprocess
+import ndk.filecopy
 import ndk.hosts
 import ndk.ndkbuild
 import ndk.paths
 from ndk.abis import Abi
 from ndk.cmake import find_cmake, find_ninja
+from ndk.jobserver import JobServerClient
+from ndk.test.buildtest.cmakeseed import CMakeSeed, seed_key
 from ndk.test.config import TestConfig
 from ndk.test.filters import TestFilter
 from ndk.test.result import Failure, Skipped, Success, TestResult
@@ -47,15 +50,26 @@ def logger() -> logging.Logger:
     return logging.getLogger(__name__)
 
 
-def _get_jobs_args() -> List[str]:
+def _get_jobs_args(jobs: Optional[JobServerClient]) -> List[str]:
+    if jobs is not None:
+        # Make takes its jobs from the jobserver, unless -j overrides it.
+        return []
     cpus = multiprocessing.cpu_count()
     return [f"-j{cpus}", f"-l{cpus}"]
 
 
+def _get_jobs_env(jobs: Optional[JobServerClient]) -> Dict[str, str]:
+    if jobs is not None:
+        return jobs.env()
+    return dict(os.environ)
+
+
 def _prep_build_dir(src_dir: Path, out_dir: Path) -> None:
     if out_dir.exists():
         shutil.rmtree(out_dir)
-    shutil.copytree(src_dir, out_dir, ignore=shutil.ignore_patterns("__pycache__"))
+    ndk.filecopy.copy_tree(
+        src_dir, out_dir, ignore=shutil.ignore_patterns("__pycache__")
+    )
 
 
 class Test(ABC):
@@ -76,8 +90,21 @@ class Test(ABC):
         return TestConfig.from_test_dir(self.test_dir)
 
     def run(
-        self, obj_dir: Path, dist_dir: Path, test_filters: TestFilter
+        self,
+        obj_dir: Path,
+        dist_dir: Path,
+        test_filters: TestFilter,
+        jobs: Optional[JobServerClient] = None,
     ) -> Tuple[TestResult, List["Test"]]:
+        """Runs the test.
+
+        Args:
+            obj_dir: Out directory for intermediate build artifacts.
+            dist_dir: Out directory for build artifacts needed for running.
+            test_filters: Filters to apply when running tests.
+            jobs: Jobserver to take the jobs for the build from. If None, the
+                build uses a job per CPU.
+        """
         raise NotImplementedError
 
     def is_negative_test(self) -> bool:
@@ -130,6 +157,14 @@ class BuildTest(Test):
             self, f"Test build failed: {shlex.join(proc.args)}:\n{proc.stdout}"
         )
 
+    def get_build_outputs(self, _obj_dir: Path, _dist_dir: Path) -> List[Path]:
+        """Returns the build outputs that are used after the test is built.
+
+        These are restored when the test's result is restored from the test
+        build cache.
+        """
+        return []
+
     def verify_no_cruft_in_dist(
         self, dist_dir: Path, build_cmd: list[str]
     ) -> Optional[Failure[None]]:
@@ -147,7 +182,11 @@ class BuildTest(Test):
         return None
 
     def run(
-        self, obj_dir: Path, dist_dir: Path, _test_filters: TestFilter
+        self,
+        obj_dir: Path,
+        dist_dir: Path,
+        _test_filters: TestFilter,
+        jobs: Optional[JobServerClient] = None,
     ) -> Tuple[TestResult, List[Test]]:
         raise NotImplementedError
 
@@ -209,7 +248,11 @@ class PythonBuildTest(BuildTest):
         return out_dir / str(self.config) / "test.py" / self.name
 
     def run(
-        self, obj_dir: Path, _dist_dir: Path, _test_filters: TestFilter
+        self,
+        obj_dir: Path,
+        _dist_dir: Path,
+        _test_filters: TestFilter,
+        _jobs: Optional[JobServerClient] = None,
     ) -> Tuple[TestResult, List[Test]]:
         build_dir = self.get_build_dir(obj_dir)
         logger().info("Building test: %s", self.name)
@@ -237,7 +280,11 @@ class ShellBuildTest(BuildTest):
         return out_dir / str(self.config) / "build.sh" / self.name
 
     def run(
-        self, obj_dir: Path, _dist_dir: Path, _test_filters: TestFilter
+        self,
+        obj_dir: Path,
+        _dist_dir: Path,
+        _test_filters: TestFilter,
+        jobs: Optional[JobServerClient] = None,
     ) -> Tuple[TestResult, List[Test]]:
         build_dir = self.get_build_dir(obj_dir)
         logger().info("Building test: %s", self.name)
@@ -253,6 +300,7 @@ class ShellBuildTest(BuildTest):
             self.ndk_build_flags,
             self.abi,
             self.api,
+            jobs,
         )
         return result, []
 
@@ -265,17 +313,21 @@ def _run_build_sh_test(
     ndk_build_flags: List[str],
     abi: Abi,
     platform: int,
+    jobs: Optional[JobServerClient],
 ) -> TestResult:
     _prep_build_dir(test_dir, build_dir)
     with ndk.ext.os.cd(build_dir):
-        build_cmd = ["bash", "build.sh"] + _get_jobs_args() + ndk_build_flags
-        test_env = dict(os.environ)
+        build_cmd = ["bash", "build.sh"] + _get_jobs_args(jobs) + ndk_build_flags
+        test_env = _get_jobs_env(jobs)
         test_env["NDK"] = str(ndk_path)
         if abi is not None:
             test_env["APP_ABI"] = abi
         test_env["APP_PLATFORM"] = f"android-{platform}"
         rc, out = ndk.ext.subprocess.call_output(
-            build_cmd, env=test_env, encoding="utf-8"
+            build_cmd,
+            env=test_env,
+            encoding="utf-8",
+            pass_fds=jobs.pass_fds if jobs is not None else (),
         )
         if rc == 0:
             return Success(test)
@@ -372,11 +424,20 @@ class NdkBuildTest(BuildTest):
             return self.get_build_dir(dist_dir)
         return self.get_build_dir(obj_dir) / "dist"
 
+    def get_build_outputs(self, _obj_dir: Path, dist_dir: Path) -> List[Path]:
+        if self.dist:
+            return [self.get_build_dir(dist_dir)]
+        return []
+
     def get_build_dir(self, out_dir: Path) -> Path:
         return out_dir / str(self.config) / "ndk-build" / self.name
 
     def run(
-        self, obj_dir: Path, dist_dir: Path, _test_filters: TestFilter
+        self,
+        obj_dir: Path,
+        dist_dir: Path,
+        _test_filters: TestFilter,
+        jobs: Optional[JobServerClient] = None,
     ) -> Tuple[TestResult, List[Test]]:
         logger().info("Building test: %s", self.name)
         obj_dir = self.get_build_dir(obj_dir)
@@ -389,6 +450,7 @@ class NdkBuildTest(BuildTest):
             self.ndk_path,
             self.ndk_build_flags,
             self.abi,
+            jobs,
         )
         if (failure := self.verify_no_cruft_in_dist(dist_dir, proc.args)) is not None:
             return failure, []
@@ -402,14 +464,20 @@ def _run_ndk_build_test(
     ndk_path: Path,
     ndk_build_flags: List[str],
     abi: Abi,
+    jobs: Optional[JobServerClient],
 ) -> CompletedProcess[str]:
     _prep_build_dir(test_dir, obj_dir)
     with ndk.ext.os.cd(obj_dir):
         args = [
             f"APP_ABI={abi}",
             f"NDK_LIBS_OUT={dist_dir}",
-        ] + _get_jobs_args()
-        return ndk.ndkbuild.build(ndk_path, args + ndk_build_flags)
+        ] + _get_jobs_args(jobs)
+        return ndk.ndkbuild.build(
+            ndk_path,
+            args + ndk_build_flags,
+            env=_get_jobs_env(jobs),
+            pass_fds=jobs.pass_fds if jobs is not None else (),
+        )
 
 
 class CMakeBuildTest(BuildTest):
@@ -436,12 +504,22 @@ class CMakeBuildTest(BuildTest):
             return self.get_build_dir(dist_dir)
         return self.get_build_dir(obj_dir) / "dist"
 
+    def get_build_outputs(self, _obj_dir: Path, dist_dir: Path) -> List[Path]:
+        if self.dist:
+            return [self.get_build_dir(dist_dir)]
+        return []
+
     def get_build_dir(self, out_dir: Path) -> Path:
         return out_dir / str(self.config) / "cmake" / self.name
 
     def run(
-        self, obj_dir: Path, dist_dir: Path, _test_filters: TestFilter
+        self,
+        obj_dir: Path,
+        dist_dir: Path,
+        _test_filters: TestFilter,
+        jobs: Optional[JobServerClient] = None,
     ) -> Tuple[TestResult, List[Test]]:
+        seed_dir = obj_dir / "cmake-seeds"
         obj_dir = self.get_build_dir(obj_dir)
         dist_dir = self.get_dist_dir(obj_dir, dist_dir)
         logger().info("Building test: %s", self.name)
@@ -449,11 +527,13 @@ class CMakeBuildTest(BuildTest):
         proc = _run_cmake_build_test(
             obj_dir,
             dist_dir,
+            seed_dir,
             self.test_dir,
             self.ndk_path,
             self.cmake_flags,
             self.abi,
             self.config.toolchain_file == CMakeToolchainFile.Legacy,
+            jobs,
         )
         if (failure := self.verify_no_cruft_in_dist(dist_dir, proc.args)) is not None:
             return failure, []
@@ -463,11 +543,13 @@ class CMakeBuildTest(BuildTest):
 def _run_cmake_build_test(
     obj_dir: Path,
     dist_dir: Path,
+    seed_dir: Path,
     test_dir: Path,
     ndk_path: Path,
     cmake_flags: List[str],
     abi: str,
     use_legacy_toolchain_file: bool,
+    jobs: Optional[JobServerClient],
 ) -> CompletedProcess[str]:
     _prep_build_dir(test_dir, obj_dir)
 
@@ -477,22 +559,30 @@ def _run_cmake_build_test(
     toolchain_file = ndk_path / "build" / "cmake" / "android.toolchain.cmake"
     abi_obj_dir = obj_dir / abi
     abi_lib_dir = dist_dir / abi
-    args = [
-        f"-H{obj_dir}",
-        f"-B{abi_obj_dir}",
+    toolchain_args = [
         f"-DCMAKE_TOOLCHAIN_FILE={toolchain_file}",
         f"-DANDROID_ABI={abi}",
-        f"-DCMAKE_RUNTIME_OUTPUT_DIRECTORY={abi_lib_dir}",
-        f"-DCMAKE_LIBRARY_OUTPUT_DIRECTORY={abi_lib_dir}",
         "-GNinja",
         f"-DCMAKE_MAKE_PROGRAM={ninja_bin}",
     ]
     if use_legacy_toolchain_file:
-        args.append("-DANDROID_USE_LEGACY_TOOLCHAIN_FILE=ON")
+        toolchain_args.append("-DANDROID_USE_LEGACY_TOOLCHAIN_FILE=ON")
     else:
-        args.append("-DANDROID_USE_LEGACY_TOOLCHAIN_FILE=OFF")
+        toolchain_args.append("-DANDROID_USE_LEGACY_TOOLCHAIN_FILE=OFF")
+    toolchain_args.extend(cmake_flags)
+
+    # Tests with the same toolchain settings share the results of detecting the
+    # toolchain rather than each detecting it again.
+    seed = CMakeSeed(seed_dir / seed_key(cmake_bin, ndk_path, toolchain_args))
+    args = [
+        f"-H{obj_dir}",
+        f"-B{abi_obj_dir}",
+        f"-DCMAKE_RUNTIME_OUTPUT_DIRECTORY={abi_lib_dir}",
+        f"-DCMAKE_LIBRARY_OUTPUT_DIRECTORY={abi_lib_dir}",
+    ]
+    args.extend(seed.apply(abi_obj_dir))
     proc = subprocess.run(
-        [str(cmake_bin)] + args + cmake_flags,
+        [str(cmake_bin)] + args + toolchain_args,
         check=False,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
@@ -500,8 +590,15 @@ def _run_cmake_build_test(
     )
     if proc.returncode != 0:
         return proc
+    seed.update(abi_obj_dir)
+    if jobs is None:
+        build_jobs_args = _get_jobs_args(jobs)
+    else:
+        # Ninja isn't a jobserver client, so it gets its share of the jobs that
+        # are free when the build starts for the whole build.
+        build_jobs_args = [f"-j{jobs.acquire_available()}"]
     return subprocess.run(
-        [str(cmake_bin), "--build", str(abi_obj_dir), "--"] + _get_jobs_args(),
+        [str(cmake_bin), "--build", str(abi_obj_dir), "--"] + build_jobs_args,
         check=False,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
@@ -0,0 +1,188 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Sharing of CMake's toolchain detection between test builds.
+
+The first time a CMake build directory is configured, CMake identifies the
+target system and each enabled language's compiler, checks that the compilers
+work and finds the binutils. That takes several compiles and links per
+language, and is most of the time it takes to configure a test. The results
+are written to CMakeFiles/<version> and to the cache, and CMake reuses them when
+the directory is reconfigured.
+
+A seed is a snapshot of those results taken from a configured test. Any other
+test configured with exactly the same toolchain settings, NDK and CMake is
+seeded with it: the files are copied into its build directory and the cache
+entries are preloaded with -C, so CMake treats the directory as one that has
+already been configured. Languages the seed doesn't have yet are detected as
+usual, and the seed is then updated to include them.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+import shutil
+from pathlib import Path
+from typing import Iterator, List, Sequence
+
+import ndk.jsonfile
+
+# The file that preloads the cache of a seeded build directory.
+INITIAL_CACHE = "initial-cache.cmake"
+
+# CMake reads these from CMakeFiles/<version> instead of redetecting them.
+DETECTION_FILE_PATTERNS = ("CMakeSystem.cmake", "CMake*Compiler.cmake")
+
+CACHE_ENTRY_RE = re.compile(r'^("?)(?P<name>[^"]+?)\1:(?P<type>[A-Z]+)=(?P<value>.*)$')
+
+
+def logger() -> logging.Logger:
+    """Returns the module logger."""
+    return logging.getLogger(__name__)
+
+
+def _file_identity(path: Path) -> str:
+    try:
+        path = path.resolve()
+        info = path.stat()
+    except OSError:
+        return f"{path}\0missing"
+    return f"{path}\0{info.st_size}\0{info.st_mtime_ns}"
+
+
+def _ndk_identity(ndk_path: Path) -> List[str]:
+    """Returns strings that change when the NDK's toolchain changes.
+
+    Seeds live in the test out directory, which outlives rebuilds of the NDK at
+    the same path. The detection results depend on the compilers (their IDs,
+    versions and implicit include and link directories), so the key includes
+    the NDK's revision and the identity of its clang. This is only a few stats,
+    so it is cheap enough to compute for every test.
+    """
+    try:
+        source_properties = (ndk_path / "source.properties").read_text(encoding="utf-8")
+    except OSError:
+        source_properties = ""
+    compilers = sorted(ndk_path.glob("toolchains/llvm/prebuilt/*/bin/clang")) + sorted(
+        ndk_path.glob("toolchains/llvm/prebuilt/*/bin/clang.exe")
+    )
+    return [source_properties] + [_file_identity(p) for p in compilers]
+
+
+def seed_key(cmake: Path, ndk_path: Path, toolchain_args: Sequence[str]) -> str:
+    """Returns the key of the seed for the given toolchain settings.
+
+    Args:
+        cmake: The CMake used to configure the test.
+        ndk_path: The NDK the test is built with.
+        toolchain_args: Every argument to CMake that isn't specific to the
+            test, such as the toolchain file, the ABI and the extra flags.
+    """
+    return hashlib.sha256(
+        json.dumps(
+            [_file_identity(cmake), _ndk_identity(ndk_path), list(toolchain_args)]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def _quote(value: str) -> str:
+    value = value.replace("\\", "\\\\").replace('"', '\\"').replace("$", "\\$")
+    return f'"{value}"'
+
+
+def _detected_cache_entries(cache_file: Path) -> Iterator[tuple[str, str]]:
+    """Yields the programs found while detecting the toolchain."""
+    with cache_file.open(encoding="utf-8") as cache:
+        for line in cache:
+            match = CACHE_ENTRY_RE.match(line.rstrip("\n"))
+            if match is None:
+                continue
+            if match["type"] == "FILEPATH" and match["name"].startswith("CMAKE_"):
+                yield match["name"], match["value"]
+
+
+def _detection_files(build_dir: Path) -> Iterator[Path]:
+    files_dir = build_dir / "CMakeFiles"
+    for pattern in DETECTION_FILE_PATTERNS:
+        yield from files_dir.glob(f"*/{pattern}")
+
+
+class CMakeSeed:
+    """The toolchain detection results for one set of toolchain settings.
+
+    Seeds are used by many build workers at once. Each file in a seed is
+    replaced atomically, and a seed that is missing some languages only causes
+    those languages to be detected again.
+    """
+
+    def __init__(self, seed_dir: Path) -> None:
+        self.seed_dir = seed_dir
+
+    def apply(self, build_dir: Path) -> List[str]:
+        """Seeds a build directory that has not been configured yet.
+
+        Returns:
+            The arguments to pass to CMake to use the seed. The list is empty if
+            there is no seed yet.
+        """
+        initial_cache = self.seed_dir / INITIAL_CACHE
+        if not initial_cache.exists():
+            return []
+        for version_dir in self.seed_dir.iterdir():
+            if not version_dir.is_dir():
+                continue
+            dst_dir = build_dir / "CMakeFiles" / version_dir.name
+            dst_dir.mkdir(parents=True, exist_ok=True)
+            for path in version_dir.iterdir():
+                if not path.name.startswith("."):
+                    shutil.copyfile(path, dst_dir / path.name)
+        return ["-C", str(initial_cache)]
+
+    def update(self, build_dir: Path) -> None:
+        """Updates the seed from a successfully configured build directory.
+
+        The seed is only written if the build directory detected something that
+        the seed doesn't have, so this is cheap for seeded build directories.
+        """
+        new_files = [
+            path
+            for path in _detection_files(build_dir)
+            if not (self.seed_dir / path.parent.name / path.name).exists()
+        ]
+        if not new_files:
+            return
+        try:
+            for path in new_files:
+                version_dir = self.seed_dir / path.parent.name
+                version_dir.mkdir(parents=True, exist_ok=True)
+                contents = path.read_text(encoding="utf-8")
+                with ndk.jsonfile.atomic_write(version_dir / path.name) as seed_file:
+                    seed_file.write(contents)
+            # The cache of a seeded build directory includes the entries of the
+            # seed it was configured with, so this never loses any.
+            lines = [
+                f"set({name} {_quote(value)} CACHE FILEPATH {_quote('')})"
+                for name, value in _detected_cache_entries(build_dir / "CMakeCache.txt")
+            ]
+            # Without this CMake ignores CMakeFiles/<version> and detects
+            # everything again, since it assumes a build directory without a
+            # cache has no detection results.
+            lines.append('set(CMAKE_PLATFORM_INFO_INITIALIZED 1 CACHE INTERNAL "")')
+            with ndk.jsonfile.atomic_write(self.seed_dir / INITIAL_CACHE) as cache:
+                cache.write("\n".join(lines) + "\n")
+        except OSError as ex:
+            logger().warning("Could not update CMake seed %s: %s", self.seed_dir, ex)
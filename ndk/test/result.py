@@ -35,6 +35,11 @@ class ResultTranslations:
 class TestResult:
     def __init__(self, test: Test):
         self.test = test
+        # Wall time in seconds taken to produce this result, if it was measured.
+        self.duration: float | None = None
+        # True if this result was restored from the test build cache rather than
+        # produced by running the test.
+        self.cached = False
 
     def __repr__(self) -> str:
         return self.to_string(colored=False)
@@ -97,7 +102,8 @@ class Success(TestResult):
         self, tr: ResultTranslations = ResultTranslations(), colored: bool = False
     ) -> str:
         label = ndk.termcolor.maybe_color(tr.success, "green", colored)
-        return f"{label} {self.test}"
+        cached = " (cached)" if self.cached else ""
+        return f"{label} {self.test}{cached}"
 
 
 class Skipped(TestResult):
@@ -50,6 +50,7 @@ class TestOptions:
         clean: bool = True,
         build_report: Optional[str] = None,
         package_path: Optional[Path] = None,
+        build_cache_dir: Optional[Path] = None,
     ) -> None:
         """Initializes a TestOptions object.
 
@@ -61,6 +62,8 @@ class TestOptions:
             clean: True if the out directory should be cleaned before building.
             build_report: Path to write a build report to, if any.
             package_path: Path (without extension) to package the tests.
+            build_cache_dir: Path to the test build cache, if tests that have
+                not changed since they were last built should not be rebuilt.
         """
         self.src_dir = src_dir
         self.ndk_path = ndk_path
@@ -69,6 +72,7 @@ class TestOptions:
         self.clean = clean
         self.build_report = build_report
         self.package_path = package_path
+        self.build_cache_dir = build_cache_dir
 
 
 class TestSpec:
@@ -0,0 +1,132 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.test.buildcache."""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.abis import Abi
+from ndk.test.buildcache import TestBuildCache
+from ndk.test.buildtest.case import NdkBuildTest
+from ndk.test.result import Failure, Success
+from ndk.test.spec import BuildConfiguration, CMakeToolchainFile, WeakSymbolsConfig
+
+
+class TestBuildCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+        self.ndk = self.temp_dir / "ndk"
+        (self.ndk / "build").mkdir(parents=True)
+        (self.ndk / "build/ndk-build").write_text("make")
+        self.test_dir = self.temp_dir / "src/foo"
+        (self.test_dir / "jni").mkdir(parents=True)
+        (self.test_dir / "jni/Android.mk").write_text("include $(BUILD_SHARED_LIBRARY)")
+        self.obj_dir = self.temp_dir / "out/obj"
+        self.dist_dir = self.temp_dir / "out/dist"
+        self.cache_dir = self.temp_dir / "cache"
+        self.test = self.make_test(self.test_dir)
+
+    def make_test(self, test_dir: Path) -> NdkBuildTest:
+        config = BuildConfiguration(
+            Abi("arm64-v8a"),
+            None,
+            CMakeToolchainFile.Default,
+            WeakSymbolsConfig.StrictAPI,
+        )
+        return NdkBuildTest(test_dir.name, test_dir, config, self.ndk, dist=True)
+
+    def make_cache(self) -> TestBuildCache:
+        return TestBuildCache(self.cache_dir, self.ndk, [])
+
+    def build(self) -> Path:
+        output = self.test.get_build_outputs(self.obj_dir, self.dist_dir)[0]
+        (output / "arm64-v8a").mkdir(parents=True)
+        (output / "arm64-v8a/libfoo.so").write_text("foo")
+        return output
+
+    def test_restore(self) -> None:
+        cache = self.make_cache()
+        key = cache.key_for(self.test)
+        self.assertIsNone(cache.restore(self.test, key, self.obj_dir, self.dist_dir))
+
+        output = self.build()
+        cache.store(self.test, key, Success(self.test), self.obj_dir, self.dist_dir)
+        (output / "arm64-v8a/libfoo.so").unlink()
+
+        result = cache.restore(self.test, key, self.obj_dir, self.dist_dir)
+        assert result is not None
+        self.assertIsInstance(result, Success)
+        self.assertTrue(result.cached)
+        self.assertEqual("foo", (output / "arm64-v8a/libfoo.so").read_text())
+
+    def test_restore_failure(self) -> None:
+        cache = self.make_cache()
+        key = cache.key_for(self.test)
+        self.build()
+        cache.store(
+            self.test, key, Failure(self.test, "error"), self.obj_dir, self.dist_dir
+        )
+        result = cache.restore(self.test, key, self.obj_dir, self.dist_dir)
+        assert isinstance(result, Failure)
+        self.assertEqual("error", result.message)
+
+    def test_key_depends_on_sources(self) -> None:
+        cache = self.make_cache()
+        key = cache.key_for(self.test)
+        (self.test_dir / "jni/foo.cpp").write_text("")
+        self.assertNotEqual(key, cache.key_for(self.test))
+
+    def test_key_depends_on_config(self) -> None:
+        cache = self.make_cache()
+        other = self.make_test(self.test_dir)
+        other.config = other.config.with_api(33)
+        self.assertNotEqual(cache.key_for(self.test), cache.key_for(other))
+
+    def test_key_depends_on_ndk_contents(self) -> None:
+        key = self.make_cache().key_for(self.test)
+
+        # Rewriting the NDK without changing it doesn't invalidate the cache.
+        ndk_build = self.ndk / "build/ndk-build"
+        ndk_build.write_text("make")
+        os.utime(ndk_build, (0, 0))
+        (self.ndk / "build/__pycache__").mkdir()
+        (self.ndk / "build/__pycache__/foo.pyc").write_text("")
+        self.assertEqual(key, self.make_cache().key_for(self.test))
+
+        ndk_build.write_text("gmake")
+        self.assertNotEqual(key, self.make_cache().key_for(self.test))
+
+    def test_prune(self) -> None:
+        cache = self.make_cache()
+        self.build()
+        keys = []
+        for i in range(TestBuildCache.MAX_ENTRIES_PER_TEST + 1):
+            (self.test_dir / "jni/foo.cpp").write_text(str(i))
+            keys.append(cache.key_for(self.test))
+            cache.store(
+                self.test, keys[-1], Success(self.test), self.obj_dir, self.dist_dir
+            )
+            entry = self.cache_dir / self.test.get_build_dir(Path()) / keys[-1]
+            os.utime(entry, ns=(i, i))
+        self.assertIsNone(
+            cache.restore(self.test, keys[0], self.obj_dir, self.dist_dir)
+        )
+        self.assertIsNotNone(
+            cache.restore(self.test, keys[-1], self.obj_dir, self.dist_dir)
+        )
@@ -0,0 +1,168 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.test.buildtest.cmakeseed."""
+import re
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.test.buildtest.cmakeseed import INITIAL_CACHE, CMakeSeed, seed_key
+
+CMAKE = shutil.which("cmake")
+
+
+def read_cache(build_dir: Path) -> dict[str, str]:
+    entries = {}
+    for line in (build_dir / "CMakeCache.txt").read_text().splitlines():
+        if match := re.match(r"^(CMAKE_[A-Z_]+):FILEPATH=(.*)$", line):
+            entries[match[1]] = match[2]
+    return entries
+
+
+class CMakeSeedTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+        self.seed = CMakeSeed(self.temp_dir / "seed")
+
+    def make_build_dir(self, name: str, languages: str) -> Path:
+        build_dir = self.temp_dir / name / "build"
+        (build_dir / "CMakeFiles/3.0.0").mkdir(parents=True)
+        for language in languages.split():
+            (build_dir / f"CMakeFiles/3.0.0/CMake{language}Compiler.cmake").write_text(
+                language
+            )
+        (build_dir / "CMakeFiles/3.0.0/CMakeSystem.cmake").write_text("system")
+        (build_dir / "CMakeCache.txt").write_text(
+            "// Archiver\n"
+            "CMAKE_AR:FILEPATH=/ndk/bin/llvm-ar\n"
+            'CMAKE_STRIP:FILEPATH=C:/Program Files/"$strip"\n'
+            "CMAKE_PROJECT_NAME:STATIC=foo\n"
+            "foo_SOURCE_DIR:STATIC=/src/foo\n"
+        )
+        return build_dir
+
+    def test_key(self) -> None:
+        ndk = self.temp_dir / "ndk"
+        self.assertEqual(
+            seed_key(Path("cmake"), ndk, ["-DANDROID_ABI=x86"]),
+            seed_key(Path("cmake"), ndk, ["-DANDROID_ABI=x86"]),
+        )
+        self.assertNotEqual(
+            seed_key(Path("cmake"), ndk, ["-DANDROID_ABI=x86"]),
+            seed_key(Path("cmake"), ndk, ["-DANDROID_ABI=x86_64"]),
+        )
+
+    def test_key_depends_on_tools(self) -> None:
+        ndk = self.temp_dir / "ndk"
+        clang = ndk / "toolchains/llvm/prebuilt/linux-x86_64/bin/clang"
+        clang.parent.mkdir(parents=True)
+        clang.write_text("clang")
+        (ndk / "source.properties").write_text("Pkg.Revision = 26.0.1\n")
+        cmake = self.temp_dir / "cmake"
+        cmake.write_text("cmake")
+
+        def key() -> str:
+            return seed_key(cmake, ndk, ["-DANDROID_ABI=x86"])
+
+        # The NDK is rebuilt at the same path with a new compiler.
+        old_key = key()
+        clang.write_text("new clang")
+        self.assertNotEqual(old_key, key())
+
+        old_key = key()
+        (ndk / "source.properties").write_text("Pkg.Revision = 26.0.2\n")
+        self.assertNotEqual(old_key, key())
+
+        old_key = key()
+        cmake.write_text("new cmake")
+        self.assertNotEqual(old_key, key())
+        self.assertEqual(key(), key())
+
+    def test_no_seed(self) -> None:
+        build_dir = self.temp_dir / "build"
+        self.assertEqual([], self.seed.apply(build_dir))
+        self.assertFalse(build_dir.exists())
+
+    def test_update_and_apply(self) -> None:
+        self.seed.update(self.make_build_dir("a", "CXX"))
+        initial_cache = (self.seed.seed_dir / INITIAL_CACHE).read_text()
+        self.assertIn(
+            'set(CMAKE_AR "/ndk/bin/llvm-ar" CACHE FILEPATH "")', initial_cache
+        )
+        self.assertIn(r'"C:/Program Files/\"\$strip\""', initial_cache)
+        self.assertNotIn("foo", initial_cache)
+
+        build_dir = self.temp_dir / "b/build"
+        self.assertEqual(
+            ["-C", str(self.seed.seed_dir / INITIAL_CACHE)], self.seed.apply(build_dir)
+        )
+        self.assertEqual(
+            "CXX", (build_dir / "CMakeFiles/3.0.0/CMakeCXXCompiler.cmake").read_text()
+        )
+
+    def test_update_adds_languages(self) -> None:
+        self.seed.update(self.make_build_dir("a", "CXX"))
+        initial_cache = self.seed.seed_dir / INITIAL_CACHE
+        mtime = initial_cache.stat().st_mtime_ns
+
+        # Nothing new, so the seed isn't rewritten.
+        self.seed.update(self.make_build_dir("b", "CXX"))
+        self.assertEqual(mtime, initial_cache.stat().st_mtime_ns)
+
+        self.seed.update(self.make_build_dir("c", "C CXX"))
+        self.assertEqual(
+            ["CMakeCCompiler.cmake", "CMakeCXXCompiler.cmake", "CMakeSystem.cmake"],
+            sorted(p.name for p in (self.seed.seed_dir / "3.0.0").iterdir()),
+        )
+
+    @unittest.skipIf(CMAKE is None, "needs cmake")
+    def test_cmake(self) -> None:
+        assert CMAKE is not None
+
+        def configure(name: str, languages: str, seed: bool) -> str:
+            src_dir = self.temp_dir / name
+            src_dir.mkdir()
+            (src_dir / "CMakeLists.txt").write_text(
+                f"cmake_minimum_required(VERSION 3.6)\nproject({name} {languages})\n"
+            )
+            build_dir = src_dir / "build"
+            args = self.seed.apply(build_dir) if seed else []
+            output = subprocess.run(
+                [CMAKE, f"-H{src_dir}", f"-B{build_dir}"] + args,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            if seed:
+                self.seed.update(build_dir)
+            return output
+
+        configure("a", "CXX", seed=True)
+        output = configure("b", "C CXX", seed=True)
+        self.assertNotIn("CXX compiler identification", output)
+        self.assertIn("C compiler identification", output)
+
+        output = configure("c", "C CXX", seed=True)
+        self.assertNotIn("compiler identification", output)
+
+        configure("d", "C CXX", seed=False)
+        self.assertEqual(
+            read_cache(self.temp_dir / "d/build"), read_cache(self.temp_dir / "c/build")
+        )
@@ -25,7 +25,16 @@ from threading import Event
 from types import FrameType
 from typing import Optional
 
-from ndk.workqueue import BasicWorkQueue, TaskError, Worker, WorkQueue
+from ndk.tasktrace import TaskTracer
+from ndk.workqueue import (
+    BasicWorkQueue,
+    ShardingGroup,
+    ShardingWorkQueue,
+    TaskError,
+    Transport,
+    Worker,
+    WorkQueue,
+)
 
 
 def put(_worker: Worker, i: int) -> int:
@@ -63,9 +72,14 @@ def sigterm_handler(_signum: int, _trace: Optional[FrameType]) -> None:
 
 
 def sleep_until_sigterm(pid_queue: Queue[int]) -> None:
-    """Sleeps until signalled, then passes the PID through the queue."""
-    signal.signal(signal.SIGTERM, sigterm_handler)
+    """Passes the PID through the queue and sleeps until signalled.
+
+    The PID is passed through the queue again once the process is signalled.
+    The SIGTERM handler must already be installed, or the caller may signal the
+    process before it is ready to report it.
+    """
     try:
+        pid_queue.put(os.getpid())
         while True:
             time.sleep(60)  # There is no signal.pause() on Windows :(
     finally:
@@ -80,11 +94,17 @@ def spawn_child(_worker: Worker, pid_queue: Queue[int]) -> None:
     PIDs will be passed through the queue again to inform the caller that both
     processes were signalled.
     """
+    signal.signal(signal.SIGTERM, sigterm_handler)
     os.fork()
-    pid_queue.put(os.getpid())
     sleep_until_sigterm(pid_queue)
 
 
+def get_shard(worker: Worker) -> str:
+    """Returns the shard that the worker belongs to."""
+    shard: str = worker.data[0]
+    return shard
+
+
 def raise_error(_worker: Worker) -> None:
     """Raises a RuntimeError to be re-raised in the caller."""
     raise RuntimeError("Error in child")
@@ -93,9 +113,11 @@ def raise_error(_worker: Worker) -> None:
 class WorkQueueTest(unittest.TestCase):
     """Tests for WorkQueue."""
 
+    transport = Transport.PIPE
+
     def test_put_func(self) -> None:
         """Test that we can pass a function to the queue and get results."""
-        workqueue = WorkQueue(4)
+        workqueue = WorkQueue(4, transport=self.transport)
 
         workqueue.add_task(put, 1)
         workqueue.add_task(put, 2)
@@ -111,7 +133,7 @@ class WorkQueueTest(unittest.TestCase):
 
     def test_put_functor(self) -> None:
         """Test that we can pass a functor to the queue and get results."""
-        workqueue = WorkQueue(4)
+        workqueue = WorkQueue(4, transport=self.transport)
 
         workqueue.add_task(Functor(1))
         workqueue.add_task(Functor(2))
@@ -127,7 +149,7 @@ class WorkQueueTest(unittest.TestCase):
 
     def test_finished(self) -> None:
         """Tests that finished() returns the correct result."""
-        workqueue = WorkQueue(4)
+        workqueue = WorkQueue(4, transport=self.transport)
         self.assertTrue(workqueue.finished())
 
         manager = multiprocessing.Manager()
@@ -144,7 +166,7 @@ class WorkQueueTest(unittest.TestCase):
 
     def test_status(self) -> None:
         """Tests that worker status can be accessed from the parent."""
-        workqueue = WorkQueue(1)
+        workqueue = WorkQueue(1, transport=self.transport)
 
         manager = multiprocessing.Manager()
         ready_event = manager.Event()
@@ -162,7 +184,7 @@ class WorkQueueTest(unittest.TestCase):
 
     def test_subprocesses_killed(self) -> None:
         """Tests that terminate() kills descendents of worker processes."""
-        workqueue = WorkQueue(4)
+        workqueue = WorkQueue(4, transport=self.transport)
 
         manager = multiprocessing.Manager()
         queue = manager.Queue()
@@ -184,12 +206,181 @@ class WorkQueueTest(unittest.TestCase):
 
     def test_subprocess_exception(self) -> None:
         """Tests that exceptions raised in the task are re-raised."""
-        workqueue = WorkQueue()
+        workqueue = WorkQueue(transport=self.transport)
+
+        try:
+            workqueue.add_task(raise_error)
+            with self.assertRaises(TaskError):
+                workqueue.get_result()
+        finally:
+            workqueue.terminate()
+            workqueue.join()
+
+    def test_long_status(self) -> None:
+        """Tests that overlong statuses are truncated rather than rejected."""
+        workqueue = WorkQueue(1, transport=self.transport)
+        try:
+            worker = workqueue.workers[0]
+            worker.status = "x" * (Worker.MAX_STATUS_SIZE * 2)
+            self.assertEqual("x" * Worker.MAX_STATUS_SIZE, worker.status)
+        finally:
+            workqueue.terminate()
+            workqueue.join()
+
+    def test_many_tasks(self) -> None:
+        """Tests that queueing more tasks than fit in a pipe does not block."""
+        workqueue = WorkQueue(2, transport=self.transport)
+        try:
+            for i in range(2000):
+                workqueue.add_task(put, i)
+            results: list[int] = []
+            while not workqueue.finished():
+                results.extend(workqueue.get_results())
+            self.assertEqual(list(range(2000)), sorted(results))
+        finally:
+            workqueue.terminate()
+            workqueue.join()
+
+    def test_priority(self) -> None:
+        """Tests that higher priority tasks are started first."""
+        workqueue = WorkQueue(1, transport=self.transport)
+        try:
+            manager = multiprocessing.Manager()
+            event = manager.Event()
+            # Occupies the worker. The next task fills the dispatch window, so
+            # everything after that is ordered by the scheduler.
+            workqueue.add_task(block_on_event, event)
+            workqueue.add_task(put, 1)
+            workqueue.add_task_with_priority(3, put, 3)
+            workqueue.add_task(put, 0)
+            workqueue.add_task_with_priority(5, put, 5)
+            workqueue.add_task_with_priority(3, put, 4)
+            event.set()
+            results = [workqueue.get_result() for _ in range(6)]
+            self.assertEqual([None, 1, 5, 3, 4, 0], results)
+        finally:
+            workqueue.terminate()
+            workqueue.join()
 
+    def test_resize(self) -> None:
+        """Tests that workers can be added and removed between tasks."""
+        workqueue = WorkQueue(1, transport=self.transport)
         try:
             workqueue.add_task(raise_error)
             with self.assertRaises(TaskError):
                 workqueue.get_result()
+            self.assertTrue(workqueue.finished())
+
+            # Workers survive errors in tasks.
+            self.assertTrue(workqueue.workers[0].is_alive())
+            workqueue.resize(3)
+            self.assertEqual(3, len(workqueue.workers))
+            self.assertTrue(all(w.is_alive() for w in workqueue.workers))
+
+            workqueue.resize(1)
+            self.assertEqual(1, len(workqueue.workers))
+            workqueue.add_task(put, 1)
+            self.assertEqual(1, workqueue.get_result())
+
+            workqueue.add_task(block_on_event, multiprocessing.Manager().Event())
+            with self.assertRaises(RuntimeError):
+                workqueue.resize(2)
+        finally:
+            workqueue.terminate()
+            workqueue.join()
+
+    def test_tracer(self) -> None:
+        """Tests that task timing is reported to the tracer."""
+        tracer = TaskTracer()
+        workqueue = WorkQueue(2, transport=self.transport, tracer=tracer, name="test")
+        try:
+            workqueue.add_task(put, 1)
+            workqueue.add_task(Functor(2))
+            workqueue.get_result()
+            workqueue.get_result()
+        finally:
+            workqueue.terminate()
+            workqueue.join()
+
+        worker_pids = tracer.workers["test"]
+        self.assertEqual(2, len(worker_pids))
+        records = tracer.finished_records
+        self.assertEqual(
+            {"put", "Functor"}, {r.timing.name for r in records if r.timing}
+        )
+        for record in records:
+            assert record.timing is not None
+            self.assertEqual("test", record.queue)
+            self.assertIn(record.timing.worker, worker_pids)
+            self.assertLessEqual(record.queued, record.timing.started)
+            self.assertLessEqual(record.timing.started, record.timing.finished)
+
+
+class ManagerWorkQueueTest(WorkQueueTest):
+    """Tests for WorkQueue using the Manager transport."""
+
+    transport = Transport.MANAGER
+
+
+class Group(ShardingGroup[str]):
+    """A sharding group with a single shard of the same name."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    @property
+    def shards(self) -> list[str]:
+        return [self.name]
+
+    def __str__(self) -> str:
+        return self.name
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Group) and self.name == other.name
+
+    def __hash__(self) -> int:
+        return hash(self.name)
+
+
+class ShardingWorkQueueTest(unittest.TestCase):
+    """Tests for ShardingWorkQueue."""
+
+    def test_groups(self) -> None:
+        """Tests that tasks are run by the group they were added to."""
+        a = Group("a")
+        b = Group("b")
+        workqueue: ShardingWorkQueue[str, str] = ShardingWorkQueue([a, b], 2)
+        try:
+            for _ in range(4):
+                workqueue.add_task(a, get_shard)
+            workqueue.add_task(b, get_shard)
+            results = []
+            while not workqueue.finished():
+                results.extend(workqueue.get_results())
+            self.assertEqual(["a", "a", "a", "a", "b"], sorted(results))
+        finally:
+            workqueue.terminate()
+            workqueue.join()
+
+    def test_any_group(self) -> None:
+        """Tests that shared tasks are taken by whichever group is free."""
+        a = Group("a")
+        b = Group("b")
+        workqueue: ShardingWorkQueue[Optional[str], str] = ShardingWorkQueue([a, b], 1)
+        try:
+            manager = multiprocessing.Manager()
+            event = manager.Event()
+            # Fills every slot in group a's dispatch window.
+            for _ in range(workqueue.max_dispatched[a]):
+                workqueue.add_task(a, block_on_event, event)
+            for _ in range(5):
+                workqueue.add_task_for_any_group([a, b], 0, get_shard)
+            self.assertEqual(["b"] * 5, [workqueue.get_result() for _ in range(5)])
+            event.set()
+            results = []
+            while not workqueue.finished():
+                results.extend(workqueue.get_results())
+            self.assertEqual([None] * workqueue.max_dispatched[a], results)
         finally:
             workqueue.terminate()
             workqueue.join()
@@ -230,6 +421,15 @@ class BasicWorkQueueTest(unittest.TestCase):
         workqueue.terminate()
         workqueue.join()
 
+    def test_priority(self) -> None:
+        """Tests that higher priority tasks are run first."""
+        workqueue: BasicWorkQueue[int] = BasicWorkQueue()
+
+        workqueue.add_task(put, 1)
+        workqueue.add_task_with_priority(2, put, 2)
+        workqueue.add_task(put, 3)
+        self.assertEqual([2, 1, 3], [workqueue.get_result() for _ in range(3)])
+
     def test_finished(self) -> None:
         """Tests that finished() returns the correct result."""
         workqueue = WorkQueue()
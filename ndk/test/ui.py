@@ -67,7 +67,7 @@ class TestProgressUi(Ui):
                 group_id = f"{len(group.shards)} devices {group}"
                 lines.append(
                     "{: >{width}} {}".format(
-                        self.workqueue.task_queues[group].qsize(),
+                        self.workqueue.num_queued(group),
                         group_id,
                         width=self.NUM_TESTS_DIGITS,
                     )
@@ -0,0 +1,114 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.archive."""
+import io
+import os
+import stat
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+import ndk.archive
+from ndk.archive import make_zip, walk_archive_entries, write_tar, write_zip
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+        self.ndk = self.temp_dir / "android-ndk"
+        (self.ndk / "bin").mkdir(parents=True)
+        (self.ndk / "empty").mkdir()
+        clang = self.ndk / "bin/clang"
+        clang.write_text("clang " * 1000)
+        clang.chmod(0o755)
+        (self.ndk / "bin/clang++").symlink_to("clang")
+        (self.ndk / "random").write_bytes(os.urandom(4096))
+        (self.ndk / "zero").write_bytes(b"")
+
+    def test_walk(self) -> None:
+        names = [
+            e.arcname
+            for e in walk_archive_entries(self.temp_dir, ["android-ndk"], True)
+        ]
+        self.assertEqual(
+            [
+                "android-ndk",
+                "android-ndk/bin",
+                "android-ndk/bin/clang",
+                "android-ndk/bin/clang++",
+                "android-ndk/empty",
+                "android-ndk/random",
+                "android-ndk/zero",
+            ],
+            names,
+        )
+
+    def test_zip(self) -> None:
+        zip_file = make_zip(self.temp_dir / "ndk", self.temp_dir, ["android-ndk"], True)
+        with zipfile.ZipFile(zip_file) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertTrue(archive.getinfo("android-ndk/empty/").is_dir())
+            clang = archive.getinfo("android-ndk/bin/clang")
+            self.assertEqual(zipfile.ZIP_DEFLATED, clang.compress_type)
+            self.assertEqual(0o755, stat.S_IMODE(clang.external_attr >> 16))
+            self.assertEqual((self.ndk / "bin/clang").read_bytes(), archive.read(clang))
+            link = archive.getinfo("android-ndk/bin/clang++")
+            self.assertTrue(stat.S_ISLNK(link.external_attr >> 16))
+            self.assertEqual(b"clang", archive.read(link))
+            self.assertEqual(
+                zipfile.ZIP_STORED, archive.getinfo("android-ndk/random").compress_type
+            )
+            self.assertEqual(b"", archive.read("android-ndk/zero"))
+
+    def test_zip_flattens_symlinks(self) -> None:
+        zip_file = make_zip(
+            self.temp_dir / "ndk", self.temp_dir, ["android-ndk"], False
+        )
+        with zipfile.ZipFile(zip_file) as archive:
+            link = archive.getinfo("android-ndk/bin/clang++")
+            self.assertTrue(stat.S_ISREG(link.external_attr >> 16))
+            self.assertEqual(archive.read("android-ndk/bin/clang"), archive.read(link))
+
+    def test_zip64(self) -> None:
+        zip_file = self.temp_dir / "ndk.zip"
+        entries = walk_archive_entries(self.temp_dir, ["android-ndk"], True)
+        with mock.patch.object(ndk.archive, "ZIP64_LIMIT", 100):
+            write_zip(zip_file, entries, jobs=2)
+        with zipfile.ZipFile(zip_file) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(len(entries), len(archive.infolist()))
+            self.assertEqual(
+                (self.ndk / "random").read_bytes(), archive.read("android-ndk/random")
+            )
+
+    def test_tar(self) -> None:
+        output = io.BytesIO()
+        entries = walk_archive_entries(self.temp_dir, ["android-ndk"], True)
+        write_tar(output, entries, preserve_symlinks=True)
+        output.seek(0)
+        with tarfile.open(fileobj=output) as archive:
+            self.assertEqual([e.arcname for e in entries], archive.getnames())
+            link = archive.getmember("android-ndk/bin/clang++")
+            self.assertTrue(link.issym())
+            self.assertEqual("clang", link.linkname)
+            clang = archive.extractfile("android-ndk/bin/clang")
+            assert clang is not None
+            self.assertEqual((self.ndk / "bin/clang").read_bytes(), clang.read())
@@ -0,0 +1,138 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.buildcache."""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List, Optional
+
+from ndk.buildcache import BuildCache, fingerprint
+from ndk.builds import BuildContext, Module
+from ndk.hosts import Host
+
+
+class FakeModule(Module):
+    name = "fake"
+    install_path = Path("fake")
+    no_notice = True
+
+    def __init__(self, src: Path, deps: Optional[set[str]] = None) -> None:
+        super().__init__()
+        self.src = src
+        if deps is not None:
+            self.deps = deps
+
+    @property
+    def build_inputs(self) -> Optional[List[Path]]:
+        return [self.src]
+
+    @property
+    def build_outputs(self) -> List[Path]:
+        return [self.intermediate_out_dir / "out", self.intermediate_out_dir / "f"]
+
+    def build(self) -> None:
+        out = self.intermediate_out_dir / "out"
+        out.mkdir(parents=True, exist_ok=True)
+        (out / "a.txt").write_text((self.src / "a.c").read_text())
+        (self.intermediate_out_dir / "f").write_text("file")
+
+
+class BuildCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+        self.src = self.temp_dir / "src"
+        self.src.mkdir()
+        (self.src / "a.c").write_text("int a;")
+        self.module = FakeModule(self.src)
+        self.module.context = BuildContext(
+            self.temp_dir / "out", self.temp_dir / "dist", [], Host.current(), 0
+        )
+        self.cache = BuildCache(self.temp_dir / "cache", [], 0)
+
+    def test_fingerprint(self) -> None:
+        before = fingerprint([self.src])
+        self.assertEqual(before, fingerprint([self.src]))
+        (self.src / ".git").mkdir()
+        self.assertEqual(before, fingerprint([self.src]))
+        (self.src / "b.c").write_text("int b;")
+        self.assertNotEqual(before, fingerprint([self.src]))
+
+    def test_fingerprint_detects_modification(self) -> None:
+        before = fingerprint([self.src])
+        path = self.src / "a.c"
+        path.write_text("int b;")
+        info = path.stat()
+        os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns + 1_000_000_000))
+        self.assertNotEqual(before, fingerprint([self.src]))
+
+    def test_round_trip(self) -> None:
+        key = self.cache.key_for(self.module)
+        assert key is not None
+        self.assertFalse(self.cache.restore(self.module, key))
+
+        self.module.build()
+        self.cache.store(self.module, key)
+        out_dir = self.module.intermediate_out_dir
+        (out_dir / "out/a.txt").write_text("stale")
+        (out_dir / "out/extra.txt").write_text("stale")
+
+        self.assertEqual(key, self.cache.key_for(self.module))
+        self.assertTrue(self.cache.restore(self.module, key))
+        self.assertEqual("int a;", (out_dir / "out/a.txt").read_text())
+        self.assertFalse((out_dir / "out/extra.txt").exists())
+        self.assertEqual("file", (out_dir / "f").read_text())
+
+    def test_key_changes(self) -> None:
+        key = self.cache.key_for(self.module)
+        self.assertEqual(
+            key, BuildCache(self.temp_dir / "cache", [], 0).key_for(self.module)
+        )
+        self.assertNotEqual(
+            key, BuildCache(self.temp_dir / "cache", [], 1).key_for(self.module)
+        )
+        (self.src / "b.c").write_text("int b;")
+        self.assertNotEqual(key, self.cache.key_for(self.module))
+
+    def test_dependency_keys(self) -> None:
+        module = FakeModule(self.src, deps={"dep"})
+        module.context = self.module.context
+        dep = FakeModule(self.src)
+        dep.name = "dep"
+        self.assertIsNone(self.cache.key_for(module))
+
+        self.cache.set_key(dep, "1")
+        key = self.cache.key_for(module)
+        self.assertIsNotNone(key)
+        self.cache.set_key(dep, "2")
+        self.assertNotEqual(key, self.cache.key_for(module))
+
+    def test_undeclared_inputs(self) -> None:
+        module = Module.__new__(Module)
+        self.assertIsNone(self.cache.key_for(module))
+
+    def test_prune(self) -> None:
+        self.module.build()
+        keys = [str(i) for i in range(BuildCache.MAX_ENTRIES_PER_MODULE + 2)]
+        for i, key in enumerate(keys):
+            self.cache.store(self.module, key)
+            entry = self.temp_dir / "cache/fake" / key
+            os.utime(entry, ns=(i * 1_000_000_000, i * 1_000_000_000))
+        self.cache.prune(self.module)
+        remaining = sorted(p.name for p in (self.temp_dir / "cache/fake").iterdir())
+        self.assertEqual(keys[-BuildCache.MAX_ENTRIES_PER_MODULE :], remaining)
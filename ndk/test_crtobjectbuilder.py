@@ -0,0 +1,74 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.crtobjectbuilder."""
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from elfnote_testing import make_android_ident_elf
+from ndk.abis import Abi
+from ndk.crtobjectbuilder import CrtObjectBuilder
+from ndk.platforms import ALL_API_LEVELS
+
+
+class FakeCrtObjectBuilder(CrtObjectBuilder):
+    """Writes fake objects rather than running clang."""
+
+    def __init__(self, build_dir: Path) -> None:
+        super().__init__(Path("llvm"), build_dir, 1234, jobs=4)
+        self.built: list[Path] = []
+        self.lock = threading.Lock()
+
+    def build_crt_object(
+        self,
+        dst: Path,
+        srcs: list[Path],
+        api: int,
+        abi: Abi,
+        build_number: int,
+        defines: list[str],
+    ) -> None:
+        dst.write_bytes(make_android_ident_elf(api))
+        with self.lock:
+            self.built.append(dst)
+
+
+class CrtObjectBuilderTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+
+    def test_check_elf_note(self) -> None:
+        obj = self.temp_dir / "crtbegin_so.o"
+        obj.write_bytes(make_android_ident_elf(21))
+        CrtObjectBuilder.check_elf_note(obj, 21)
+        with self.assertRaisesRegex(RuntimeError, "for API 21, expected 23"):
+            CrtObjectBuilder.check_elf_note(obj, 23)
+
+        obj.write_bytes(make_android_ident_elf(None))
+        with self.assertRaisesRegex(RuntimeError, "does not contain NDK ELF note"):
+            CrtObjectBuilder.check_elf_note(obj, 21)
+
+    def test_build(self) -> None:
+        builder = FakeCrtObjectBuilder(self.temp_dir / "crt")
+        builder.build()
+        self.assertEqual(len(builder.artifacts), len(builder.built))
+        self.assertEqual(
+            sorted(p for _, _, p in builder.artifacts), sorted(builder.built)
+        )
+        self.assertEqual(set(ALL_API_LEVELS), {api for _, api, _ in builder.artifacts})
@@ -19,6 +19,7 @@ from typing import Set
 
 from ndk.builds import Module
 from ndk.deps import CyclicDependencyError, DependencyManager
+from ndk.durations import DurationHistory
 
 
 class MockModule(Module):
@@ -91,6 +92,24 @@ class ComplexD(MockModule):
     deps = {"complexA", "complexB"}
 
 
+# A module whose build only needs the build outputs of its dependency, and one
+# that needs its installed files.
+class PipelineLib(MockModule):
+    name = "pipelineLib"
+    deps: Set[str] = set()
+
+
+class PipelineApp(MockModule):
+    name = "pipelineApp"
+    deps = {"pipelineLib"}
+    build_output_deps = {"pipelineLib"}
+
+
+class PipelineUser(MockModule):
+    name = "pipelineUser"
+    deps = {"pipelineLib"}
+
+
 class DependencyManagerTest(unittest.TestCase):
     def test_cyclic_dependency_message(self) -> None:
         """Test that a cycle raises the proper exception."""
@@ -116,7 +135,7 @@ class DependencyManagerTest(unittest.TestCase):
         isolated = Isolated()
         deps = DependencyManager([isolated])
         self.assertSetEqual({isolated}, deps.buildable_modules)
-        self.assertSetEqual({isolated}, deps.get_buildable())
+        self.assertSetEqual({isolated}, set(deps.get_buildable()))
         self.assertSetEqual(set(), deps.buildable_modules)
         deps.complete(isolated)
 
@@ -127,12 +146,12 @@ class DependencyManagerTest(unittest.TestCase):
         deps = DependencyManager([simpleA, simpleB])
         self.assertSetEqual({simpleB}, set(deps.blocked_modules.keys()))
         self.assertSetEqual({simpleA}, deps.buildable_modules)
-        self.assertSetEqual({simpleA}, deps.get_buildable())
+        self.assertSetEqual({simpleA}, set(deps.get_buildable()))
         self.assertSetEqual(set(), deps.buildable_modules)
         deps.complete(simpleA)
         self.assertSetEqual(set(), set(deps.blocked_modules.keys()))
         self.assertSetEqual({simpleB}, deps.buildable_modules)
-        self.assertSetEqual({simpleB}, deps.get_buildable())
+        self.assertSetEqual({simpleB}, set(deps.get_buildable()))
         self.assertSetEqual(set(), deps.buildable_modules)
         deps.complete(simpleB)
 
@@ -147,20 +166,83 @@ class DependencyManagerTest(unittest.TestCase):
             {complexB, complexC, complexD}, set(deps.blocked_modules.keys())
         )
         self.assertSetEqual({complexA}, deps.buildable_modules)
-        self.assertSetEqual({complexA}, deps.get_buildable())
+        self.assertSetEqual({complexA}, set(deps.get_buildable()))
         self.assertSetEqual(set(), deps.buildable_modules)
         deps.complete(complexA)
         self.assertSetEqual({complexD}, set(deps.blocked_modules.keys()))
         self.assertSetEqual({complexB, complexC}, deps.buildable_modules)
-        self.assertSetEqual({complexB, complexC}, deps.get_buildable())
+        self.assertSetEqual({complexB, complexC}, set(deps.get_buildable()))
         self.assertSetEqual(set(), deps.buildable_modules)
         deps.complete(complexC)
         self.assertSetEqual({complexD}, set(deps.blocked_modules.keys()))
         self.assertSetEqual(set(), deps.buildable_modules)
-        self.assertSetEqual(set(), deps.get_buildable())
+        self.assertSetEqual(set(), set(deps.get_buildable()))
         deps.complete(complexB)
         self.assertSetEqual(set(), set(deps.blocked_modules.keys()))
         self.assertSetEqual({complexD}, deps.buildable_modules)
-        self.assertSetEqual({complexD}, deps.get_buildable())
+        self.assertSetEqual({complexD}, set(deps.get_buildable()))
         self.assertSetEqual(set(), deps.buildable_modules)
         deps.complete(complexD)
+
+    def test_critical_path_priority(self) -> None:
+        """Test that modules at the head of longer chains are built first."""
+        complexA = ComplexA()
+        complexB = ComplexB()
+        complexC = ComplexC()
+        complexD = ComplexD()
+        modules = [complexA, complexB, complexC, complexD]
+
+        deps = DependencyManager(modules)
+        self.assertEqual(3.0, deps.priority(complexA))
+        self.assertListEqual([complexA], deps.get_buildable())
+        deps.complete(complexA)
+        self.assertListEqual([complexB, complexC], deps.get_buildable())
+
+        # With no history, as in the first build, every module counts the same.
+        deps = DependencyManager(modules, DurationHistory())
+        self.assertEqual(3.0, deps.priority(complexA))
+        self.assertEqual(1.0, deps.priority(complexD))
+        self.assertListEqual([complexA], deps.get_buildable())
+
+        durations = DurationHistory()
+        durations.record("complexA", 1.0)
+        durations.record("complexB", 1.0)
+        durations.record("complexC", 10.0)
+        durations.record("complexD", 1.0)
+        deps = DependencyManager(modules, durations)
+        self.assertEqual(11.0, deps.priority(complexA))
+        self.assertListEqual([complexA], deps.get_buildable())
+        deps.complete(complexA)
+        self.assertListEqual([complexC, complexB], deps.get_buildable())
+
+    def test_pipelined_install(self) -> None:
+        """Test that builds may start before their dependencies are installed."""
+        lib = PipelineLib()
+        app = PipelineApp()
+        user = PipelineUser()
+        deps = DependencyManager([lib, app, user])
+        self.assertListEqual([lib], deps.get_buildable())
+        self.assertListEqual([], deps.get_installable())
+
+        deps.complete_build(lib)
+        self.assertListEqual([app], deps.get_buildable())
+        self.assertListEqual([lib], deps.get_installable())
+
+        # The app can't be installed until the lib has been. The module object
+        # that was built is the one that gets installed.
+        built_app = PipelineApp()
+        deps.complete_build(built_app)
+        self.assertListEqual([], deps.get_installable())
+
+        deps.complete(lib)
+        self.assertListEqual([user], deps.get_buildable())
+        installable = deps.get_installable()
+        self.assertListEqual([app], installable)
+        self.assertIs(built_app, installable[0])
+        deps.complete(app)
+
+        deps.complete_build(user)
+        self.assertListEqual([user], deps.get_installable())
+        deps.complete(user)
+        self.assertSetEqual(set(), set(deps.blocked_modules.keys()))
+        self.assertDictEqual({}, deps.install_blocked_modules)
@@ -0,0 +1,60 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.durations."""
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.durations import DurationHistory
+
+
+class DurationHistoryTest(unittest.TestCase):
+    def test_estimate(self) -> None:
+        history = DurationHistory()
+        self.assertEqual(1.0, history.estimate("a"))
+        history.record("a", 1.0)
+        history.record("b", 2.0)
+        history.record("c", 10.0)
+        self.assertEqual(10.0, history.estimate("c"))
+        # Unknown tasks are assumed to be typical.
+        self.assertEqual(2.0, history.estimate("d"))
+
+    def test_record_smooths(self) -> None:
+        history = DurationHistory()
+        history.record("a", 10.0)
+        history.record("a", 20.0)
+        self.assertEqual(15.0, history.get("a"))
+
+    def test_round_trip(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "sub/durations.json"
+            history = DurationHistory.load(path)
+            self.assertIsNone(history.get("a"))
+            history.record("a", 3.5)
+            history.save()
+
+            self.assertEqual(3.5, DurationHistory.load(path).get("a"))
+
+    def test_load_corrupt(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "durations.json"
+            path.write_text("{not json", encoding="utf-8")
+            with self.assertLogs("ndk.jsonfile", "WARNING"):
+                history = DurationHistory.load(path)
+            self.assertEqual({}, history.durations)
+            history.record("a", 1.0)
+            history.save()
+            self.assertEqual(1.0, DurationHistory.load(path).get("a"))
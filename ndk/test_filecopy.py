@@ -0,0 +1,90 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.filecopy."""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.filecopy import copy_file, copy_tree, ignore_paths, reflink
+
+
+class FileCopyTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+        self.src = self.temp_dir / "src"
+        for path in (
+            "bin/clang",
+            "include/c++/v1/vector",
+            "lib/cmake/llvm/LLVMConfig.cmake",
+            "lib/clang/17/include/stddef.h",
+            "lib/clang/17/lib/linux/libclang_rt.a",
+            "lib/libLLVM.so",
+        ):
+            (self.src / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.src / path).write_text(path)
+
+    def test_copy_file(self) -> None:
+        src = self.src / "bin/clang"
+        src.chmod(0o755)
+        dst = self.temp_dir / "clang"
+        copy_file(src, dst)
+        self.assertEqual("bin/clang", dst.read_text())
+        self.assertEqual(0o755, dst.stat().st_mode & 0o777)
+
+        # Modifying the copy must not modify the source.
+        dst.write_text("stripped")
+        self.assertEqual("bin/clang", src.read_text())
+
+        # Existing files are overwritten.
+        copy_file(src, dst)
+        self.assertEqual("bin/clang", dst.read_text())
+
+    def test_reflink_does_not_replace(self) -> None:
+        dst = self.temp_dir / "clang"
+        dst.write_text("existing")
+        self.assertFalse(reflink(self.src / "bin/clang", dst))
+        self.assertEqual("existing", dst.read_text())
+
+    def test_reflink_failure_cleans_up(self) -> None:
+        dst = self.temp_dir / "clang"
+        if not reflink(self.src / "bin/clang", dst):
+            self.assertFalse(dst.exists())
+
+    def test_copy_tree_ignore_paths(self) -> None:
+        dst = self.temp_dir / "dst"
+        copy_tree(
+            self.src,
+            dst,
+            ignore=ignore_paths(self.src, ["include", "lib/cmake", "*/lib/linux"]),
+        )
+        copied = sorted(
+            Path(root, f).relative_to(dst).as_posix()
+            for root, _, files in os.walk(dst)
+            for f in files
+        )
+        self.assertEqual(
+            ["bin/clang", "lib/clang/17/include/stddef.h", "lib/libLLVM.so"], copied
+        )
+        self.assertFalse((dst / "lib/clang/17/lib/linux").exists())
+
+    def test_copy_tree_symlinks(self) -> None:
+        (self.src / "bin/clang++").symlink_to("clang")
+        dst = self.temp_dir / "dst"
+        copy_tree(self.src, dst, symlinks=True)
+        self.assertEqual("clang", os.readlink(dst / "bin/clang++"))
@@ -0,0 +1,102 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.jobserver."""
+import contextlib
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.jobserver import JobServer
+
+MAKE = shutil.which("make")
+
+
+@unittest.skipIf(os.name == "nt", "jobserver is POSIX only")
+class JobServerTest(unittest.TestCase):
+    def test_tokens_are_shared(self) -> None:
+        with JobServer(3) as job_server:
+            with job_server.client() as first:
+                with job_server.client() as second:
+                    self.assertEqual(2, first.acquire_available())
+                    self.assertEqual(1, second.acquire_available())
+                    self.assertEqual(1, second.tokens)
+                # The second client's token was returned.
+                self.assertEqual(3, first.acquire_available())
+
+    def test_tokens_are_returned(self) -> None:
+        with JobServer(2) as job_server:
+            for _ in range(3):
+                with job_server.client() as client:
+                    self.assertEqual(2, client.acquire_available())
+
+    def test_fair_share(self) -> None:
+        with JobServer(8) as job_server:
+            with contextlib.ExitStack() as stack:
+                clients = [stack.enter_context(job_server.client()) for _ in range(3)]
+                # A build that starts while most tokens are free doesn't take
+                # all of them.
+                self.assertEqual(3, clients[0].fair_share())
+                self.assertEqual(3, clients[0].acquire_available())
+                self.assertEqual(3, clients[0].acquire_available())
+                self.assertEqual(3, clients[1].acquire_available())
+
+                # Takes the last token.
+                with job_server.client() as fourth:
+                    self.assertEqual(2, fourth.fair_share())
+                    self.assertEqual(1, fourth.acquire_available())
+                self.assertEqual(2, clients[2].acquire_available())
+            with job_server.client() as client:
+                self.assertEqual(8, client.acquire_available())
+
+    def test_cleanup(self) -> None:
+        with JobServer(1) as job_server:
+            assert job_server.path is not None
+            path = job_server.path
+            self.assertTrue(path.exists())
+        self.assertFalse(path.parent.exists())
+
+    @unittest.skipIf(MAKE is None, "needs make")
+    def test_make_client(self) -> None:
+        assert MAKE is not None
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = Path(temp_dir_str)
+            # Each job records the number of jobs that were running when it
+            # started.
+            targets = [f"t{i}" for i in range(8)]
+            (temp_dir / "Makefile").write_text(
+                f"all: {' '.join(targets)}\n"
+                "t%:\n"
+                "\t@mkdir running/$@ && ls running | wc -l >> counts"
+                " && sleep 0.2 && rmdir running/$@\n"
+            )
+            (temp_dir / "running").mkdir()
+            with JobServer(2) as job_server:
+                with job_server.client() as client:
+                    subprocess.run(
+                        [MAKE, "-C", str(temp_dir)],
+                        check=True,
+                        capture_output=True,
+                        env=client.env(),
+                        pass_fds=client.pass_fds,
+                    )
+                    # Make returned the tokens it took.
+                    self.assertEqual(2, client.acquire_available())
+            counts = [int(c) for c in (temp_dir / "counts").read_text().split()]
+            self.assertEqual(len(targets), len(counts))
+            self.assertEqual(2, max(counts))
@@ -0,0 +1,54 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.jsonfile."""
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.jsonfile import atomic_write, load_versioned, save_versioned
+
+
+class JsonFileTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+
+    def test_round_trip(self) -> None:
+        path = self.temp_dir / "sub/data.json"
+        save_versioned(path, 2, {"a": 1})
+        self.assertEqual({"version": 2, "a": 1}, load_versioned(path, 2, "data"))
+        self.assertEqual([path], list(path.parent.iterdir()))
+
+    def test_load_rejected(self) -> None:
+        path = self.temp_dir / "data.json"
+        self.assertIsNone(load_versioned(path, 1, "data"))
+        save_versioned(path, 1, {})
+        self.assertIsNone(load_versioned(path, 2, "data"))
+        path.write_text("[1]", encoding="utf-8")
+        self.assertIsNone(load_versioned(path, 1, "data"))
+        path.write_text("{not json", encoding="utf-8")
+        with self.assertLogs("ndk.jsonfile", "WARNING"):
+            self.assertIsNone(load_versioned(path, 1, "data"))
+
+    def test_atomic_write_failure(self) -> None:
+        path = self.temp_dir / "data.txt"
+        path.write_text("old", encoding="utf-8")
+        with self.assertRaises(RuntimeError):
+            with atomic_write(path) as output_file:
+                output_file.write("new")
+                raise RuntimeError
+        self.assertEqual("old", path.read_text(encoding="utf-8"))
@@ -0,0 +1,137 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.manifest."""
+import hashlib
+import json
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.manifest import InstallManifest, ManifestError
+
+
+class InstallManifestTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+        self.ndk = self.temp_dir / "android-ndk"
+        bin_dir = self.ndk / "toolchains/llvm/bin"
+        bin_dir.mkdir(parents=True)
+        (bin_dir / "clang").write_bytes(b"\0" * 100_000)
+        (bin_dir / "clang++").symlink_to("clang")
+        (self.ndk / "python").mkdir()
+        (self.ndk / "python/a.py").write_text("")
+        (self.ndk / "python/a.pyc").write_text("")
+        (self.ndk / "Android.bp").write_text("")
+        (self.ndk / "llvm").symlink_to("toolchains/llvm")
+        (self.ndk / "clang").symlink_to("llvm/bin/clang")
+
+    def link(self, name: str, target: str) -> None:
+        (self.ndk / name).symlink_to(target)
+
+    def test_scan(self) -> None:
+        manifest = InstallManifest.scan(self.ndk)
+        paths = [e.path for e in manifest]
+        self.assertEqual(
+            [
+                "Android.bp",
+                "clang",
+                "llvm",
+                "python",
+                "python/a.py",
+                "python/a.pyc",
+                "toolchains",
+                "toolchains/llvm",
+                "toolchains/llvm/bin",
+                "toolchains/llvm/bin/clang",
+                "toolchains/llvm/bin/clang++",
+            ],
+            paths,
+        )
+        self.assertEqual(
+            "clang", manifest.entries["toolchains/llvm/bin/clang++"].link_target
+        )
+
+    @unittest.skipIf(shutil.which("du") is None, "needs du")
+    def test_disk_usage(self) -> None:
+        (self.ndk / "hardlink").hardlink_to(self.ndk / "toolchains/llvm/bin/clang")
+        du_output = subprocess.check_output(["du", "-sm", str(self.ndk)], text=True)
+        # du also counts the root directory itself, which may round up.
+        self.assertIn(
+            InstallManifest.scan(self.ndk).disk_usage_mib(),
+            {int(du_output.split()[0]), int(du_output.split()[0]) - 1},
+        )
+
+    def test_resolve(self) -> None:
+        manifest = InstallManifest.scan(self.ndk)
+        self.assertEqual(
+            "toolchains/llvm/bin/clang", manifest.resolve(manifest.entries["clang"])
+        )
+        self.assertEqual(
+            "toolchains/llvm/bin/clang",
+            manifest.resolve(manifest.entries["toolchains/llvm/bin/clang++"]),
+        )
+
+    def test_resolve_errors(self) -> None:
+        self.link("missing", "llvm/bin/gcc")
+        self.link("outside", "llvm/../../../etc")
+        self.link("absolute", "/usr/bin/clang")
+        self.link("loop", "loop")
+        manifest = InstallManifest.scan(self.ndk)
+        for name, message in (
+            ("missing", "non-existent"),
+            ("outside", "outside NDK"),
+            ("absolute", "absolute path"),
+            ("loop", "symlink loop"),
+        ):
+            with self.subTest(name=name):
+                with self.assertRaisesRegex(ManifestError, message):
+                    manifest.resolve(manifest.entries[name])
+
+    def test_remove(self) -> None:
+        manifest = InstallManifest.scan(self.ndk)
+        removed = manifest.remove(lambda e: e.path.endswith(".pyc"))
+        self.assertEqual(["python/a.pyc"], removed)
+        self.assertFalse((self.ndk / "python/a.pyc").exists())
+        self.assertNotIn("python/a.pyc", manifest.entries)
+
+    def test_archive_entries(self) -> None:
+        manifest = InstallManifest.scan(self.ndk)
+        entries = {e.arcname: e for e in manifest.archive_entries(True)}
+        self.assertIsNone(entries["android-ndk"].link_target)
+        self.assertEqual("toolchains/llvm", entries["android-ndk/llvm"].link_target)
+
+        entries = {e.arcname: e for e in manifest.archive_entries(False)}
+        self.assertIsNone(entries["android-ndk/llvm"].link_target)
+        self.assertTrue(entries["android-ndk/llvm"].is_dir)
+        self.assertIn("android-ndk/llvm/bin/clang", entries)
+
+    def test_write(self) -> None:
+        manifest = InstallManifest.scan(self.ndk)
+        path = self.temp_dir / "dist/install_manifest.json"
+        manifest.write(path)
+        data = json.loads(path.read_text(encoding="utf-8"))
+        self.assertEqual("android-ndk", data["root"])
+        entries = {e["path"]: e for e in data["entries"]}
+        self.assertEqual(
+            hashlib.sha256(b"\0" * 100_000).hexdigest(),
+            entries["toolchains/llvm/bin/clang"]["sha256"],
+        )
+        self.assertEqual("clang", entries["toolchains/llvm/bin/clang++"]["target"])
+        self.assertNotIn("sha256", entries["toolchains"])
@@ -0,0 +1,76 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.notices."""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.notices import NoticeManifest
+
+
+class NoticeManifestTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = Path(temp_dir.name)
+        self.manifest_path = self.temp_dir / "manifest.json"
+        self.output = self.temp_dir / "NOTICE"
+        self.notices = []
+        for name, text in (("a", "Apache"), ("b", "MIT"), ("c", "Apache")):
+            path = self.temp_dir / name
+            path.write_text(text)
+            self.notices.append(path)
+
+    def test_deduplicates(self) -> None:
+        manifest = NoticeManifest(self.manifest_path)
+        self.assertTrue(manifest.write_notice_file(self.output, self.notices))
+        self.assertEqual(
+            os.linesep.join(["Apache", "MIT"]), self.output.read_text(encoding="utf-8")
+        )
+
+    def test_incremental(self) -> None:
+        manifest = NoticeManifest(self.manifest_path)
+        manifest.hash_all(self.notices)
+        self.assertTrue(manifest.write_notice_file(self.output, self.notices))
+        manifest.save()
+
+        manifest = NoticeManifest.load(self.manifest_path)
+        self.assertFalse(manifest.write_notice_file(self.output, self.notices))
+
+        # Removing a duplicate doesn't change the output.
+        self.assertFalse(manifest.write_notice_file(self.output, self.notices[:2]))
+
+        # Changing a notice does.
+        path = self.notices[1]
+        path.write_text("BSD")
+        info = path.stat()
+        os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns + 1_000_000_000))
+        self.assertTrue(manifest.write_notice_file(self.output, self.notices))
+        self.assertIn("BSD", self.output.read_text(encoding="utf-8"))
+
+    def test_output_modified(self) -> None:
+        manifest = NoticeManifest(self.manifest_path)
+        manifest.write_notice_file(self.output, self.notices)
+        self.output.unlink()
+        self.assertTrue(manifest.write_notice_file(self.output, self.notices))
+        self.assertTrue(self.output.exists())
+
+    def test_unreadable_manifest(self) -> None:
+        self.manifest_path.write_text("{")
+        manifest = NoticeManifest.load(self.manifest_path)
+        self.assertEqual({}, manifest.files)
+        self.assertTrue(manifest.write_notice_file(self.output, self.notices))
@@ -0,0 +1,139 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Tests for ndk.tasktrace."""
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from ndk.tasktrace import TaskMeter, TaskTiming, TaskTracer
+
+
+def make_tracer() -> TaskTracer:
+    """Creates a tracer for a two worker queue.
+
+    Task 0 runs from 0 to 4 and task 1 from 0 to 1. Task 2 is queued when task
+    1 finishes, but waits for a worker until 2 and runs until 6. Task 3 is
+    queued when task 0 finishes and runs from 4 to 5.
+    """
+    tracer = TaskTracer()
+    tracer.add_worker(100, "build")
+    tracer.add_worker(101, "build")
+    tracer.task_queued(0, "build", 0.0)
+    tracer.task_queued(1, "build", 0.0)
+    tracer.task_finished(1, TaskTiming(101, "b", 0.0, 1.0))
+    tracer.task_queued(2, "build", 1.0)
+    tracer.task_finished(
+        2,
+        TaskTiming(
+            101,
+            "build c",
+            2.0,
+            6.0,
+            "build",
+            peak_rss_kib=2048,
+            bytes_written=2**20,
+            args={"restored": False},
+        ),
+    )
+    tracer.task_finished(0, TaskTiming(100, "a", 0.0, 4.0))
+    tracer.task_queued(3, "build", 4.0)
+    tracer.task_finished(3, TaskTiming(100, "d", 4.0, 5.0))
+    return tracer
+
+
+class TaskTracerTest(unittest.TestCase):
+    def test_summarize(self) -> None:
+        summary = make_tracer().summarize()
+        self.assertEqual(6.0, summary.wall_time)
+        self.assertEqual(1, len(summary.queues))
+        queue = summary.queues[0]
+        self.assertEqual("build", queue.name)
+        self.assertEqual(2, queue.num_workers)
+        self.assertEqual(4, queue.num_tasks)
+        self.assertEqual(10.0, queue.busy_time)
+        self.assertAlmostEqual(10 / 12, queue.utilization)
+        self.assertEqual(0.25, queue.mean_wait)
+        self.assertEqual(1.0, queue.max_wait)
+        # Ties are in the order the tasks started.
+        self.assertEqual(
+            ["a", "build c"], [r.timing.name for r in summary.slowest if r.timing][:2]
+        )
+
+    def test_format(self) -> None:
+        text = make_tracer().summarize(num_slowest=1).format()
+        self.assertIn("Slowest tasks:\n       4.0s a (waited 0.0s)\n", text)
+        self.assertIn(
+            "Critical path (6.0s):\n"
+            "       1.0s b (waited 0.0s)\n"
+            "       4.0s build c (waited 1.0s, peak RSS 2 MiB, wrote 1 MiB)",
+            text,
+        )
+
+    def test_critical_path(self) -> None:
+        path = make_tracer().critical_path()
+        self.assertEqual([1, 2], [r.task_id for r in path])
+
+    def test_unfinished_tasks_ignored(self) -> None:
+        tracer = make_tracer()
+        tracer.task_queued(4, "build", 5.0)
+        self.assertEqual(4, tracer.summarize().queues[0].num_tasks)
+
+    def test_empty(self) -> None:
+        tracer = TaskTracer()
+        self.assertEqual(0.0, tracer.summarize().wall_time)
+        self.assertEqual([], tracer.to_chrome_trace()["traceEvents"])
+
+    def test_write_chrome_trace(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "logs/trace.json"
+            make_tracer().write_chrome_trace(path)
+            events = json.loads(path.read_text(encoding="utf-8"))["traceEvents"]
+        tasks = {e["name"]: e for e in events if e["ph"] == "X"}
+        self.assertEqual({"a", "b", "build c", "d"}, set(tasks))
+        build = tasks["build c"]
+        self.assertEqual(2_000_000, build["ts"])
+        self.assertEqual(4_000_000, build["dur"])
+        self.assertEqual(101, build["tid"])
+        self.assertEqual("build", build["cat"])
+        self.assertEqual("task", tasks["a"]["cat"])
+        self.assertEqual(1000.0, build["args"]["wait_ms"])
+        self.assertEqual(2048, build["args"]["peak_rss_kib"])
+        self.assertEqual(2**20, build["args"]["bytes_written"])
+        self.assertFalse(build["args"]["restored"])
+        self.assertTrue(build["args"]["critical_path"])
+        self.assertFalse(tasks["a"]["args"]["critical_path"])
+        waiting = [e["args"]["waiting"] for e in events if e["ph"] == "C"]
+        self.assertEqual(0, waiting[-1])
+        self.assertEqual(2, max(waiting))
+
+
+class TaskMeterTest(unittest.TestCase):
+    def test_finish(self) -> None:
+        timing = TaskMeter().finish("task")
+        self.assertEqual(os.getpid(), timing.worker)
+        self.assertEqual("task", timing.name)
+        self.assertEqual("task", timing.category)
+        self.assertLessEqual(timing.started, timing.finished)
+
+    def test_describe(self) -> None:
+        meter = TaskMeter()
+        meter.describe("build a", "build", restored=True)
+        timing = meter.finish("task")
+        self.assertEqual("build a", timing.name)
+        self.assertEqual("build", timing.category)
+        self.assertEqual({"restored": True}, timing.args)
@@ -46,10 +46,7 @@ class Timer:
         """Stop the timer."""
         assert self.start_time is not None
         self.end_time = timeit.default_timer()
-
-        # Not interested in partial seconds at this scale.
-        seconds = int(self.end_time - self.start_time)
-        self.duration = datetime.timedelta(seconds=seconds)
+        self.duration = datetime.timedelta(seconds=self.end_time - self.start_time)
 
     def __enter__(self) -> None:
         self.start()
@@ -0,0 +1,109 @@
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Measures the per-task overhead of each WorkQueue transport.
+
+Run with `poetry run python -m ndk.tools.benchworkqueue`.
+
+The tasks do no work, so the reported time is almost entirely spent in IPC and
+pickling. Use --payload-size to approximate the size of real tasks (a test
+build task pickles its whole BuildConfiguration and test spec).
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+from ndk.workqueue import Transport, Worker, WorkQueue
+
+
+def echo(_worker: Worker, payload: bytes) -> int:
+    """Returns the size of the payload."""
+    return len(payload)
+
+
+def run_benchmark(
+    transport: Transport, num_workers: int, num_tasks: int, payload_size: int
+) -> tuple[float, float]:
+    """Runs num_tasks empty tasks through a WorkQueue.
+
+    Returns:
+        A tuple of the time taken to start the workers and the time taken to
+        queue and collect every task, both in seconds.
+    """
+    payload = b"\0" * payload_size
+    start = time.perf_counter()
+    workqueue = WorkQueue(num_workers, transport=transport)
+    started = time.perf_counter()
+    try:
+        for _ in range(num_tasks):
+            workqueue.add_task(echo, payload)
+        while not workqueue.finished():
+            workqueue.get_results()
+        finished = time.perf_counter()
+    finally:
+        workqueue.terminate()
+        workqueue.join()
+    return started - start, finished - started
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=8, help="Number of worker processes."
+    )
+    parser.add_argument(
+        "-n", "--tasks", type=int, default=10000, help="Number of tasks to run."
+    )
+    parser.add_argument(
+        "--payload-size",
+        type=int,
+        default=0,
+        help="Size in bytes of the argument passed to each task.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of runs for each transport."
+    )
+    parser.add_argument(
+        "--transport",
+        choices=[t.value for t in Transport],
+        action="append",
+        help="Transport to measure. May be repeated. Defaults to all transports.",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.transport is None:
+        transports = list(Transport)
+    else:
+        transports = [Transport(t) for t in args.transport]
+
+    print(f"{args.tasks} tasks, {args.jobs} workers, {args.payload_size} byte payload")
+    for transport in transports:
+        startup, elapsed = min(
+            run_benchmark(transport, args.jobs, args.tasks, args.payload_size)
+            for _ in range(args.repeat)
+        )
+        print(
+            f"{transport.value:>8}: startup {startup * 1000:7.1f} ms, "
+            f"total {elapsed:6.3f} s, "
+            f"{elapsed / args.tasks * 1e6:7.1f} us/task"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -263,8 +263,8 @@ class WorkQueueUi(Ui):
 
 
 def finish_workqueue_with_ui(
-    workqueue: ndk.workqueue.WorkQueue,
-    ui_fn: Callable[[ndk.ansi.Console, ndk.workqueue.WorkQueue], Ui],
+    workqueue: AnyWorkQueue,
+    ui_fn: Callable[[ndk.ansi.Console, AnyWorkQueue], Ui],
 ) -> None:
     console = ndk.ansi.get_console()
     ui = ui_fn(console, workqueue)
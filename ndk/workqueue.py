@@ -16,33 +16,39 @@
 """Defines WorkQueue for delegating asynchronous work to subprocesses."""
 from __future__ import annotations
 
-import collections
+import ctypes
+import enum
+import heapq
+import itertools
 import logging
 import multiprocessing
 import multiprocessing.managers
 import os
+import queue
 import signal
 import sys
+import time
 import traceback
 from abc import ABC, abstractmethod
 from collections.abc import Hashable
-from queue import Queue
 from types import FrameType
 from typing import (
     Any,
     Callable,
     Concatenate,
-    Deque,
     Dict,
     Generic,
     Iterable,
     List,
     Optional,
     ParamSpec,
+    Protocol,
     TypeVar,
     Union,
 )
 
+from ndk.tasktrace import TaskMeter, TaskTiming, TaskTracer
+
 IS_WINDOWS = sys.platform == "win32"
 
 
@@ -52,6 +58,90 @@ if IS_WINDOWS:
     ProcessGroup = Optional[ctypes.wintypes.HANDLE]
 
 
+QueueItemT = TypeVar("QueueItemT")
+
+
+class TransportQueue(Protocol[QueueItemT]):
+    """The subset of the queue interface used to pass tasks and results.
+
+    Satisfied by both the Manager proxied queue.Queue and the pipe based
+    multiprocessing queues.
+    """
+
+    def put(self, item: QueueItemT, /) -> None:
+        ...
+
+    def get(self) -> QueueItemT:
+        ...
+
+    def empty(self) -> bool:
+        ...
+
+
+class TaskQueue(TransportQueue[QueueItemT], Protocol[QueueItemT]):
+    """A TransportQueue that can be waited on with a timeout."""
+
+    def get(self, block: bool = True, timeout: Optional[float] = None, /) -> QueueItemT:
+        ...
+
+
+class Transport(enum.Enum):
+    """The mechanism used to pass tasks and results between processes."""
+
+    #: Queues live in a multiprocessing.Manager server process and every put and
+    #: get is a proxied round trip through that process.
+    MANAGER = "manager"
+    #: Tasks and results are written directly to pipes shared by the parent and
+    #: the workers. There is no broker process.
+    PIPE = "pipe"
+
+
+def create_task_queue(
+    transport: Transport, manager: Optional[multiprocessing.managers.SyncManager]
+) -> TaskQueue[Task]:
+    """Creates a queue for passing tasks from the parent to the workers."""
+    if transport is Transport.MANAGER:
+        assert manager is not None
+        return manager.Queue()
+    # multiprocessing.Queue buffers puts in a feeder thread, so add_task never
+    # blocks on a full pipe while the workers are blocked writing results. The
+    # parent must not wait for that buffer to drain when it exits though: if
+    # the workers were terminated early nothing will ever read it.
+    task_queue: multiprocessing.Queue[Task] = multiprocessing.Queue()
+    task_queue.cancel_join_thread()
+    return task_queue
+
+
+def create_result_queue(
+    transport: Transport, manager: Optional[multiprocessing.managers.SyncManager]
+) -> TransportQueue[Any]:
+    """Creates a queue for passing results from the workers to the parent."""
+    if transport is Transport.MANAGER:
+        assert manager is not None
+        return manager.Queue()
+    # Results are written synchronously so that nothing is left buffered in the
+    # worker when it is terminated.
+    return multiprocessing.SimpleQueue()
+
+
+def queue_size(transport_queue: TransportQueue[Any]) -> Optional[int]:
+    """Returns the approximate number of items in the queue.
+
+    Returns None if the size cannot be determined. multiprocessing.Queue does
+    not implement qsize() on macOS, and SimpleQueue does not implement it at
+    all.
+    """
+    qsize = getattr(transport_queue, "qsize", None)
+    if qsize is None:
+        return None
+    try:
+        size = qsize()
+    except NotImplementedError:
+        return None
+    assert isinstance(size, int)
+    return size
+
+
 def logger() -> logging.Logger:
     """Returns the module level logger."""
     return logging.getLogger(__name__)
@@ -117,54 +207,71 @@ class Worker:
     IDLE_STATUS = "IDLE"
     EXCEPTION_STATUS = "EXCEPTION"
 
+    # Size of the shared status buffer. Longer statuses are truncated.
+    MAX_STATUS_SIZE = 1024
+
+    # How often an idle worker wakes up to handle pending signals. See
+    # get_task().
+    POLL_INTERVAL = 1.0
+
     def __init__(
         self,
         data: Any,
-        task_queue: Queue[Task],
-        result_queue: Queue[Any],
-        manager: multiprocessing.managers.SyncManager,
+        task_queue: TaskQueue[Task],
+        result_queue: TransportQueue[Any],
     ) -> None:
         """Creates a Worker object.
 
         Args:
-            task_queue: A multiprocessing.Queue of Tasks to retrieve work from.
-            result_queue: A multiprocessing.Queue to push results to.
+            task_queue: A queue of Tasks to retrieve work from.
+            result_queue: A queue to push results to.
         """
         self.data = data
         self.task_queue = task_queue
         self.result_queue = result_queue
-        # For multiprocess.Manager.Value, the type is actually ignored.
-        # https://stackoverflow.com/a/21290961/632035
-        self._status = manager.Value("", self.IDLE_STATUS)
-        self._status_lock = manager.Lock()
+        # The status is kept in shared memory rather than a Manager.Value so
+        # that the UI can poll it without a round trip to another process.
+        self._status = multiprocessing.Array(ctypes.c_char, self.MAX_STATUS_SIZE)
+        self.status = self.IDLE_STATUS
+        # Measures the running task. Replaced at the start of each task.
+        self.meter = TaskMeter()
         self.process = multiprocessing.Process(target=self.main)
 
     @property
     def status(self) -> str:
         """The worker's current status."""
-        with self._status_lock:
-            # Typeshed has a seemingly incorrect definition of
-            # SyncManager.Value that just returns the wrapped type rather than
-            # the proxy type.
-            return self._status.value
+        return self._status.value.decode("utf-8", errors="replace")
 
     @status.setter
     def status(self, value: str) -> None:
         """Sets the status for the worker."""
-        with self._status_lock:
-            # Typeshed has a seemingly incorrect definition of
-            # SyncManager.Value that just returns the wrapped type rather than
-            # the proxy type.
-            self._status.value = value
-
-    def put_result(self, result: Any, status: str) -> None:
-        """Puts a result onto the result queue."""
-        with self._status_lock:
-            # Typeshed has a seemingly incorrect definition of
-            # SyncManager.Value that just returns the wrapped type rather than
-            # the proxy type.
-            self._status.value = status
-        self.result_queue.put(result)
+        self._status.value = value.encode("utf-8")[: self.MAX_STATUS_SIZE]
+
+    def put_result(
+        self,
+        task_id: Optional[int],
+        result: Any,
+        status: str,
+        timing: Optional[TaskTiming] = None,
+    ) -> None:
+        """Puts a result onto the result queue.
+
+        Results are tagged with the ID of the task that produced them so that
+        the work queue knows which of its in-flight tasks finished, and with the
+        time the task took to run.
+        """
+        self.status = status
+        self.result_queue.put((task_id, result, timing))
+
+    def task_timing(self, task: Task) -> TaskTiming:
+        """Returns the timing of a task that is finishing now.
+
+        A task that didn't describe itself to the meter is described by the
+        status it set, if any, since that usually names what was being worked
+        on.
+        """
+        status = self.status
+        return self.meter.finish(task.name if status == self.IDLE_STATUS else status)
 
     @property
     def pid(self) -> Optional[int]:
@@ -187,24 +294,60 @@ class Worker:
         """Joins the worker process."""
         self.process.join(timeout)
 
+    def get_task(self) -> Task:
+        """Waits for the next task.
+
+        A SIGTERM that arrives just as the worker starts waiting on the task
+        queue's lock is not handled until the wait ends, and a SystemExit raised
+        just after the lock is taken leaks it to the other workers. Waking up
+        periodically ensures the worker always exits when terminated.
+        """
+        while True:
+            try:
+                return self.task_queue.get(True, self.POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+    def run_task(self, task: Task) -> None:
+        """Runs a task and puts its result on the result queue.
+
+        An exception raised by the task is passed to the parent as a TaskError.
+        The worker remains available for other tasks, since a work queue may be
+        reused after a task fails.
+        """
+        self.meter = TaskMeter()
+        try:
+            result = task.run(self)
+        except Exception:  # pylint: disable=broad-except
+            logger().debug("worker %d task raised exception", os.getpid())
+            result = TaskError(traceback.format_exc())
+        logger().debug("worker %d putting result", os.getpid())
+        timing = self.task_timing(task)
+        self.put_result(task.task_id, result, self.IDLE_STATUS, timing)
+
     def main(self) -> None:
         """Main loop for worker processes."""
         group = assign_self_to_new_process_group()
         signal.signal(signal.SIGTERM, worker_sigterm_handler)
+        task_id: Optional[int] = None
         try:
             while True:
                 logger().debug("worker %d waiting for work", os.getpid())
-                task = self.task_queue.get()
+                task = self.get_task()
+                if task.func is stop_worker:
+                    logger().debug("worker %d stopping", os.getpid())
+                    self.put_result(task.task_id, os.getpid(), self.IDLE_STATUS)
+                    break
+                task_id = task.task_id
                 logger().debug("worker %d running task", os.getpid())
-                result = task.run(self)
-                logger().debug("worker %d putting result", os.getpid())
-                self.put_result(result, self.IDLE_STATUS)
+                self.run_task(task)
+                task_id = None
         except SystemExit:
             pass
         except:  # pylint: disable=bare-except
             logger().debug("worker %d raised exception", os.getpid())
             trace = "".join(traceback.format_exception(*sys.exc_info()))
-            self.put_result(TaskError(trace), self.EXCEPTION_STATUS)
+            self.put_result(task_id, TaskError(trace), self.EXCEPTION_STATUS)
         finally:
             # multiprocessing.Process.terminate() doesn't kill our descendents.
             signal.signal(signal.SIGTERM, signal.SIG_IGN)
@@ -218,6 +361,14 @@ ResultT = TypeVar("ResultT")
 ParamT = ParamSpec("ParamT")
 
 
+def stop_worker(_worker: Worker) -> None:
+    """A task that makes the worker that receives it exit.
+
+    Used by ProcessPoolWorkQueue.resize(). Worker.main() handles this task
+    itself rather than running it.
+    """
+
+
 class Task:
     """A task to be executed by a worker process."""
 
@@ -237,23 +388,87 @@ class Task:
         self.func = func
         self.args = args
         self.kwargs = kwargs
+        # Assigned by the work queue when the task is scheduled.
+        self.task_id: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        """A description of the task for logs and traces."""
+        return getattr(self.func, "__name__", type(self.func).__name__)
 
     def run(self, worker_data: Any) -> Any:
         """Invokes the task."""
         return self.func(worker_data, *self.args, **self.kwargs)
 
 
+class TaskScheduler:
+    """Orders pending tasks by priority.
+
+    Tasks with a higher priority are run first. Tasks with equal priority are
+    run in the order they were added, so a scheduler that is only given the
+    default priority behaves as a FIFO.
+
+    Using the estimated duration of a task as its priority gives longest
+    processing time first (LPT) scheduling, which keeps the slowest tasks from
+    being started at the end of a run when there is nothing left to run in
+    parallel with them.
+    """
+
+    # Task IDs are unique across all schedulers so that a work queue with
+    # several schedulers can map an ID back to the scheduler it came from.
+    _task_ids = itertools.count()
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, Task]] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, task: Task, priority: float = 0.0) -> int:
+        """Schedules a task and returns its task ID."""
+        task_id = next(self._task_ids)
+        task.task_id = task_id
+        heapq.heappush(self._heap, (-priority, task_id, task))
+        return task_id
+
+    def pop(self) -> Task:
+        """Removes and returns the highest priority task."""
+        return heapq.heappop(self._heap)[2]
+
+    def peek(self) -> tuple[float, int]:
+        """Returns the sort key of the task that pop() would return.
+
+        Keys from different schedulers can be compared to find which
+        scheduler's next task should be run first.
+        """
+        negated_priority, task_id, _task = self._heap[0]
+        return negated_priority, task_id
+
+
 class ProcessPoolWorkQueue:
-    """A pool of processes for executing work asynchronously."""
+    """A pool of processes for executing work asynchronously.
+
+    Tasks are held in a TaskScheduler by the parent and only handed to the
+    workers a few at a time, so a high priority task added late does not have
+    to wait behind everything that was added before it.
+    """
 
     join_timeout = 8  # Timeout for join before trying SIGKILL.
 
+    # Number of tasks per worker that may be in the task queue or running at
+    # once. More than one keeps workers busy while the parent is handling
+    # results, but each extra task is one that can't be reordered.
+    tasks_per_worker = 2
+
     def __init__(
         self,
         num_workers: int = multiprocessing.cpu_count(),
-        task_queue: Optional[Queue[Task]] = None,
-        result_queue: Optional[Queue[Any]] = None,
+        task_queue: Optional[TaskQueue[Task]] = None,
+        result_queue: Optional[TransportQueue[Any]] = None,
         worker_data: Optional[Any] = None,
+        transport: Transport = Transport.PIPE,
+        tracer: Optional[TaskTracer] = None,
+        name: str = "workqueue",
     ) -> None:
         """Creates a WorkQueue.
 
@@ -262,26 +477,36 @@ class ProcessPoolWorkQueue:
 
         Args:
             num_workers: Number of worker processes to spawn.
-            task_queue: multiprocessing.Queue for tasks. Allows multiple work
-                queues to share a single task queue. If None, the work queue
-                creates its own.
-            result_queue: multiprocessing.Queue for results. Allows multiple
-                work queues to share a single result queue. If None, the work
-                queue creates its own.
+            task_queue: Queue for tasks. Allows multiple work queues to share a
+                single task queue. If None, the work queue creates its own.
+            result_queue: Queue for results. Allows multiple work queues to
+                share a single result queue. If None, the work queue creates its
+                own.
             worker_data: Data to be passed to every task run by this work
                 queue.
+            transport: The mechanism used to create the queues that this work
+                queue owns.
+            tracer: Records the timing of every task if not None.
+            name: Name of the work queue in the tracer's records.
         """
-        self.manager = multiprocessing.Manager()
-
+        self.transport = transport
+        self.tracer = tracer
+        self._name = name
+        self.manager: Optional[multiprocessing.managers.SyncManager] = None
+        if transport is Transport.MANAGER:
+            self.manager = multiprocessing.Manager()
+
+        self.task_queue: TaskQueue[Task]
         if task_queue is None:
-            self.task_queue = self.manager.Queue()
+            self.task_queue = create_task_queue(transport, self.manager)
             self.owns_task_queue = True
         else:
             self.task_queue = task_queue
             self.owns_task_queue = False
 
+        self.result_queue: TransportQueue[Any]
         if result_queue is None:
-            self.result_queue = self.manager.Queue()
+            self.result_queue = create_result_queue(transport, self.manager)
             self.owns_result_queue = True
         else:
             self.result_queue = result_queue
@@ -293,8 +518,27 @@ class ProcessPoolWorkQueue:
         # multiprocessing.JoinableQueue's join isn't able to implement
         # finished() because it doesn't come in a non-blocking flavor.
         self.num_tasks = 0
+        self.scheduler = TaskScheduler()
+        self.num_dispatched = 0
         self._spawn_workers(num_workers)
 
+    @property
+    def name(self) -> str:
+        """Name of the work queue in the tracer's records.
+
+        A work queue that is reused for several phases of a build can be
+        renamed between phases so that each phase is traced separately.
+        """
+        return self._name
+
+    @name.setter
+    def name(self, name: str) -> None:
+        self._name = name
+        if self.tracer is not None:
+            for worker in self.workers:
+                if worker.pid is not None:
+                    self.tracer.add_worker(worker.pid, name)
+
     def add_task(
         self,
         func: Callable[Concatenate[Worker, ParamT], ResultT],
@@ -303,23 +547,62 @@ class ProcessPoolWorkQueue:
     ) -> None:
         """Queues up a new task for execution.
 
-        Tasks are executed in order of insertion as worker processes become
-        available.
+        The task has the default priority (see add_task_with_priority), so it
+        runs after any queued tasks with a higher priority. Among tasks of equal
+        priority, tasks are executed in order of insertion as worker processes
+        become available.
+
+        Args:
+            func: An invocable object to be executed by a worker process.
+            args: Arguments to be passed to the task.
+            kwargs: Keyword arguments to be passed to the task.
+        """
+        self.add_task_with_priority(0.0, func, *args, **kwargs)
+
+    def add_task_with_priority(
+        self,
+        priority: float,
+        func: Callable[Concatenate[Worker, ParamT], ResultT],
+        *args: ParamT.args,
+        **kwargs: ParamT.kwargs,
+    ) -> None:
+        """Queues up a new task to be run before lower priority tasks.
+
+        Tasks of equal priority are started in order of insertion.
 
         Args:
+            priority: Tasks with higher priorities are started first. Pass the
+                estimated duration of the task to run the longest tasks first.
             func: An invocable object to be executed by a worker process.
             args: Arguments to be passed to the task.
             kwargs: Keyword arguments to be passed to the task.
         """
-        self.task_queue.put(Task(func, *args, **kwargs))
+        task_id = self.scheduler.push(Task(func, *args, **kwargs), priority)
+        if self.tracer is not None:
+            self.tracer.task_queued(task_id, self.name, time.monotonic())
         self.num_tasks += 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Moves tasks from the scheduler to the task queue.
+
+        Only enough tasks to keep every worker busy are queued at a time.
+        """
+        max_dispatched = self.tasks_per_worker * max(len(self.workers), 1)
+        while self.scheduler and self.num_dispatched < max_dispatched:
+            self.task_queue.put(self.scheduler.pop())
+            self.num_dispatched += 1
 
     def get_result(self) -> Any:
         """Gets a result from the queue, blocking until one is available."""
-        result = self.result_queue.get()
+        task_id, result, timing = self.result_queue.get()
+        if self.tracer is not None and task_id is not None and timing is not None:
+            self.tracer.task_finished(task_id, timing)
+        self.num_dispatched -= 1
+        self._dispatch()
+        self.num_tasks -= 1
         if isinstance(result, TaskError):
             raise result
-        self.num_tasks -= 1
         return result
 
     @property
@@ -365,6 +648,49 @@ class ProcessPoolWorkQueue:
         """Returns True if all tasks have completed execution."""
         return self.num_tasks == 0
 
+    def resize(self, num_workers: int) -> None:
+        """Changes the number of worker processes.
+
+        Workers that have died are replaced. The work queue must be idle,
+        since stopping a worker waits for the worker to acknowledge it on the
+        result queue.
+
+        Args:
+            num_workers: The number of worker processes to keep.
+
+        Raises:
+            RuntimeError: The work queue has unfinished tasks or shares its
+                queues with other work queues.
+        """
+        if not self.finished() or self.num_dispatched:
+            raise RuntimeError("Cannot resize a work queue with unfinished tasks")
+        if not self.owns_task_queue or not self.owns_result_queue:
+            raise RuntimeError("Cannot resize a work queue with shared queues")
+
+        live_workers = []
+        for worker in self.workers:
+            if worker.is_alive():
+                live_workers.append(worker)
+            else:
+                worker.join()
+        self.workers = live_workers
+
+        if num_workers > len(self.workers):
+            self._spawn_workers(num_workers - len(self.workers))
+            return
+
+        num_stopping = len(self.workers) - num_workers
+        for _ in range(num_stopping):
+            self.task_queue.put(Task(stop_worker))
+        stopped_pids = set()
+        for _ in range(num_stopping):
+            _task_id, pid, _timing = self.result_queue.get()
+            stopped_pids.add(pid)
+        for worker in self.workers:
+            if worker.pid in stopped_pids:
+                worker.join()
+        self.workers = [w for w in self.workers if w.pid not in stopped_pids]
+
     def _spawn_workers(self, num_workers: int) -> None:
         """Spawns the worker processes.
 
@@ -372,10 +698,10 @@ class ProcessPoolWorkQueue:
             num_workers: Number of worker proceeses to spawn.
         """
         for _ in range(num_workers):
-            worker = Worker(
-                self.worker_data, self.task_queue, self.result_queue, self.manager
-            )
+            worker = Worker(self.worker_data, self.task_queue, self.result_queue)
             worker.start()
+            if self.tracer is not None and worker.pid is not None:
+                self.tracer.add_worker(worker.pid, self.name)
             self.workers.append(worker)
 
 
@@ -384,6 +710,7 @@ class BasicWorker:
 
     def __init__(self, data: Any) -> None:
         self.data = data
+        self.meter = TaskMeter()
 
 
 class BaseWorkQueue(ABC, Generic[ResultT]):
@@ -422,16 +749,35 @@ class BasicWorkQueue(BaseWorkQueue[ResultT]):
     def __init__(
         self,
         num_workers: Optional[int] = None,
-        task_queue: Optional[Queue[Task]] = None,
-        result_queue: Optional[Queue[ResultT]] = None,
+        task_queue: Optional[TaskQueue[Task]] = None,
+        result_queue: Optional[TransportQueue[ResultT]] = None,
         worker_data: Optional[Any] = None,
+        transport: Optional[Transport] = None,
+        tracer: Optional[TaskTracer] = None,
+        name: str = "workqueue",
     ) -> None:
         """Creates a SerialWorkQueue."""
-        self.task_queue: Deque[Task] = collections.deque()
+        self.scheduler = TaskScheduler()
         self.worker_data = worker_data
+        self.tracer = tracer
+        self.name = name
+
+    def resize(self, num_workers: int) -> None:
+        """Does nothing."""
 
     # pylint: enable=unused-argument
 
+    @property
+    def name(self) -> str:
+        """Name of the work queue in the tracer's records."""
+        return self._name
+
+    @name.setter
+    def name(self, name: str) -> None:
+        self._name = name
+        if self.tracer is not None:
+            self.tracer.add_worker(os.getpid(), name)
+
     def add_task(
         self,
         func: Callable[Concatenate[Worker, ParamT], ResultT],
@@ -447,16 +793,39 @@ class BasicWorkQueue(BaseWorkQueue[ResultT]):
             args: Arguments to be passed to the task.
             kwargs: Keyword arguments to be passed to the task.
         """
-        self.task_queue.append(Task(func, *args, **kwargs))
+        self.add_task_with_priority(0.0, func, *args, **kwargs)
+
+    def add_task_with_priority(
+        self,
+        priority: float,
+        func: Callable[Concatenate[Worker, ParamT], ResultT],
+        *args: ParamT.args,
+        **kwargs: ParamT.kwargs,
+    ) -> None:
+        """Queues up a new task to be run before lower priority tasks.
+
+        Args:
+            priority: Tasks with higher priorities are run first.
+            func: An invocable object to be executed by a worker process.
+            args: Arguments to be passed to the task.
+            kwargs: Keyword arguments to be passed to the task.
+        """
+        task_id = self.scheduler.push(Task(func, *args, **kwargs), priority)
+        if self.tracer is not None:
+            self.tracer.task_queued(task_id, self.name, time.monotonic())
 
     def get_result(self) -> Any:
         """Executes a task and returns the result."""
-        task = self.task_queue.popleft()
+        task = self.scheduler.pop()
+        worker = BasicWorker(self.worker_data)
         try:
-            return task.run(BasicWorker(self.worker_data))
+            return task.run(worker)
         except Exception as ex:
             trace = "".join(traceback.format_exception(*sys.exc_info()))
             raise TaskError(trace) from ex
+        finally:
+            if self.tracer is not None and task.task_id is not None:
+                self.tracer.task_finished(task.task_id, worker.meter.finish(task.name))
 
     def terminate(self) -> None:
         """Does nothing."""
@@ -467,7 +836,7 @@ class BasicWorkQueue(BaseWorkQueue[ResultT]):
     @property
     def num_tasks(self) -> int:
         """Number of tasks that have not yet been claimed."""
-        return len(self.task_queue)
+        return len(self.scheduler)
 
     @property
     def has_pending_results(self) -> bool:
@@ -493,24 +862,70 @@ class ShardingGroup(Hashable, Generic[ShardT]):
 
 
 class ShardingWorkQueue(BaseWorkQueue[ResultT], Generic[ResultT, ShardT]):
+    """A work queue with a separate pool of workers for each sharding group.
+
+    As with ProcessPoolWorkQueue, each group's pending tasks are ordered by a
+    TaskScheduler and only a few are handed to the group's workers at a time.
+
+    Tasks added with add_task_for_any_group() may be run by any of several
+    groups. They are held in a scheduler shared by those groups, and whichever
+    of the groups has a free worker first takes the next one. A group with
+    fast devices is then not left idle while a slower group still has a
+    backlog of tasks that either could run.
+
+    Each worker's data is a list of its shard and its group.
+
+    If a tracer is given, each group is traced as a separate work queue.
+    """
+
     def __init__(
-        self, device_groups: Iterable[ShardingGroup[ShardT]], procs_per_device: int
+        self,
+        device_groups: Iterable[ShardingGroup[ShardT]],
+        procs_per_device: int,
+        transport: Transport = Transport.PIPE,
+        tracer: Optional[TaskTracer] = None,
     ) -> None:
-        self.manager = multiprocessing.Manager()
-        self.result_queue = self.manager.Queue()
-        self.task_queues: Dict[ShardingGroup[ShardT], Queue[Task]] = {}
+        self.tracer = tracer
+        self.manager: Optional[multiprocessing.managers.SyncManager] = None
+        if transport is Transport.MANAGER:
+            self.manager = multiprocessing.Manager()
+        self.result_queue = create_result_queue(transport, self.manager)
+        self.task_queues: Dict[ShardingGroup[ShardT], TaskQueue[Task]] = {}
 
         self.work_queues: Dict[ShardingGroup[ShardT], Dict[Any, WorkQueue]] = {}
+        self.schedulers: Dict[ShardingGroup[ShardT], TaskScheduler] = {}
+        # Schedulers for tasks that may run on any of several groups, keyed by
+        # the groups that may run them.
+        self.shared_schedulers: Dict[
+            frozenset[ShardingGroup[ShardT]], TaskScheduler
+        ] = {}
+        # Times that shared tasks were queued. They are only traced once the
+        # group that runs them is known.
+        self.queued_times: Dict[int, float] = {}
+        self.num_dispatched: Dict[ShardingGroup[ShardT], int] = {}
+        self.max_dispatched: Dict[ShardingGroup[ShardT], int] = {}
+        # Maps the IDs of dispatched tasks to the group they were sent to.
+        self.dispatched_groups: Dict[int, ShardingGroup[ShardT]] = {}
         self.num_tasks = 0
         for group in device_groups:
             self.work_queues[group] = {}
-            self.task_queues[group] = self.manager.Queue()
+            self.schedulers[group] = TaskScheduler()
+            self.num_dispatched[group] = 0
+            self.max_dispatched[group] = (
+                WorkQueue.tasks_per_worker
+                * procs_per_device
+                * max(len(group.shards), 1)
+            )
+            self.task_queues[group] = create_task_queue(transport, self.manager)
             for shard in group.shards:
                 self.work_queues[group][shard] = WorkQueue(
                     procs_per_device,
                     task_queue=self.task_queues[group],
                     result_queue=self.result_queue,
-                    worker_data=[shard],
+                    worker_data=[shard, group],
+                    transport=transport,
+                    tracer=tracer,
+                    name=str(group),
                 )
 
     def add_task(
@@ -520,15 +935,112 @@ class ShardingWorkQueue(BaseWorkQueue[ResultT], Generic[ResultT, ShardT]):
         *args: ParamT.args,
         **kwargs: ParamT.kwargs,
     ) -> None:
-        self.task_queues[group].put(Task(func, *args, **kwargs))
+        self.add_task_with_priority(group, 0.0, func, *args, **kwargs)
+
+    def add_task_with_priority(
+        self,
+        group: ShardingGroup[ShardT],
+        priority: float,
+        func: Callable[Concatenate[Worker, ParamT], ResultT],
+        *args: ParamT.args,
+        **kwargs: ParamT.kwargs,
+    ) -> None:
+        """Queues up a new task to be run before lower priority tasks.
+
+        Args:
+            group: The sharding group to run the task on.
+            priority: Tasks with higher priorities are started first. Pass the
+                estimated duration of the task to run the longest tasks first.
+            func: An invocable object to be executed by a worker process.
+            args: Arguments to be passed to the task.
+            kwargs: Keyword arguments to be passed to the task.
+        """
+        task_id = self.schedulers[group].push(Task(func, *args, **kwargs), priority)
+        if self.tracer is not None:
+            self.tracer.task_queued(task_id, str(group), time.monotonic())
+        self.num_tasks += 1
+        self._dispatch(group)
+
+    def add_task_for_any_group(
+        self,
+        groups: Iterable[ShardingGroup[ShardT]],
+        priority: float,
+        func: Callable[Concatenate[Worker, ParamT], ResultT],
+        *args: ParamT.args,
+        **kwargs: ParamT.kwargs,
+    ) -> None:
+        """Queues up a new task that may be run by any of the given groups.
+
+        The task should use the worker's data to find out which shard and
+        group it is running on.
+
+        Args:
+            groups: The sharding groups that may run the task.
+            priority: Tasks with higher priorities are started first. Pass the
+                estimated duration of the task to run the longest tasks first.
+            func: An invocable object to be executed by a worker process.
+            args: Arguments to be passed to the task.
+            kwargs: Keyword arguments to be passed to the task.
+        """
+        eligible_groups = frozenset(groups)
+        if not eligible_groups:
+            raise ValueError("A task must be runnable by at least one group")
+        scheduler = self.shared_schedulers.setdefault(eligible_groups, TaskScheduler())
+        task_id = scheduler.push(Task(func, *args, **kwargs), priority)
+        if self.tracer is not None:
+            self.queued_times[task_id] = time.monotonic()
         self.num_tasks += 1
+        # Offer the task to the least busy groups first.
+        for group in sorted(eligible_groups, key=lambda g: self.num_dispatched[g]):
+            self._dispatch(group)
+
+    def _next_scheduler(self, group: ShardingGroup[ShardT]) -> Optional[TaskScheduler]:
+        """Returns the scheduler with the next task the group should run."""
+        candidates = [self.schedulers[group]]
+        for groups, scheduler in self.shared_schedulers.items():
+            if group in groups:
+                candidates.append(scheduler)
+        candidates = [c for c in candidates if c]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: c.peek())
+
+    def _dispatch(self, group: ShardingGroup[ShardT]) -> None:
+        """Moves tasks from the group's schedulers to its task queue."""
+        while self.num_dispatched[group] < self.max_dispatched[group]:
+            scheduler = self._next_scheduler(group)
+            if scheduler is None:
+                break
+            task = scheduler.pop()
+            assert task.task_id is not None
+            if task.task_id in self.queued_times and self.tracer is not None:
+                self.tracer.task_queued(
+                    task.task_id, str(group), self.queued_times.pop(task.task_id)
+                )
+            self.dispatched_groups[task.task_id] = group
+            self.task_queues[group].put(task)
+            self.num_dispatched[group] += 1
+
+    def num_queued(self, group: ShardingGroup[ShardT]) -> int:
+        """Returns the number of tasks for the group that have not started.
+
+        Tasks that may be run by any of several groups are only counted once
+        they have been handed to a group.
+        """
+        return len(self.schedulers[group]) + (queue_size(self.task_queues[group]) or 0)
 
     def get_result(self) -> Any:
         """Gets a result from the queue, blocking until one is available."""
-        result = self.result_queue.get()
+        task_id, result, timing = self.result_queue.get()
+        if self.tracer is not None and task_id is not None and timing is not None:
+            self.tracer.task_finished(task_id, timing)
+        if task_id is not None:
+            group = self.dispatched_groups.pop(task_id)
+            self.num_dispatched[group] -= 1
+            self._dispatch(group)
+        self.num_tasks -= 1
         if isinstance(result, TaskError):
             raise result
-        self.num_tasks -= 1
         return result
 
     def terminate(self) -> None:
@@ -21,16 +21,35 @@ See https://developer.android.com/ndk/guides/ndk-stack for more information.
 from __future__ import annotations
 
 import argparse
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import io
+import json
 import os
+import queue
 import re
 import shutil
+import socketserver
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
 import zipfile
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, TextIO, TypeVar
+
+import elfnote
 
 EXE_SUFFIX = ".exe" if os.name == "nt" else ""
 
+CRASH_BANNER = "*** *** *** *** *** *** *** *** *** *** *** *** *** *** *** ***"
+
+T = TypeVar("T")
+U = TypeVar("U")
+
 
 class TmpDir:
     """Manage temporary directory creation."""
@@ -112,13 +131,24 @@ def find_readelf(ndk_root: str, ndk_bin: str, ndk_host_tag: str) -> str | None:
     return None
 
 
-def get_build_id(readelf_path: str, elf_file: str) -> str | None:
+def get_build_id(readelf_path: str | None, elf_file: str) -> str | None:
     """Get the GNU build id note from an elf file.
 
+    The note is read in-process. readelf is only used as a fallback for files
+    that the in-process reader can't parse.
+
     Returns: The build id found or None if there is no build id or the
-             readelf path does not exist.
+             build id could not be read.
     """
 
+    try:
+        return elfnote.read_notes(elf_file).build_id
+    except OSError:
+        return None
+    except elfnote.ElfError:
+        if not readelf_path:
+            return None
+
     try:
         output = subprocess.check_output([readelf_path, "-n", elf_file])
         m = re.search(r"Build ID:\s+([0-9a-f]+)", output.decode())
@@ -129,6 +159,141 @@ def get_build_id(readelf_path: str, elf_file: str) -> str | None:
         return None
 
 
+def is_elf_file(path: str) -> bool:
+    """Returns True if the file at path starts with the ELF magic."""
+    try:
+        with open(path, "rb") as elf_file:
+            return elf_file.read(4) == b"\x7fELF"
+    except OSError:
+        return False
+
+
+class BuildIdIndex:
+    """A persistent map from GNU build ids to the ELF files in a symbol directory.
+
+    The whole symbol directory is searched, including subdirectories, so the
+    symbol directory can be a symbol store holding many builds of a library.
+    The index is saved as JSON. Each file's entry records its size and mtime,
+    so refreshing the index only reads files that are new or have changed.
+    """
+
+    VERSION = 1
+
+    def __init__(self, index_path: str, symbol_dir: str) -> None:
+        self.index_path = index_path
+        self.symbol_dir = symbol_dir
+        # Maps paths relative to symbol_dir to (size, mtime_ns, build id).
+        self.entries: dict[str, tuple[int, int, str | None]] = {}
+        self.paths_by_build_id: dict[str, str] = {}
+        self.dirty = False
+
+    def load(self) -> None:
+        """Loads the saved index, if it exists and is for this symbol directory.
+
+        The index is only a cache, so an index that can't be read is ignored,
+        as are any malformed entries in it.
+        """
+        try:
+            with open(self.index_path, encoding="utf-8") as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return
+        if data.get("symbol_dir") != os.path.abspath(self.symbol_dir):
+            return
+        files = data.get("files")
+        if not isinstance(files, dict):
+            return
+        entries: dict[str, tuple[int, int, str | None]] = {}
+        for path, entry in files.items():
+            if not isinstance(entry, list) or len(entry) != 3:
+                continue
+            size, mtime_ns, build_id = entry
+            if not isinstance(size, int) or not isinstance(mtime_ns, int):
+                continue
+            if build_id is not None and not isinstance(build_id, str):
+                continue
+            entries[path] = (size, mtime_ns, build_id)
+        self.entries = entries
+
+    def refresh(self, readelf_path: str | None) -> None:
+        """Updates the index to match the current contents of the symbol directory."""
+        index_path = os.path.abspath(self.index_path)
+        entries: dict[str, tuple[int, int, str | None]] = {}
+        for root, _, files in os.walk(self.symbol_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.abspath(path) == index_path:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                rel_path = os.path.relpath(path, self.symbol_dir)
+                entry = self.entries.get(rel_path)
+                if entry is None or entry[:2] != (stat.st_size, stat.st_mtime_ns):
+                    build_id = None
+                    if is_elf_file(path):
+                        build_id = get_build_id(readelf_path, path)
+                    entry = (stat.st_size, stat.st_mtime_ns, build_id)
+                    self.dirty = True
+                entries[rel_path] = entry
+        if entries.keys() != self.entries.keys():
+            self.dirty = True
+        self.entries = entries
+
+        # The map is replaced rather than updated in place, since a long running
+        # ndk-stack looks up build ids while the index is being refreshed.
+        paths_by_build_id: dict[str, str] = {}
+        for rel_path, (_, _, build_id) in sorted(entries.items()):
+            if build_id is not None:
+                paths_by_build_id.setdefault(
+                    build_id, os.path.join(self.symbol_dir, rel_path)
+                )
+        self.paths_by_build_id = paths_by_build_id
+
+    def save(self) -> None:
+        """Writes the index back to disk if it changed."""
+        if not self.dirty:
+            return
+        data = {
+            "version": self.VERSION,
+            "symbol_dir": os.path.abspath(self.symbol_dir),
+            "files": self.entries,
+        }
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as index_file:
+            json.dump(data, index_file)
+        os.replace(tmp_path, self.index_path)
+        self.dirty = False
+
+    def lookup(self, build_id: str) -> str | None:
+        """Returns the path of the ELF file with the given build id, if any."""
+        return self.paths_by_build_id.get(build_id)
+
+
+def find_zip_info(
+    infos: list[zipfile.ZipInfo], file_size: int, offset: int
+) -> zipfile.ZipInfo | None:
+    """Find the entry of a zip file that contains the given file offset.
+
+    Args:
+        infos: The entries of the zip file sorted by header_offset.
+        file_size: The size of the zip file.
+        offset: The offset into the zip file.
+
+    Returns: The ZipInfo of the last entry that starts at or before 'offset',
+             or None if 'offset' is not within any entry.
+    """
+    if offset >= file_size:
+        return None
+    index = bisect.bisect_right(infos, offset, key=lambda info: info.header_offset)
+    if index == 0:
+        return None
+    return infos[index - 1]
+
+
 def get_zip_info_from_offset(
     zip_file: zipfile.ZipFile, offset: int
 ) -> zipfile.ZipInfo | None:
@@ -143,22 +308,185 @@ def get_zip_info_from_offset(
     if offset >= file_size:
         return None
 
-    # The code below requires that the infos are sorted by header_offset,
-    # so sort the infos.
     infos = sorted(zip_file.infolist(), key=lambda info: info.header_offset)
-    if not infos or offset < infos[0].header_offset:
-        return None
+    return find_zip_info(infos, file_size, offset)
 
-    for i in range(1, len(infos)):
-        prev_info = infos[i - 1]
-        cur_offset = infos[i].header_offset
-        if prev_info.header_offset <= offset < cur_offset:
-            zip_info = prev_info
-            return zip_info
-    zip_info = infos[len(infos) - 1]
-    if offset < zip_info.header_offset:
-        return None
-    return zip_info
+
+class ApkFile:
+    """An apk whose libraries are looked up by the offset they were mapped at.
+
+    The central directory is read and sorted once, so each lookup is a
+    binary search. Each library is extracted at most once. Libraries that are
+    stored uncompressed (as page-aligned libraries are) have their build id
+    read in place, so mismatched libraries are never copied out of the apk, and
+    matching ones are copied without going through zipfile's decompressor.
+    """
+
+    # The fixed size part of a zip local file header.
+    _local_header = struct.Struct("<4s22xHH")
+
+    def __init__(self, path: str, extract_dir: str) -> None:
+        self.path = path
+        self.extract_dir = extract_dir
+        stat = os.stat(path)
+        self.file_size = stat.st_size
+        # Used to notice when a long running ndk-stack sees the apk change.
+        self.mtime_ns = stat.st_mtime_ns
+        self.zip_file = zipfile.ZipFile(path)
+        self.infos = sorted(
+            self.zip_file.infolist(), key=lambda info: info.header_offset
+        )
+        # Maps the header offset of each extracted entry to its path.
+        self.extracted: dict[int, str] = {}
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        self.zip_file.close()
+
+    def find_entry(self, offset: int) -> zipfile.ZipInfo | None:
+        """Returns the entry that contains the given offset into the apk."""
+        return find_zip_info(self.infos, self.file_size, offset)
+
+    def data_offset(self, zip_info: zipfile.ZipInfo) -> int:
+        """Returns the offset of the entry's data in the apk."""
+        with open(self.path, "rb") as apk:
+            apk.seek(zip_info.header_offset)
+            header = apk.read(self._local_header.size)
+        if len(header) != self._local_header.size:
+            raise zipfile.BadZipFile("Truncated local file header")
+        magic, name_len, extra_len = self._local_header.unpack(header)
+        if magic != b"PK\x03\x04":
+            raise zipfile.BadZipFile("Bad magic number for local file header")
+        data_offset: int = (
+            zip_info.header_offset + self._local_header.size + name_len + extra_len
+        )
+        return data_offset
+
+    def entry_identity(self, zip_info: zipfile.ZipInfo) -> str:
+        """Returns a string that changes whenever the entry may have changed.
+
+        Unlike the path an entry is extracted to, this is the same in every run
+        of ndk-stack, so it can identify extracted files in persistent caches.
+        """
+        return "%s:%d:%d!%s:%d" % (
+            os.path.abspath(self.path),
+            self.file_size,
+            self.mtime_ns,
+            zip_info.filename,
+            zip_info.header_offset,
+        )
+
+    def get_build_id(self, zip_info: zipfile.ZipInfo) -> str | None:
+        """Reads the build id of an uncompressed entry without extracting it."""
+        assert zip_info.compress_type == zipfile.ZIP_STORED
+        try:
+            return elfnote.read_notes(self.path, self.data_offset(zip_info)).build_id
+        except (elfnote.ElfError, zipfile.BadZipFile):
+            return None
+
+    def extract(self, zip_info: zipfile.ZipInfo) -> str:
+        """Extracts an entry, or returns the path it was already extracted to."""
+        with self.lock:
+            return self._extract(zip_info)
+
+    def _extract(self, zip_info: zipfile.ZipInfo) -> str:
+        path = self.extracted.get(zip_info.header_offset)
+        if path is not None:
+            return path
+        if zip_info.compress_type == zipfile.ZIP_STORED:
+            # Keep the entry's directories, as zip_file.extract() does, so that
+            # each ABI's copy of a library is extracted to its own file.
+            parts = [
+                part
+                for part in zip_info.filename.split("/")
+                if part not in ("", ".", "..")
+            ]
+            path = os.path.join(self.extract_dir, *parts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(self.path, "rb") as apk, open(path, "wb") as output:
+                apk.seek(self.data_offset(zip_info))
+                remaining = zip_info.file_size
+                while remaining > 0:
+                    chunk = apk.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        raise zipfile.BadZipFile("Truncated file data")
+                    output.write(chunk)
+                    remaining -= len(chunk)
+        else:
+            path = self.zip_file.extract(zip_info, self.extract_dir)
+        self.extracted[zip_info.header_offset] = path
+        return path
+
+
+class ApkCache:
+    """The apks opened while symbolizing, each extracting to its own directory.
+
+    Apks are used by many threads at once. An apk that changed on disk is
+    replaced in the cache, but is only closed once every thread that was using
+    it is done with it.
+    """
+
+    def __init__(self, tmp_dir: TmpDir) -> None:
+        self.tmp_dir = tmp_dir
+        self.apks: dict[str, ApkFile] = {}
+        # The number of threads using each open apk, including replaced ones.
+        self.users: dict[ApkFile, int] = {}
+        self.num_opened = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> ApkCache:
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self.lock:
+            for apk in self.apks.values():
+                self._release(apk)
+            self.apks = {}
+
+    def _release(self, apk: ApkFile) -> None:
+        """Drops a reference to apk, closing it if it was the last one."""
+        users = self.users.pop(apk) - 1
+        if users:
+            self.users[apk] = users
+        else:
+            apk.close()
+
+    @contextlib.contextmanager
+    def open(self, path: str) -> Iterator[ApkFile]:
+        """Returns the ApkFile for path, opening it if needed.
+
+        The ApkFile stays open until the context is exited. An apk that has
+        changed since it was opened is opened again.
+
+        Raises:
+          OSError: The apk does not exist.
+        """
+        with self.lock:
+            apk = self.apks.get(path)
+            if apk is not None:
+                stat = os.stat(path)
+                if (stat.st_mtime_ns, stat.st_size) != (apk.mtime_ns, apk.file_size):
+                    del self.apks[path]
+                    self._release(apk)
+                    apk = None
+            if apk is None:
+                extract_dir = os.path.join(
+                    self.tmp_dir.get_directory(), "apk%d" % self.num_opened
+                )
+                self.num_opened += 1
+                apk = ApkFile(path, extract_dir)
+                self.apks[path] = apk
+                # The cache's own reference.
+                self.users[apk] = 1
+            self.users[apk] += 1
+        try:
+            yield apk
+        finally:
+            with self.lock:
+                self._release(apk)
 
 
 class FrameInfo:
@@ -233,67 +561,143 @@ class FrameInfo:
             self.build_id = m.group(1)
         else:
             self.build_id = None
+        # Set by get_elf_file if the ELF file was extracted from an apk. See
+        # ApkFile.entry_identity.
+        self.elf_identity: str | None = None
 
     def verify_elf_file(
-        self, readelf_path: str | None, elf_file_path: str, display_elf_path: str
+        self,
+        readelf_path: str | None,
+        elf_file_path: str,
+        display_elf_path: str,
+        log: TextIO | None = None,
     ) -> bool:
         """Verify if the elf file is valid.
 
+        Warnings are written to log, or to stdout if log is None.
+
         Returns: True if the elf file exists and build id matches (if it exists).
         """
 
         if not os.path.exists(elf_file_path):
             return False
-        if readelf_path and self.build_id:
+        if self.build_id:
             build_id = get_build_id(readelf_path, elf_file_path)
-            if self.build_id != build_id:
-                print("WARNING: Mismatched build id for %s" % (display_elf_path))
-                print("WARNING:   Expected %s" % (self.build_id))
-                print("WARNING:   Found    %s" % (build_id))
-                return False
+            return self.verify_build_id(build_id, display_elf_path, log)
+        return True
+
+    def verify_build_id(
+        self, build_id: str | None, display_elf_path: str, log: TextIO | None = None
+    ) -> bool:
+        """Verify that a build id matches the build id of this frame.
+
+        Warnings are written to log, or to stdout if log is None.
+
+        Returns: True if the build id matches or the frame has no build id.
+        """
+
+        if self.build_id and self.build_id != build_id:
+            print(
+                "WARNING: Mismatched build id for %s" % (display_elf_path),
+                file=log,
+            )
+            print("WARNING:   Expected %s" % (self.build_id), file=log)
+            print("WARNING:   Found    %s" % (build_id), file=log)
+            return False
         return True
 
+    def extract_elf_file(
+        self,
+        apk: ApkFile,
+        zip_info: zipfile.ZipInfo,
+        readelf_path: str | None,
+        display_elf_path: str,
+        log: TextIO | None = None,
+    ) -> str | None:
+        """Extract the elf file for this frame from an apk.
+
+        Returns: The path to the extracted elf file, or None if its build id
+                 does not match.
+        """
+
+        if zip_info.compress_type == zipfile.ZIP_STORED:
+            # Check the build id in place so mismatched files are never copied.
+            if not self.verify_build_id(
+                apk.get_build_id(zip_info), display_elf_path, log
+            ):
+                return None
+            elf_file_path = apk.extract(zip_info)
+        else:
+            elf_file_path = apk.extract(zip_info)
+            if not self.verify_elf_file(
+                readelf_path, elf_file_path, display_elf_path, log
+            ):
+                return None
+        self.elf_identity = apk.entry_identity(zip_info)
+        return elf_file_path
+
     def get_elf_file(
-        self, symbol_dir: str, readelf_path: str | None, tmp_dir: TmpDir
+        self,
+        symbol_dir: str,
+        readelf_path: str | None,
+        tmp_dir: TmpDir,
+        log: TextIO | None = None,
+        build_id_index: BuildIdIndex | None = None,
+        apk_cache: ApkCache | None = None,
     ) -> str | None:
         """Get the path to the elf file represented by this frame.
 
         Returns: The path to the elf file if it is valid, or None if
                  no valid elf file can be found. If the file has to be
                  extracted from an apk, the elf file will be placed in
-                 tmp_dir.
+                 tmp_dir. Warnings are written to log (see verify_elf_file).
+                 If a build_id_index is given, frames with a build id are
+                 looked up in it before searching by file name. Apks are
+                 opened through apk_cache if given, so that lookups and
+                 extractions are shared between frames.
         """
 
+        if apk_cache is None:
+            with ApkCache(tmp_dir) as apk_cache:
+                return self.get_elf_file(
+                    symbol_dir, readelf_path, tmp_dir, log, build_id_index, apk_cache
+                )
+
         elf_file = os.path.basename(self.elf_file)
+        # Frames for a bare apk need the name of the library in the apk, so
+        # those always go through the search below.
+        if build_id_index is not None and self.build_id is not None:
+            if self.container_file or elf_file[-4:] != ".apk":
+                elf_file_path = build_id_index.lookup(self.build_id)
+                if elf_file_path is not None:
+                    return elf_file_path
+
         if self.container_file:
             # This matches a file format such as Base.apk!libsomething.so
             # so see if we can find libsomething.so in the symbol directory.
             elf_file_path = os.path.join(symbol_dir, elf_file)
-            if self.verify_elf_file(readelf_path, elf_file_path, elf_file_path):
+            if self.verify_elf_file(readelf_path, elf_file_path, elf_file_path, log):
                 return elf_file_path
 
             apk_file_path = os.path.join(
                 symbol_dir, os.path.basename(self.container_file)
             )
-            with zipfile.ZipFile(apk_file_path) as zip_file:
+            with apk_cache.open(apk_file_path) as apk:
                 assert self.offset is not None
-                zip_info = get_zip_info_from_offset(zip_file, self.offset)
+                zip_info = apk.find_entry(self.offset)
                 if not zip_info:
                     return None
-                elf_file_path = zip_file.extract(zip_info, tmp_dir.get_directory())
                 display_elf_file = "%s!%s" % (apk_file_path, elf_file)
-                if not self.verify_elf_file(
-                    readelf_path, elf_file_path, display_elf_file
-                ):
-                    return None
-                return elf_file_path
+                return self.extract_elf_file(
+                    apk, zip_info, readelf_path, display_elf_file, log
+                )
         elif elf_file[-4:] == ".apk":
             # This matches a stack line such as:
             #   #08 pc 00cbed9c  GoogleCamera.apk (offset 0x6e32000)
             apk_file_path = os.path.join(symbol_dir, elf_file)
-            with zipfile.ZipFile(apk_file_path) as zip_file:
+            with apk_cache.open(apk_file_path) as apk:
                 assert self.offset is not None
-                zip_info = get_zip_info_from_offset(zip_file, self.offset)
+                zip_info = apk.find_entry(self.offset)
                 if not zip_info:
                     return None
 
@@ -312,22 +716,722 @@ class FrameInfo:
                     )
                 elf_file = os.path.basename(zip_info.filename)
                 elf_file_path = os.path.join(symbol_dir, elf_file)
-                if self.verify_elf_file(readelf_path, elf_file_path, elf_file_path):
+                if self.verify_elf_file(
+                    readelf_path, elf_file_path, elf_file_path, log
+                ):
                     return elf_file_path
 
-                elf_file_path = zip_file.extract(zip_info, tmp_dir.get_directory())
                 display_elf_path = "%s!%s" % (apk_file_path, elf_file)
-                if not self.verify_elf_file(
-                    readelf_path, elf_file_path, display_elf_path
-                ):
-                    return None
-                return elf_file_path
+                return self.extract_elf_file(
+                    apk, zip_info, readelf_path, display_elf_path, log
+                )
         elf_file_path = os.path.join(symbol_dir, elf_file)
-        if self.verify_elf_file(readelf_path, elf_file_path, elf_file_path):
+        if self.verify_elf_file(readelf_path, elf_file_path, elf_file_path, log):
             return elf_file_path
         return None
 
 
+class Symbolizer:
+    """An llvm-symbolizer(1) process that answers queries in batches.
+
+    Every query in a batch is written to the symbolizer in a single stream
+    while the replies are read back, so a crash dump costs one round-trip
+    rather than one per frame. Replies are returned in query order.
+
+    If json_output is True, the symbolizer uses --output-style=JSON and each
+    reply is a single line of JSON.
+    """
+
+    def __init__(self, cmd: list[str], json_output: bool = False) -> None:
+        self.json_output = json_output
+        if json_output:
+            cmd = cmd + ["--output-style=JSON"]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def close(self) -> None:
+        assert self.proc.stdin is not None
+        assert self.proc.stdout is not None
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc.kill()
+        self.proc.wait()
+
+    def symbolize(self, queries: list[tuple[str, str]]) -> list[list[str]]:
+        """Symbolizes a batch of (elf file, hex pc) queries.
+
+        Returns: The lines of symbolizer output for each query, in order.
+        """
+        if not queries:
+            return []
+        request = "".join('"%s" 0x%s\n' % query for query in queries).encode()
+        # Write from another thread so that a large batch can't deadlock with
+        # the symbolizer blocking on a full stdout pipe.
+        writer = threading.Thread(target=self._write, args=(request,))
+        writer.start()
+        try:
+            return [self._read_reply() for _ in queries]
+        finally:
+            writer.join()
+
+    def _write(self, request: bytes) -> None:
+        assert self.proc.stdin is not None
+        try:
+            self.proc.stdin.write(request)
+            self.proc.stdin.flush()
+        except OSError:
+            # The symbolizer died. The reader will see EOF.
+            pass
+
+    def _read_reply(self) -> list[str]:
+        assert self.proc.stdout is not None
+        if self.json_output:
+            line = self.proc.stdout.readline().rstrip()
+            return [line.decode()] if line else []
+        lines: list[str] = []
+        while True:
+            line = self.proc.stdout.readline().rstrip()
+            if not line:
+                return lines
+            lines.append(line.decode())
+
+
+class SymbolizerPool:
+    """A pool of up to size Symbolizers, started as they are needed."""
+
+    def __init__(self, cmd: list[str], size: int, json_output: bool = False) -> None:
+        self.cmd = cmd
+        self.size = size
+        self.json_output = json_output
+        self.symbolizers: list[Symbolizer] = []
+        self.idle: queue.SimpleQueue[Symbolizer] = queue.SimpleQueue()
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> SymbolizerPool:
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for symbolizer in self.symbolizers:
+            symbolizer.close()
+        self.symbolizers = []
+
+    @contextlib.contextmanager
+    def acquire(self) -> Iterator[Symbolizer]:
+        """Takes a Symbolizer from the pool for the duration of the context."""
+        try:
+            symbolizer = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                start_new = len(self.symbolizers) < self.size
+                if start_new:
+                    symbolizer = Symbolizer(self.cmd, self.json_output)
+                    self.symbolizers.append(symbolizer)
+            if not start_new:
+                symbolizer = self.idle.get()
+        try:
+            yield symbolizer
+        finally:
+            self.idle.put(symbolizer)
+
+
+def elf_file_identity(path: str) -> str | None:
+    """Returns a string that changes whenever the file at path changes.
+
+    Files extracted from apks are identified by ApkFile.entry_identity instead,
+    since they are extracted to a new temporary directory in each run.
+
+    Returns: None if the file can't be stat'd.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return "%s:%d:%d" % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+class SymbolCache:
+    """A cache of symbolizer output keyed by build id, ELF file and pc.
+
+    The build id alone doesn't identify the symbols: a library extracted from
+    an apk is usually stripped, but has the same build id as the unstripped
+    library in the symbol directory. Keys include the identity of the file that
+    was symbolized (see elf_file_identity and ApkFile.entry_identity), so
+    output from one is never served for the other.
+
+    The most recently used max_entries results are kept in memory. If path is
+    given, the cache is also loaded from and saved to that file, so repeated
+    frames are only symbolized once across runs.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path: str | None = None, max_entries: int = 100000) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.entries: collections.OrderedDict[
+            str, list[str]
+        ] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(build_id: str, elf_identity: str, pc: str, json_output: bool) -> str:
+        return "%s:%s:%x:%s" % (
+            "json" if json_output else "text",
+            build_id,
+            int(pc, 16),
+            elf_identity,
+        )
+
+    def get(self, key: str) -> list[str] | None:
+        with self.lock:
+            symbolizer_output = self.entries.get(key)
+            if symbolizer_output is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return symbolizer_output
+
+    def put(self, key: str, symbolizer_output: list[str]) -> None:
+        with self.lock:
+            self.entries[key] = symbolizer_output
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def load(self) -> None:
+        """Loads the saved cache, if there is one."""
+        if self.path is None:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.VERSION:
+            return
+        with self.lock:
+            self.entries = collections.OrderedDict(data["entries"])
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def save(self) -> None:
+        """Writes the cache back to disk if it changed."""
+        if self.path is None or not self.dirty:
+            return
+        with self.lock:
+            data = {"version": self.VERSION, "entries": self.entries}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                json.dump(data, cache_file)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+def ordered_map(func: Callable[[T], U], items: Iterable[T], jobs: int) -> Iterator[U]:
+    """Like map(), but calls func on up to jobs items in parallel.
+
+    Results are returned in the order of items. Only a bounded number of items
+    are read ahead, so items may be a stream.
+    """
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending: collections.deque[concurrent.futures.Future[U]] = collections.deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 4 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_input_files(paths: list[str]) -> Iterator[str]:
+    """Expands directories in paths to the files they contain, sorted by name."""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                file_path = os.path.join(path, name)
+                if os.path.isfile(file_path):
+                    yield file_path
+        else:
+            yield path
+
+
+def iter_input_crash_dumps(
+    input_file: TextIO | None, paths: list[str]
+) -> Iterator[list[str]]:
+    """Returns the crash dumps of every input.
+
+    Each input file is split into crash dumps independently. If no inputs
+    are given, stdin is used.
+    """
+    if input_file is None and not paths:
+        input_file = sys.stdin
+    if input_file is not None:
+        yield from iter_crash_dumps(input_file)
+    for path in iter_input_files(paths):
+        with open(path, encoding="utf-8", errors="replace") as tombstone:
+            yield from iter_crash_dumps(tombstone)
+
+
+def iter_crash_dumps(lines: Iterable[str]) -> Iterator[list[str]]:
+    """Splits input lines into crash dumps.
+
+    Lines outside of a crash dump are dropped.
+
+    Returns: An iterator over the lines of each crash dump. The first line
+             contains the crash banner. If the crash dump was completed, the
+             last line is the one that completed it.
+    """
+    crash: list[str] | None = None
+    saw_frame = False
+    for line in lines:
+        line = line.rstrip()
+
+        if crash is None:
+            if CRASH_BANNER in line:
+                crash = [line]
+                saw_frame = False
+            continue
+
+        crash.append(line)
+        frame_info = FrameInfo.from_line(line)
+        if not frame_info:
+            if saw_frame:
+                yield crash
+                crash = None
+            continue
+
+        # There can be a gap between sanitizer frames in the abort message
+        # and the actual backtrace. Do not end the crash dump until we've
+        # seen the actual backtrace.
+        if not frame_info.sanitizer:
+            saw_frame = True
+    if crash is not None:
+        yield crash
+
+
+@dataclass
+class ResolvedFrame:
+    """A backtrace frame and the ELF file found for it.
+
+    Attributes:
+      frame_info: The parsed frame.
+      elf_file: The path to the ELF file for the frame, or None if none was
+                found.
+      warnings: Warnings printed while looking for the ELF file.
+      symbolizer_output: The symbolizer's reply for the frame. For JSON output,
+                         this is a single line of JSON.
+    """
+
+    frame_info: FrameInfo
+    elf_file: str | None
+    warnings: str
+    symbolizer_output: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ResolvedCrashDump:
+    """A crash dump with its frames matched to ELF files.
+
+    Attributes:
+      items: The output of the crash dump in input order. Each item is either
+             a line of text or a frame.
+      fingerprint: The build fingerprint, if the crash dump had one.
+      abort_message: The abort message, if the crash dump had one.
+    """
+
+    items: list[str | ResolvedFrame] = field(default_factory=list)
+    fingerprint: str | None = None
+    abort_message: str | None = None
+
+    @property
+    def frames(self) -> list[ResolvedFrame]:
+        return [item for item in self.items if isinstance(item, ResolvedFrame)]
+
+
+def resolve_crash_dump(
+    crash: list[str],
+    symbol_dir: str,
+    readelf_path: str | None,
+    tmp_dir: TmpDir,
+    build_id_index: BuildIdIndex | None = None,
+    apk_cache: ApkCache | None = None,
+) -> ResolvedCrashDump:
+    """Parses a crash dump from iter_crash_dumps and finds its ELF files."""
+    crash_dump = ResolvedCrashDump()
+    saw_frame = False
+    for line in crash[1:]:
+        for tag in ["Build fingerprint:", "Abort message:"]:
+            if tag in line:
+                tagged = line[line.find(tag) :]
+                crash_dump.items.append(tagged)
+                value = tagged[len(tag) :].strip()
+                if len(value) >= 2 and value[0] == value[-1] == "'":
+                    value = value[1:-1]
+                if tag == "Build fingerprint:":
+                    crash_dump.fingerprint = value
+                else:
+                    crash_dump.abort_message = value
+
+        frame_info = FrameInfo.from_line(line)
+        if not frame_info:
+            if saw_frame:
+                crash_dump.items.append("Crash dump is completed\n")
+            continue
+
+        if not frame_info.sanitizer:
+            saw_frame = True
+
+        log = io.StringIO()
+        try:
+            elf_file = frame_info.get_elf_file(
+                symbol_dir, readelf_path, tmp_dir, log, build_id_index, apk_cache
+            )
+        except IOError:
+            elf_file = None
+        crash_dump.items.append(ResolvedFrame(frame_info, elf_file, log.getvalue()))
+    return crash_dump
+
+
+def symbolize_frames(
+    crash_dump: ResolvedCrashDump,
+    symbolizer: Symbolizer,
+    symbol_cache: SymbolCache | None = None,
+) -> None:
+    """Symbolizes every frame of a crash dump in a single batch.
+
+    Frames found in symbol_cache are not sent to the symbolizer, and frames
+    that repeat within the crash dump are only sent once.
+    """
+    queries: list[tuple[str, str]] = []
+    cache_keys: list[str | None] = []
+    query_indices: dict[str, int] = {}
+    elf_identities: dict[str, str | None] = {}
+    # Each frame to symbolize and the index of its query.
+    frame_queries: list[tuple[ResolvedFrame, int]] = []
+    for frame in crash_dump.frames:
+        if not frame.elf_file:
+            continue
+        cache_key = None
+        if symbol_cache is not None:
+            # A frame's own build id has already been checked against the file.
+            build_id = frame.frame_info.build_id or get_build_id(None, frame.elf_file)
+            elf_identity = frame.frame_info.elf_identity
+            if elf_identity is None:
+                if frame.elf_file not in elf_identities:
+                    elf_identities[frame.elf_file] = elf_file_identity(frame.elf_file)
+                elf_identity = elf_identities[frame.elf_file]
+            if build_id and elf_identity:
+                cache_key = SymbolCache.make_key(
+                    build_id, elf_identity, frame.frame_info.pc, symbolizer.json_output
+                )
+                symbolizer_output = symbol_cache.get(cache_key)
+                if symbolizer_output is not None:
+                    frame.symbolizer_output = symbolizer_output
+                    continue
+                if cache_key in query_indices:
+                    frame_queries.append((frame, query_indices[cache_key]))
+                    continue
+                query_indices[cache_key] = len(queries)
+        frame_queries.append((frame, len(queries)))
+        queries.append((frame.elf_file, frame.frame_info.pc))
+        cache_keys.append(cache_key)
+
+    replies = symbolizer.symbolize(queries)
+    if symbol_cache is not None:
+        for cache_key, symbolizer_output in zip(cache_keys, replies):
+            if cache_key is not None:
+                symbol_cache.put(cache_key, symbolizer_output)
+    for frame, index in frame_queries:
+        frame.symbolizer_output = replies[index]
+
+
+def format_crash_dump(crash_dump: ResolvedCrashDump) -> str:
+    """Formats a symbolized crash dump as text."""
+    out = ["********** Crash dump: **********\n"]
+    for item in crash_dump.items:
+        if isinstance(item, str):
+            out.append(item + "\n")
+            continue
+        frame_info = item.frame_info
+        out.append(item.warnings)
+        # Print a slightly different version of the stack trace line.
+        # The original format:
+        #      #00 pc 0007b350  /lib/bionic/libc.so (__strchr_chk+4)
+        # becomes:
+        #      #00 0x0007b350 /lib/bionic/libc.so (__strchr_chk+4)
+        out_line = "%s 0x%s %s" % (frame_info.num, frame_info.pc, frame_info.tail)
+        out.append(out_line + "\n")
+        indent = (out_line.find("(") + 1) * " "
+        # TODO: rewrite file names base on a source path?
+        for line in item.symbolizer_output:
+            out.append("%s%s\n" % (indent, line))
+    return "".join(out)
+
+
+def crash_dump_to_json(crash_dump: ResolvedCrashDump) -> dict[str, object]:
+    """Converts a crash dump symbolized with JSON output to a JSON object."""
+    frames = []
+    for frame in crash_dump.frames:
+        frame_info = frame.frame_info
+        symbols = []
+        for line in frame.symbolizer_output:
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                continue
+            # Inlined functions are listed innermost first.
+            for symbol in reply.get("Symbol", []):
+                symbols.append(
+                    {
+                        "function": symbol.get("FunctionName"),
+                        "file": symbol.get("FileName"),
+                        "line": symbol.get("Line"),
+                        "column": symbol.get("Column"),
+                    }
+                )
+        frames.append(
+            {
+                "num": int(frame_info.num[1:]),
+                "pc": "0x" + frame_info.pc,
+                "elf": frame_info.elf_file,
+                "container": frame_info.container_file,
+                "offset": frame_info.offset,
+                "build_id": frame_info.build_id,
+                "symbol_file": frame.elf_file,
+                "symbols": symbols,
+            }
+        )
+    return {
+        "fingerprint": crash_dump.fingerprint,
+        "abort_message": crash_dump.abort_message,
+        "frames": frames,
+    }
+
+
+def symbolize_crash_dump(
+    crash: list[str],
+    symbol_dir: str,
+    readelf_path: str | None,
+    tmp_dir: TmpDir,
+    symbolizer: Symbolizer,
+    build_id_index: BuildIdIndex | None = None,
+    apk_cache: ApkCache | None = None,
+) -> str:
+    """Symbolizes a crash dump from iter_crash_dumps.
+
+    All of the frames are sent to the symbolizer as a single batch.
+
+    Returns: The symbolized crash dump.
+    """
+    crash_dump = resolve_crash_dump(
+        crash, symbol_dir, readelf_path, tmp_dir, build_id_index, apk_cache
+    )
+    symbolize_frames(crash_dump, symbolizer)
+    return format_crash_dump(crash_dump)
+
+
+class CrashSymbolizer:
+    """Symbolizes crash dumps, keeping symbolizers and caches warm between them.
+
+    Symbolizers for text and JSON output are pooled separately, and each pool
+    starts up to jobs symbolizers as they are needed.
+    """
+
+    def __init__(
+        self,
+        symbolize_cmd: list[str],
+        symbol_dir: str,
+        readelf_path: str | None,
+        jobs: int = 1,
+        build_id_index: BuildIdIndex | None = None,
+        symbol_cache: SymbolCache | None = None,
+    ) -> None:
+        self.symbol_dir = symbol_dir
+        self.readelf_path = readelf_path
+        self.jobs = jobs
+        self.build_id_index = build_id_index
+        self.symbol_cache = symbol_cache if symbol_cache is not None else SymbolCache()
+        self.tmp_dir = TmpDir()
+        self.apk_cache = ApkCache(self.tmp_dir)
+        self.symbolizer_pools = {
+            json_output: SymbolizerPool(symbolize_cmd, jobs, json_output)
+            for json_output in (False, True)
+        }
+        self.index_lock = threading.Lock()
+
+    def __enter__(self) -> CrashSymbolizer:
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for pool in self.symbolizer_pools.values():
+            pool.close()
+        self.apk_cache.close()
+        self.tmp_dir.delete()
+        self.symbol_cache.save()
+
+    def refresh_index(self) -> None:
+        """Picks up changes to the symbol directory in the build id index."""
+        if self.build_id_index is None:
+            return
+        with self.index_lock:
+            self.build_id_index.refresh(self.readelf_path)
+            self.build_id_index.save()
+
+    def symbolize(self, crash: list[str], json_output: bool) -> ResolvedCrashDump:
+        """Resolves and symbolizes a crash dump from iter_crash_dumps."""
+        crash_dump = resolve_crash_dump(
+            crash,
+            self.symbol_dir,
+            self.readelf_path,
+            self.tmp_dir,
+            self.build_id_index,
+            self.apk_cache,
+        )
+        with self.symbolizer_pools[json_output].acquire() as symbolizer:
+            symbolize_frames(crash_dump, symbolizer, self.symbol_cache)
+        return crash_dump
+
+    def symbolize_all(
+        self, crashes: Iterable[list[str]], json_output: bool
+    ) -> Iterator[ResolvedCrashDump]:
+        """Symbolizes crash dumps in parallel, returning them in order."""
+        return ordered_map(
+            lambda crash: self.symbolize(crash, json_output), crashes, self.jobs
+        )
+
+
+class JsonRpcError(Exception):
+    """An error to be returned to a JSON-RPC client."""
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+# https://www.jsonrpc.org/specification#error_object
+JSONRPC_PARSE_ERROR = -32700
+JSONRPC_INVALID_REQUEST = -32600
+JSONRPC_METHOD_NOT_FOUND = -32601
+JSONRPC_INVALID_PARAMS = -32602
+JSONRPC_INTERNAL_ERROR = -32603
+
+
+def handle_request(crash_symbolizer: CrashSymbolizer, request: object) -> object:
+    """Runs a single JSON-RPC request.
+
+    Methods:
+      symbolize: params are {"dump": text, "format": "text" or "json"}. The
+                 text result is {"text": symbolized text}. The json result is
+                 {"crashes": [crash dump], "warnings": text}, where each crash
+                 dump is as printed by --format=json.
+      refresh_index: Updates the build id index from the symbol directory.
+      stats: Returns the hit and miss counts of the symbol cache.
+
+    Returns: The result of the request.
+    """
+    if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+        raise JsonRpcError(JSONRPC_INVALID_REQUEST, "Invalid Request")
+    method = request["method"]
+    params = request.get("params", {})
+    if not isinstance(params, dict):
+        raise JsonRpcError(JSONRPC_INVALID_PARAMS, "params must be an object")
+
+    if method == "refresh_index":
+        crash_symbolizer.refresh_index()
+        return None
+    if method == "stats":
+        return crash_symbolizer.symbol_cache.stats()
+    if method != "symbolize":
+        raise JsonRpcError(JSONRPC_METHOD_NOT_FOUND, "Unknown method: " + method)
+
+    dump = params.get("dump")
+    output_format = params.get("format", "text")
+    if not isinstance(dump, str) or output_format not in ("text", "json"):
+        raise JsonRpcError(
+            JSONRPC_INVALID_PARAMS,
+            'symbolize requires a "dump" string and a "format" of text or json',
+        )
+    json_output = output_format == "json"
+    crash_dumps = crash_symbolizer.symbolize_all(
+        iter_crash_dumps(dump.splitlines()), json_output
+    )
+    if not json_output:
+        return {"text": "".join(format_crash_dump(c) for c in crash_dumps)}
+    crashes = []
+    warnings: list[str] = []
+    for crash_dump in crash_dumps:
+        crashes.append(crash_dump_to_json(crash_dump))
+        warnings.extend(frame.warnings for frame in crash_dump.frames)
+    return {"crashes": crashes, "warnings": "".join(warnings)}
+
+
+def serve(
+    crash_symbolizer: CrashSymbolizer, requests: TextIO, responses: TextIO
+) -> None:
+    """Answers JSON-RPC 2.0 requests, one JSON object per line.
+
+    Returns when requests reaches EOF.
+    """
+    for line in requests:
+        if not line.strip():
+            continue
+        request_id = None
+        response: dict[str, object] = {"jsonrpc": "2.0"}
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as ex:
+                raise JsonRpcError(JSONRPC_PARSE_ERROR, str(ex)) from ex
+            if isinstance(request, dict):
+                request_id = request.get("id")
+            response["result"] = handle_request(crash_symbolizer, request)
+        except JsonRpcError as ex:
+            response["error"] = {"code": ex.code, "message": ex.message}
+        except Exception as ex:  # pylint: disable=broad-except
+            response["error"] = {"code": JSONRPC_INTERNAL_ERROR, "message": str(ex)}
+        response["id"] = request_id
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+def serve_unix_socket(crash_symbolizer: CrashSymbolizer, path: str) -> None:
+    """Runs serve() for each connection to a Unix domain socket at path."""
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        sys.exit("Serving on a Unix domain socket is not supported on this platform")
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self) -> None:
+            requests = self.request.makefile("r", encoding="utf-8")
+            responses = self.request.makefile("w", encoding="utf-8")
+            with requests, responses:
+                serve(crash_symbolizer, requests, responses)
+
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
 def main(argv: list[str] | None = None) -> None:
     """ "Program entry point."""
     parser = argparse.ArgumentParser(
@@ -346,14 +1450,68 @@ def main(argv: list[str] | None = None) -> None:
         "-dump",
         "--dump",
         dest="input",
-        default=sys.stdin,
         type=argparse.FileType("r"),
         help="input filename",
     )
+    parser.add_argument(
+        "tombstones",
+        nargs="*",
+        metavar="TOMBSTONE",
+        help="tombstone files or directories of tombstones to symbolize",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of crash dumps to symbolize in parallel",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "json", "jsonl"],
+        default="text",
+        help=(
+            "output format. json prints an array of crash dumps; jsonl prints one "
+            "crash dump per line as soon as it is symbolized"
+        ),
+    )
+    parser.add_argument(
+        "--symbol-cache",
+        metavar="CACHE_FILE",
+        help=(
+            "file that caches symbolizer results by build id, ELF file and pc "
+            "across runs, created or updated as needed"
+        ),
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="print symbol cache hit and miss counts to stderr when done",
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        const="-",
+        metavar="SOCKET",
+        help=(
+            "run as a server answering JSON-RPC requests, one per line, on "
+            "stdin/stdout or on the given Unix domain socket"
+        ),
+    )
+    parser.add_argument(
+        "--build-id-index",
+        metavar="INDEX_FILE",
+        help=(
+            "build id index of the symbol directory, created or updated as needed. "
+            "Frames with a BuildId are found anywhere under --sym"
+        ),
+    )
     args = parser.parse_args(argv)
 
     if not os.path.exists(args.symbol_dir):
         sys.exit("{} does not exist!\n".format(args.symbol_dir))
+    if args.jobs < 1:
+        sys.exit("--jobs must be at least 1")
 
     ndk_paths = get_ndk_paths()
     symbolize_cmd = [
@@ -364,81 +1522,63 @@ def main(argv: list[str] | None = None) -> None:
     ]
     readelf_path = find_readelf(*ndk_paths)
 
-    symbolize_proc = None
-    try:
-        tmp_dir = TmpDir()
-        symbolize_proc = subprocess.Popen(
-            symbolize_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE
-        )
-        assert symbolize_proc.stdin is not None
-        assert symbolize_proc.stdout is not None
-        banner = "*** *** *** *** *** *** *** *** *** *** *** *** *** *** *** ***"
-        in_crash = False
-        saw_frame = False
-        for line in args.input:
-            line = line.rstrip()
-
-            if not in_crash:
-                if banner in line:
-                    in_crash = True
-                    saw_frame = False
-                    print("********** Crash dump: **********")
-                continue
-
-            for tag in ["Build fingerprint:", "Abort message:"]:
-                if tag in line:
-                    print(line[line.find(tag) :])
-                    continue
+    build_id_index = None
+    if args.build_id_index:
+        build_id_index = BuildIdIndex(args.build_id_index, args.symbol_dir)
+        build_id_index.load()
+        build_id_index.refresh(readelf_path)
+        build_id_index.save()
 
-            frame_info = FrameInfo.from_line(line)
-            if not frame_info:
-                if saw_frame:
-                    in_crash = False
-                    print("Crash dump is completed\n")
-                continue
+    symbol_cache = SymbolCache(args.symbol_cache)
+    symbol_cache.load()
 
-            # There can be a gap between sanitizer frames in the abort message
-            # and the actual backtrace. Do not end the crash dump until we've
-            # seen the actual backtrace.
-            if not frame_info.sanitizer:
-                saw_frame = True
+    with CrashSymbolizer(
+        symbolize_cmd,
+        args.symbol_dir,
+        readelf_path,
+        args.jobs,
+        build_id_index,
+        symbol_cache,
+    ) as crash_symbolizer:
+        if args.serve == "-":
+            serve(crash_symbolizer, sys.stdin, sys.stdout)
+            return
+        if args.serve:
+            serve_unix_socket(crash_symbolizer, args.serve)
+            return
 
-            try:
-                elf_file = frame_info.get_elf_file(
-                    args.symbol_dir, readelf_path, tmp_dir
+        json_output = args.format != "text"
+        try:
+            crashes = iter_input_crash_dumps(args.input, args.tombstones)
+            if args.format == "json":
+                print("[")
+            for i, crash_dump in enumerate(
+                crash_symbolizer.symbolize_all(crashes, json_output)
+            ):
+                if not json_output:
+                    print(format_crash_dump(crash_dump), end="")
+                    continue
+                # Keep stdout parseable by sending warnings to stderr.
+                for frame in crash_dump.frames:
+                    sys.stderr.write(frame.warnings)
+                if args.format == "jsonl":
+                    print(json.dumps(crash_dump_to_json(crash_dump)), flush=True)
+                else:
+                    if i:
+                        print(",")
+                    print(json.dumps(crash_dump_to_json(crash_dump), indent=2), end="")
+            if args.format == "json":
+                print("\n]")
+        finally:
+            if args.input:
+                args.input.close()
+            if args.cache_stats:
+                print(
+                    "symbol cache: {hits} hits, {misses} misses".format(
+                        **symbol_cache.stats()
+                    ),
+                    file=sys.stderr,
                 )
-            except IOError:
-                elf_file = None
-
-            # Print a slightly different version of the stack trace line.
-            # The original format:
-            #      #00 pc 0007b350  /lib/bionic/libc.so (__strchr_chk+4)
-            # becomes:
-            #      #00 0x0007b350 /lib/bionic/libc.so (__strchr_chk+4)
-            out_line = "%s 0x%s %s" % (frame_info.num, frame_info.pc, frame_info.tail)
-            print(out_line)
-            indent = (out_line.find("(") + 1) * " "
-            if not elf_file:
-                continue
-            value = '"%s" 0x%s\n' % (elf_file, frame_info.pc)
-            symbolize_proc.stdin.write(value.encode())
-            symbolize_proc.stdin.flush()
-            while True:
-                symbolizer_output = symbolize_proc.stdout.readline().rstrip()
-                if not symbolizer_output:
-                    break
-                # TODO: rewrite file names base on a source path?
-                print("%s%s" % (indent, symbolizer_output.decode()))
-    finally:
-        args.input.close()
-        tmp_dir.delete()
-        if symbolize_proc:
-            assert symbolize_proc.stdin is not None
-            assert symbolize_proc.stdout is not None
-            symbolize_proc.stdin.close()
-            symbolize_proc.stdout.close()
-            symbolize_proc.kill()
-            symbolize_proc.wait()
 
 
 if __name__ == "__main__":
@@ -29,13 +29,18 @@ from __future__ import division, print_function
 
 import argparse
 import logging
-import shutil
-import struct
-import subprocess
 import sys
 from pathlib import Path
 
-SEC_NAME = ".note.android.ident"
+from elfnote import (
+    ANDROID_IDENT_SECTION,
+    ElfError,
+    StructParser,
+    iterate_notes,
+    read_section,
+)
+
+SEC_NAME = ANDROID_IDENT_SECTION
 NDK_RESERVED_SIZE = 64
 
 
@@ -44,59 +49,9 @@ def logger():
     return logging.getLogger(__name__)
 
 
-def round_up_to_nearest(val, step):
-    """Round an integer, val, to the next multiple of a positive integer,
-    step."""
-    return (val + (step - 1)) // step * step
-
-
-class StructParser:
-    def __init__(self, buf):
-        self.buf = buf
-        self.pos = 0
-
-    @property
-    def remaining(self):
-        return len(self.buf) - self.pos
-
-    @property
-    def empty(self):
-        return self.remaining == 0
-
-    def read(self, read_len):
-        buf = self.buf[self.pos : read_len + self.pos]
-        self.pos += read_len
-        return buf
-
-    def read_struct(self, fmt, kind):
-        fmt = struct.Struct(fmt)
-        if self.remaining < fmt.size:
-            sys.exit("error: {} was truncated".format(kind))
-        return fmt.unpack(self.read(fmt.size))
-
-
-def iterate_notes(sec_data):
-    sec_data = StructParser(sec_data)
-    while not sec_data.empty:
-        (namesz, descsz, kind) = sec_data.read_struct("<III", "note header")
-        (name, desc) = sec_data.read_struct(
-            "{}s{}s".format(
-                round_up_to_nearest(namesz, 4), round_up_to_nearest(descsz, 4)
-            ),
-            "note body",
-        )
-        name = name[:namesz]
-        if len(name) > 0:
-            if name[-1:] == b"\0":
-                name = name[:-1]
-            else:
-                logger().warning("note name %s isn't NUL-terminated", name)
-        yield name, kind, desc[:descsz]
-
-
 def dump_android_ident_note(note):
     note = StructParser(note)
-    (android_api,) = note.read_struct("<I", "note descriptor")
+    (android_api,) = note.read_struct("I", "note descriptor")
     print("ABI_ANDROID_API: {}".format(android_api))
     if note.empty:
         return
@@ -113,79 +68,6 @@ def dump_android_ident_note(note):
         logger().warning("excess data at end of descriptor")
 
 
-# Get the offset to a section from the output of readelf
-def get_section_pos(readelf: Path, sec_name: str, file_path: str) -> tuple[int, int]:
-    cmd = [readelf, "--sections", "-W", file_path]
-    output = subprocess.check_output(cmd)
-    lines = output.decode("utf-8").splitlines()
-    for line in lines:
-        logger().debug('Checking line for "%s": %s', sec_name, line)
-        # Looking for a line like the following (all whitespace of unknown
-        # width).
-        #
-        #   [ 8] .note.android.ident NOTE 00000000 0000ec 000098 00 A 0 0 4
-        #
-        # The only column that might have internal whitespace is the first one.
-        # Since we don't care about it, remove the head of the string until the
-        # closing bracket, then split.
-        if "]" not in line:
-            continue
-        line = line[line.index("]") + 1 :]
-
-        sections = line.split()
-        if len(sections) < 5 or sec_name != sections[0]:
-            continue
-        off = int(sections[3], 16)
-        size = int(sections[4], 16)
-        return (off, size)
-    sys.exit("error: failed to find section: {}".format(sec_name))
-
-
-def get_ndk_install_path() -> Path | None:
-    try:
-        import ndk.paths  # pylint: disable=import-outside-toplevel
-
-        path = ndk.paths.get_install_path()
-        if path.exists():
-            return path
-        return None
-    except ImportError:
-        return None
-
-
-def readelf_from_ndk(ndk: Path) -> Path:
-    if not ndk.exists():
-        raise ValueError(f"--ndk is {ndk} but that path does not exist")
-    prebuilt_dir = ndk / "toolchains/llvm/prebuilt"
-    bins = list(prebuilt_dir.glob("*/bin"))
-    if not bins:
-        raise RuntimeError(f"{prebuilt_dir} contains no */bin")
-    if len(bins) != 1:
-        raise RuntimeError(f"{prebuilt_dir} contains more than one */bin")
-    bin_dir = bins[0]
-
-    readelf = (bin_dir / "llvm-readelf").with_suffix(
-        ".exe" if sys.platform == "win32" else ""
-    )
-    if not readelf.exists():
-        raise RuntimeError(f"{readelf} does not exist")
-    return readelf
-
-
-def find_readelf(ndk: Path | None) -> Path:
-    if ndk is not None:
-        return readelf_from_ndk(ndk)
-    if (install_path := get_ndk_install_path()) is not None:
-        return readelf_from_ndk(install_path)
-    if (readelf := shutil.which("llvm-readelf")) is not None:
-        return Path(readelf)
-    if (readelf := shutil.which("readelf")) is not None:
-        return Path(readelf)
-    raise RuntimeError(
-        "Could not find llvm-readelf or readelf in PATH and could find find any NDK"
-    )
-
-
 def parse_args():
     """Parses command line arguments."""
     parser = argparse.ArgumentParser()
@@ -201,7 +83,10 @@ def parse_args():
     parser.add_argument(
         "--ndk",
         type=Path,
-        help="Path to the NDK. If given, the NDK's llvm-readelf will be used.",
+        help=(
+            "Deprecated and ignored. Notes are read directly rather than with the "
+            "NDK's llvm-readelf."
+        ),
     )
     return parser.parse_args()
 
@@ -215,28 +100,28 @@ def main():
     else:
         logging.basicConfig()
 
-    file_path = args.file_path
-
-    readelf = find_readelf(args.ndk)
+    if args.ndk is not None:
+        logger().warning("--ndk is deprecated and has no effect")
 
-    with open(file_path, "rb") as obj_file:
-        (sec_off, sec_size) = get_section_pos(readelf, SEC_NAME, file_path)
+    file_path = args.file_path
 
-        obj_file.seek(sec_off)
-        sec_data = obj_file.read(sec_size)
-        if len(sec_data) != sec_size:
-            sys.exit("error: could not read {} section".format(SEC_NAME))
+    try:
+        sec_data = read_section(file_path, SEC_NAME)
+        if sec_data is None:
+            sys.exit("error: failed to find section: {}".format(SEC_NAME))
 
         print("----------ABI INFO----------")
         if len(sec_data) == 0:
             logger().warning("%s section is empty", SEC_NAME)
-        for name, kind, desc in iterate_notes(sec_data):
+        for name, kind, desc in iterate_notes(sec_data, warn=logger().warning):
             if (name, kind) == (b"Android", 1):
                 dump_android_ident_note(desc)
             else:
                 logger().warning(
                     "unrecognized note (name %s, type %d)", repr(name), kind
                 )
+    except ElfError as ex:
+        sys.exit("error: {}".format(ex))
 
 
 if __name__ == "__main__":
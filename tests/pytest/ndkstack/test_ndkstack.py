@@ -18,9 +18,12 @@
 
 from __future__ import print_function
 
+import json
 import os.path
+import tempfile
 import textwrap
 import unittest
+import zipfile
 from unittest import mock
 from unittest.mock import patch
 
@@ -32,6 +35,9 @@ except ModuleNotFoundError:  # pylint:disable=undefined-variable
     from io import StringIO
 
 import ndkstack
+from elfnote_testing import make_build_id_elf
+
+BUILD_ID = "d280fa435ad6a06508c989758d188679"
 
 
 @patch("os.path.exists")
@@ -246,13 +252,19 @@ class VerifyElfFileTests(unittest.TestCase):
     def test_elf_file_build_id_matches(self, mock_exists, mock_get_build_id):
         mock_exists.return_value = True
         frame_info = self.create_frame_info()
-        frame_info.build_id = "MOCKED_BUILD_ID"
         self.assertTrue(
             frame_info.verify_elf_file(None, "/mocked/libfake.so", "libfake.so")
         )
         mock_get_build_id.assert_not_called()
 
+        frame_info.build_id = "MOCKED_BUILD_ID"
         mock_get_build_id.return_value = "MOCKED_BUILD_ID"
+        self.assertTrue(
+            frame_info.verify_elf_file(None, "/mocked/libfake.so", "libfake.so")
+        )
+        mock_get_build_id.assert_called_once_with(None, "/mocked/libfake.so")
+
+        mock_get_build_id.reset_mock()
         self.assertTrue(
             frame_info.verify_elf_file(
                 "llvm-readelf", "/mocked/libfake.so", "libfake.so"
@@ -266,7 +278,7 @@ class VerifyElfFileTests(unittest.TestCase):
         frame_info = self.create_frame_info()
         frame_info.build_id = "DIFFERENT_BUILD_ID"
         with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
-            self.assertTrue(
+            self.assertFalse(
                 frame_info.verify_elf_file(None, "/mocked/libfake.so", "none.so")
             )
             self.assertFalse(
@@ -276,6 +288,9 @@ class VerifyElfFileTests(unittest.TestCase):
             )
         output = textwrap.dedent(
             """\
+            WARNING: Mismatched build id for none.so
+            WARNING:   Expected DIFFERENT_BUILD_ID
+            WARNING:   Found    MOCKED_BUILD_ID
             WARNING: Mismatched build id for display.so
             WARNING:   Expected DIFFERENT_BUILD_ID
             WARNING:   Found    MOCKED_BUILD_ID
@@ -284,6 +299,33 @@ class VerifyElfFileTests(unittest.TestCase):
         self.assertEqual(output, mock_stdout.getvalue())
 
 
+class GetBuildIdTests(unittest.TestCase):
+    """Tests of get_build_id()."""
+
+    def setUp(self):
+        self.files_dir = os.path.join(os.path.dirname(__file__), "files")
+
+    @patch("subprocess.check_output")
+    def test_in_process(self, mock_check_output):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        lib = os.path.join(tmp_dir.name, "libbase.so")
+        with open(lib, "wb") as lib_file:
+            lib_file.write(make_build_id_elf(BUILD_ID))
+        self.assertEqual(BUILD_ID, ndkstack.get_build_id("llvm-readelf", lib))
+        mock_check_output.assert_not_called()
+
+    @patch("subprocess.check_output")
+    def test_not_elf(self, mock_check_output):
+        not_elf = os.path.join(self.files_dir, "backtrace.txt")
+        self.assertIsNone(ndkstack.get_build_id(None, not_elf))
+        mock_check_output.assert_not_called()
+
+        mock_check_output.return_value = b""
+        self.assertIsNone(ndkstack.get_build_id("llvm-readelf", not_elf))
+        mock_check_output.assert_called_once_with(["llvm-readelf", "-n", not_elf])
+
+
 class GetZipInfoFromOffsetTests(unittest.TestCase):
     """Tests of get_zip_info_from_offset()."""
 
@@ -344,13 +386,114 @@ class GetZipInfoFromOffsetTests(unittest.TestCase):
         self.assertEqual(0x1000, zip_info.header_offset)
 
 
+class ApkFileTests(unittest.TestCase):
+    """Tests of ApkFile."""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.libbase = make_build_id_elf(BUILD_ID)
+        self.apk_path = os.path.join(tmp_dir.name, "test.apk")
+        with zipfile.ZipFile(self.apk_path, "w") as zip_file:
+            zip_file.writestr("assets/readme.txt", "readme")
+            zip_file.writestr("lib/arm64/libbase.so", self.libbase, zipfile.ZIP_STORED)
+            zip_file.writestr(
+                "lib/arm64/libdeflated.so", self.libbase, zipfile.ZIP_DEFLATED
+            )
+        self.apk = ndkstack.ApkFile(self.apk_path, os.path.join(tmp_dir.name, "out"))
+        self.addCleanup(self.apk.close)
+
+    def test_find_entry(self):
+        infos = self.apk.infos
+        self.assertEqual(infos[0], self.apk.find_entry(0))
+        self.assertEqual(infos[1], self.apk.find_entry(infos[1].header_offset))
+        self.assertEqual(infos[1], self.apk.find_entry(infos[2].header_offset - 1))
+        self.assertEqual(infos[2], self.apk.find_entry(infos[2].header_offset + 1))
+        self.assertIsNone(self.apk.find_entry(os.path.getsize(self.apk_path)))
+
+    def test_stored_build_id(self):
+        zip_info = self.apk.zip_file.getinfo("lib/arm64/libbase.so")
+        self.assertEqual(BUILD_ID, self.apk.get_build_id(zip_info))
+        self.assertEqual({}, self.apk.extracted)
+
+    def test_extract(self):
+        for name in ["lib/arm64/libbase.so", "lib/arm64/libdeflated.so"]:
+            zip_info = self.apk.zip_file.getinfo(name)
+            path = self.apk.extract(zip_info)
+            with open(path, "rb") as extracted:
+                self.assertEqual(self.libbase, extracted.read())
+            with patch.object(self.apk.zip_file, "extract") as mock_extract:
+                self.assertEqual(path, self.apk.extract(zip_info))
+                mock_extract.assert_not_called()
+
+    def test_extract_same_name(self):
+        libs = {
+            "lib/armeabi-v7a/libfoo.so": make_build_id_elf(BUILD_ID, payload=b"arm32"),
+            "lib/arm64-v8a/libfoo.so": make_build_id_elf(BUILD_ID, payload=b"arm64"),
+        }
+        with zipfile.ZipFile(self.apk_path, "a") as zip_file:
+            for name, data in libs.items():
+                zip_file.writestr(name, data, zipfile.ZIP_STORED)
+        apk = ndkstack.ApkFile(self.apk_path, self.apk.extract_dir)
+        self.addCleanup(apk.close)
+        paths = [apk.extract(apk.zip_file.getinfo(name)) for name in libs]
+        self.assertNotEqual(paths[0], paths[1])
+        for path, data in zip(paths, libs.values()):
+            with open(path, "rb") as extracted:
+                self.assertEqual(data, extracted.read())
+
+
+class ApkCacheTests(unittest.TestCase):
+    """Tests of ApkCache."""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.apk_path = os.path.join(tmp_dir.name, "test.apk")
+        self.write_apk(b"v1")
+        self.tmp_dir = ndkstack.TmpDir()
+        self.addCleanup(self.tmp_dir.delete)
+
+    def write_apk(self, contents):
+        # Replaced rather than rewritten, as installing a new apk does.
+        tmp_path = self.apk_path + ".tmp"
+        with zipfile.ZipFile(tmp_path, "w") as zip_file:
+            zip_file.writestr("lib/arm64/libfoo.so", contents, zipfile.ZIP_DEFLATED)
+        os.replace(tmp_path, self.apk_path)
+
+    def test_reuse(self):
+        with ndkstack.ApkCache(self.tmp_dir) as apk_cache:
+            with apk_cache.open(self.apk_path) as first:
+                pass
+            with apk_cache.open(self.apk_path) as second:
+                self.assertIs(first, second)
+            self.assertIsNotNone(first.zip_file.fp)
+        self.assertIsNone(first.zip_file.fp)
+
+    def test_replaced_while_in_use(self):
+        with ndkstack.ApkCache(self.tmp_dir) as apk_cache:
+            with apk_cache.open(self.apk_path) as old:
+                self.write_apk(b"version 2")
+                with apk_cache.open(self.apk_path) as new:
+                    self.assertIsNot(old, new)
+                # Still usable by the thread that opened it.
+                self.assertIsNotNone(old.zip_file.fp)
+                path = old.extract(old.zip_file.getinfo("lib/arm64/libfoo.so"))
+                with open(path, "rb") as extracted:
+                    self.assertEqual(b"v1", extracted.read())
+            self.assertIsNone(old.zip_file.fp)
+            self.assertIsNotNone(new.zip_file.fp)
+        self.assertIsNone(new.zip_file.fp)
+
+
 class GetElfFileTests(unittest.TestCase):
     """Tests of FrameInfo.get_elf_file()."""
 
     def setUp(self):
-        self.mock_zipfile = mock.MagicMock()
-        self.mock_zipfile.extract.return_value = "/fake_tmp/libtest.so"
-        self.mock_zipfile.__enter__.return_value = self.mock_zipfile
+        self.mock_apk = mock.MagicMock()
+        self.mock_apk.extract.return_value = "/fake_tmp/libtest.so"
+        self.mock_apk.find_entry.return_value.filename = "libtest.so"
+        self.mock_apk.find_entry.return_value.compress_type = zipfile.ZIP_DEFLATED
 
         self.mock_tmp = mock.MagicMock()
         self.mock_tmp.get_directory.return_value = "/fake_tmp"
@@ -392,10 +535,10 @@ class GetElfFileTests(unittest.TestCase):
             frame_info.get_elf_file("/fake_dir/symbols", None, self.mock_tmp)
         self.assertEqual("/fake/fake.apk!libtest.so", frame_info.tail)
 
-    @patch.object(ndkstack, "get_zip_info_from_offset")
-    @patch("zipfile.ZipFile")
-    def test_container_set_elf_not_in_apk(self, _, mock_get_zip_info):
-        mock_get_zip_info.return_value = None
+    @patch.object(ndkstack, "ApkFile")
+    def test_container_set_elf_not_in_apk(self, mock_apkclass):
+        mock_apkclass.return_value = self.mock_apk
+        self.mock_apk.find_entry.return_value = None
         frame_info = self.create_frame_info("/fake/fake.apk!libtest.so (offset 0x2000)")
         frame_info.verify_elf_file.return_value = False
         self.assertFalse(
@@ -403,11 +546,9 @@ class GetElfFileTests(unittest.TestCase):
         )
         self.assertEqual("/fake/fake.apk!libtest.so (offset 0x2000)", frame_info.tail)
 
-    @patch.object(ndkstack, "get_zip_info_from_offset")
-    @patch("zipfile.ZipFile")
-    def test_container_set_elf_in_apk(self, mock_zipclass, mock_get_zip_info):
-        mock_zipclass.return_value = self.mock_zipfile
-        mock_get_zip_info.return_value.filename = "libtest.so"
+    @patch.object(ndkstack, "ApkFile")
+    def test_container_set_elf_in_apk(self, mock_apkclass):
+        mock_apkclass.return_value = self.mock_apk
 
         frame_info = self.create_frame_info("/fake/fake.apk!libtest.so (offset 0x2000)")
         frame_info.verify_elf_file.side_effect = [False, True]
@@ -417,13 +558,9 @@ class GetElfFileTests(unittest.TestCase):
         )
         self.assertEqual("/fake/fake.apk!libtest.so (offset 0x2000)", frame_info.tail)
 
-    @patch.object(ndkstack, "get_zip_info_from_offset")
-    @patch("zipfile.ZipFile")
-    def test_container_set_elf_in_apk_verify_fails(
-        self, mock_zipclass, mock_get_zip_info
-    ):
-        mock_zipclass.return_value = self.mock_zipfile
-        mock_get_zip_info.return_value.filename = "libtest.so"
+    @patch.object(ndkstack, "ApkFile")
+    def test_container_set_elf_in_apk_verify_fails(self, mock_apkclass):
+        mock_apkclass.return_value = self.mock_apk
 
         frame_info = self.create_frame_info("/fake/fake.apk!libtest.so (offset 0x2000)")
         frame_info.verify_elf_file.side_effect = [False, False]
@@ -439,21 +576,19 @@ class GetElfFileTests(unittest.TestCase):
             frame_info.get_elf_file("/fake_dir/symbols", None, self.mock_tmp)
         self.assertEqual("/fake/fake.apk", frame_info.tail)
 
-    @patch.object(ndkstack, "get_zip_info_from_offset")
-    @patch("zipfile.ZipFile")
-    def test_in_apk_elf_not_in_apk(self, _, mock_get_zip_info):
-        mock_get_zip_info.return_value = None
+    @patch.object(ndkstack, "ApkFile")
+    def test_in_apk_elf_not_in_apk(self, mock_apkclass):
+        mock_apkclass.return_value = self.mock_apk
+        self.mock_apk.find_entry.return_value = None
         frame_info = self.create_frame_info("/fake/fake.apk (offset 0x2000)")
         self.assertFalse(
             frame_info.get_elf_file("/fake_dir/symbols", None, self.mock_tmp)
         )
         self.assertEqual("/fake/fake.apk (offset 0x2000)", frame_info.tail)
 
-    @patch.object(ndkstack, "get_zip_info_from_offset")
-    @patch("zipfile.ZipFile")
-    def test_in_apk_elf_in_symbol_dir(self, mock_zipclass, mock_get_zip_info):
-        mock_zipclass.return_value = self.mock_zipfile
-        mock_get_zip_info.return_value.filename = "libtest.so"
+    @patch.object(ndkstack, "ApkFile")
+    def test_in_apk_elf_in_symbol_dir(self, mock_apkclass):
+        mock_apkclass.return_value = self.mock_apk
 
         frame_info = self.create_frame_info("/fake/fake.apk (offset 0x2000)")
         frame_info.verify_elf_file.return_value = True
@@ -463,11 +598,9 @@ class GetElfFileTests(unittest.TestCase):
         )
         self.assertEqual("/fake/fake.apk!libtest.so (offset 0x2000)", frame_info.tail)
 
-    @patch.object(ndkstack, "get_zip_info_from_offset")
-    @patch("zipfile.ZipFile")
-    def test_in_apk_elf_in_apk(self, mock_zipclass, mock_get_zip_info):
-        mock_zipclass.return_value = self.mock_zipfile
-        mock_get_zip_info.return_value.filename = "libtest.so"
+    @patch.object(ndkstack, "ApkFile")
+    def test_in_apk_elf_in_apk(self, mock_apkclass):
+        mock_apkclass.return_value = self.mock_apk
 
         frame_info = self.create_frame_info("/fake/fake.apk (offset 0x2000)")
         frame_info.verify_elf_file.side_effect = [False, True]
@@ -477,11 +610,9 @@ class GetElfFileTests(unittest.TestCase):
         )
         self.assertEqual("/fake/fake.apk!libtest.so (offset 0x2000)", frame_info.tail)
 
-    @patch.object(ndkstack, "get_zip_info_from_offset")
-    @patch("zipfile.ZipFile")
-    def test_in_apk_elf_in_apk_verify_fails(self, mock_zipclass, mock_get_zip_info):
-        mock_zipclass.return_value = self.mock_zipfile
-        mock_get_zip_info.return_value.filename = "libtest.so"
+    @patch.object(ndkstack, "ApkFile")
+    def test_in_apk_elf_in_apk_verify_fails(self, mock_apkclass):
+        mock_apkclass.return_value = self.mock_apk
 
         frame_info = self.create_frame_info("/fake/fake.apk (offset 0x2000)")
         frame_info.verify_elf_file.side_effect = [False, False]
@@ -491,5 +622,477 @@ class GetElfFileTests(unittest.TestCase):
         self.assertEqual("/fake/fake.apk!libtest.so (offset 0x2000)", frame_info.tail)
 
 
+@patch.object(ndkstack, "get_build_id")
+class BuildIdIndexTests(unittest.TestCase):
+    """Tests of BuildIdIndex."""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.symbol_dir = os.path.join(tmp_dir.name, "symbols")
+        self.index_path = os.path.join(tmp_dir.name, "index.json")
+        for path in ["v1/libfake.so", "v2/libfake.so"]:
+            self.write_file(path, b"\x7fELF" + path.encode())
+        self.write_file("README", b"not an elf file")
+
+    def write_file(self, rel_path, contents):
+        path = os.path.join(self.symbol_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as output:
+            output.write(contents)
+
+    def make_index(self):
+        index = ndkstack.BuildIdIndex(self.index_path, self.symbol_dir)
+        index.load()
+        index.refresh("llvm-readelf")
+        index.save()
+        return index
+
+    def test_lookup(self, mock_get_build_id):
+        mock_get_build_id.side_effect = lambda _, path: os.path.basename(
+            os.path.dirname(path)
+        )
+        index = self.make_index()
+        self.assertEqual(2, mock_get_build_id.call_count)
+        self.assertEqual(
+            os.path.join(self.symbol_dir, "v1", "libfake.so"), index.lookup("v1")
+        )
+        self.assertEqual(
+            os.path.join(self.symbol_dir, "v2", "libfake.so"), index.lookup("v2")
+        )
+        self.assertIsNone(index.lookup("v3"))
+
+    def test_incremental_refresh(self, mock_get_build_id):
+        mock_get_build_id.side_effect = lambda _, path: os.path.basename(
+            os.path.dirname(path)
+        )
+        self.make_index()
+        mock_get_build_id.reset_mock()
+
+        index = self.make_index()
+        mock_get_build_id.assert_not_called()
+        self.assertFalse(index.dirty)
+        self.assertTrue(index.lookup("v1"))
+
+        self.write_file("v3/libfake.so", b"\x7fELF v3")
+        index = self.make_index()
+        mock_get_build_id.assert_called_once_with(
+            "llvm-readelf", os.path.join(self.symbol_dir, "v3", "libfake.so")
+        )
+        self.assertTrue(index.lookup("v3"))
+
+    def test_malformed_index(self, mock_get_build_id):
+        mock_get_build_id.side_effect = lambda _, path: os.path.basename(
+            os.path.dirname(path)
+        )
+        symbol_dir = os.path.abspath(self.symbol_dir)
+        for data in [
+            [],
+            {"version": 1, "symbol_dir": symbol_dir},
+            {"version": 1, "symbol_dir": symbol_dir, "files": []},
+            {
+                "version": 1,
+                "symbol_dir": symbol_dir,
+                "files": {
+                    "README": [1, 2],
+                    "v1/libfake.so": ["big", 2, "v1"],
+                    "v2/libfake.so": [1, 2, 3],
+                },
+            },
+        ]:
+            with open(self.index_path, "w", encoding="utf-8") as index_file:
+                json.dump(data, index_file)
+            index = self.make_index()
+            self.assertTrue(index.lookup("v1"))
+            self.assertTrue(index.lookup("v2"))
+
+    def test_get_elf_file_by_build_id(self, mock_get_build_id):
+        mock_get_build_id.return_value = "d1d420a58366bf29f1312ec826f16564"
+        index = self.make_index()
+        frame_info = ndkstack.FrameInfo.from_line(
+            "  #03 pc 00002050  /fake/libother.so "
+            "(BuildId: d1d420a58366bf29f1312ec826f16564)"
+        )
+        self.assertEqual(
+            os.path.join(self.symbol_dir, "v1", "libfake.so"),
+            frame_info.get_elf_file(self.symbol_dir, None, None, build_id_index=index),
+        )
+
+
+class IterCrashDumpsTests(unittest.TestCase):
+    """Tests of iter_crash_dumps()."""
+
+    def test_split(self):
+        lines = [
+            "before the crash\n",
+            ndkstack.CRASH_BANNER + "\n",
+            "Build fingerprint: 'fake'\n",
+            "  #00 pc 00001000  /fake/libfake.so\n",
+            "end of backtrace\n",
+            "between crashes\n",
+            "prefix " + ndkstack.CRASH_BANNER + "\n",
+            "  #00 pc 00002000  /fake/libfake.so\n",
+        ]
+        self.assertEqual(
+            [
+                [
+                    ndkstack.CRASH_BANNER,
+                    "Build fingerprint: 'fake'",
+                    "  #00 pc 00001000  /fake/libfake.so",
+                    "end of backtrace",
+                ],
+                [
+                    "prefix " + ndkstack.CRASH_BANNER,
+                    "  #00 pc 00002000  /fake/libfake.so",
+                ],
+            ],
+            list(ndkstack.iter_crash_dumps(lines)),
+        )
+
+    def test_sanitizer_frames_do_not_complete(self):
+        lines = [
+            ndkstack.CRASH_BANNER,
+            "    #0 0x7b138  (/fake/libfake.so+0x7b138)",
+            "gap",
+            "  #00 pc 00001000  /fake/libfake.so",
+            "end of backtrace",
+            "after the crash",
+        ]
+        self.assertEqual([lines[:5]], list(ndkstack.iter_crash_dumps(lines)))
+
+
+@patch.object(ndkstack.FrameInfo, "get_elf_file")
+class SymbolizeCrashDumpTests(unittest.TestCase):
+    """Tests of symbolize_crash_dump()."""
+
+    def test_single_batch(self, mock_get_elf_file):
+        mock_get_elf_file.side_effect = ["/syms/liba.so", None, "/syms/libb.so"]
+        symbolizer = mock.MagicMock()
+        symbolizer.symbolize.return_value = [["func_a", "a.c:1:0"], ["func_b"]]
+        crash = [
+            ndkstack.CRASH_BANNER,
+            "Abort message: 'oops'",
+            "  #00 pc 00001000  /fake/liba.so (func_a+4)",
+            "  #01 pc 00002000  /fake/libmissing.so",
+            "  #02 pc 00003000  /fake/libb.so (func_b+8)",
+            "end of backtrace",
+        ]
+        self.assertEqual(
+            textwrap.dedent(
+                """\
+                ********** Crash dump: **********
+                Abort message: 'oops'
+                #00 0x00001000 /fake/liba.so (func_a+4)
+                                              func_a
+                                              a.c:1:0
+                #01 0x00002000 /fake/libmissing.so
+                #02 0x00003000 /fake/libb.so (func_b+8)
+                                              func_b
+                Crash dump is completed
+
+                """
+            ),
+            ndkstack.symbolize_crash_dump(crash, "/syms", None, None, symbolizer),
+        )
+        symbolizer.symbolize.assert_called_once_with(
+            [("/syms/liba.so", "00001000"), ("/syms/libb.so", "00003000")]
+        )
+
+    def test_json(self, mock_get_elf_file):
+        mock_get_elf_file.side_effect = ["/syms/liba.so", None]
+        symbolizer = mock.MagicMock()
+        symbolizer.symbolize.return_value = [
+            [
+                '{"Address":"0x1000","ModuleName":"/syms/liba.so","Symbol":['
+                '{"Column":3,"FileName":"a.h","FunctionName":"inlined","Line":7},'
+                '{"Column":0,"FileName":"a.c","FunctionName":"func_a","Line":1}]}'
+            ]
+        ]
+        crash = [
+            ndkstack.CRASH_BANNER,
+            "Build fingerprint: 'fake/fingerprint'",
+            "  #00 pc 00001000  /fake/liba.so (func_a+4) (BuildId: 1234)",
+            "  #01 pc 00002000  /fake/fake.apk!libmissing.so (offset 0x4000)",
+        ]
+        crash_dump = ndkstack.resolve_crash_dump(crash, "/syms", None, None)
+        ndkstack.symbolize_frames(crash_dump, symbolizer)
+        self.assertEqual(
+            {
+                "fingerprint": "fake/fingerprint",
+                "abort_message": None,
+                "frames": [
+                    {
+                        "num": 0,
+                        "pc": "0x00001000",
+                        "elf": "/fake/liba.so",
+                        "container": None,
+                        "offset": None,
+                        "build_id": "1234",
+                        "symbol_file": "/syms/liba.so",
+                        "symbols": [
+                            {
+                                "function": "inlined",
+                                "file": "a.h",
+                                "line": 7,
+                                "column": 3,
+                            },
+                            {
+                                "function": "func_a",
+                                "file": "a.c",
+                                "line": 1,
+                                "column": 0,
+                            },
+                        ],
+                    },
+                    {
+                        "num": 1,
+                        "pc": "0x00002000",
+                        "elf": "libmissing.so",
+                        "container": "/fake/fake.apk",
+                        "offset": 0x4000,
+                        "build_id": None,
+                        "symbol_file": None,
+                        "symbols": [],
+                    },
+                ],
+            },
+            ndkstack.crash_dump_to_json(crash_dump),
+        )
+
+
+class SymbolCacheTests(unittest.TestCase):
+    """Tests of SymbolCache."""
+
+    def test_lru(self):
+        cache = ndkstack.SymbolCache(max_entries=2)
+        cache.put("a", ["func_a"])
+        cache.put("b", ["func_b"])
+        self.assertEqual(["func_a"], cache.get("a"))
+        cache.put("c", ["func_c"])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(["func_a"], cache.get("a"))
+        self.assertEqual(["func_c"], cache.get("c"))
+        self.assertEqual({"hits": 3, "misses": 1, "entries": 2}, cache.stats())
+
+    def test_persistent(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "cache.json")
+            cache = ndkstack.SymbolCache(path)
+            cache.load()
+            cache.put("a", ["func_a"])
+            cache.save()
+
+            cache = ndkstack.SymbolCache(path)
+            cache.load()
+            self.assertEqual(["func_a"], cache.get("a"))
+
+    def make_crash_dump(self, elf_file):
+        crash_dump = ndkstack.ResolvedCrashDump()
+        for num, pc in [("#00", "1000"), ("#01", "2000"), ("#02", "1000")]:
+            frame_info = ndkstack.FrameInfo(
+                num, pc, "/fake/liba.so (BuildId: 1234)", "/fake/liba.so"
+            )
+            crash_dump.items.append(ndkstack.ResolvedFrame(frame_info, elf_file, ""))
+        return crash_dump
+
+    def make_symbolizer(self):
+        symbolizer = mock.MagicMock()
+        symbolizer.json_output = False
+        symbolizer.symbolize.side_effect = lambda queries: [
+            ["func_" + pc] for _, pc in queries
+        ]
+        return symbolizer
+
+    def test_symbolize_frames(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        liba = os.path.join(tmp_dir.name, "liba.so")
+        with open(liba, "wb") as lib:
+            lib.write(make_build_id_elf("1234"))
+        crash_dump = self.make_crash_dump(liba)
+        symbolizer = self.make_symbolizer()
+        cache = ndkstack.SymbolCache()
+
+        ndkstack.symbolize_frames(crash_dump, symbolizer, cache)
+        symbolizer.symbolize.assert_called_once_with([(liba, "1000"), (liba, "2000")])
+        self.assertEqual(
+            [["func_1000"], ["func_2000"], ["func_1000"]],
+            [frame.symbolizer_output for frame in crash_dump.frames],
+        )
+
+        symbolizer.symbolize.reset_mock()
+        ndkstack.symbolize_frames(crash_dump, symbolizer, cache)
+        symbolizer.symbolize.assert_called_once_with([])
+        self.assertEqual(3, cache.hits)
+
+    def test_symbolize_frames_other_file(self):
+        # A stripped copy of the library, as extracted from an apk, has the
+        # same build id as the one in the symbol directory.
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        stripped = os.path.join(tmp_dir.name, "stripped.so")
+        unstripped = os.path.join(tmp_dir.name, "unstripped.so")
+        for path in [stripped, unstripped]:
+            with open(path, "wb") as lib:
+                lib.write(make_build_id_elf("1234"))
+        symbolizer = mock.MagicMock()
+        symbolizer.json_output = False
+        symbolizer.symbolize.side_effect = lambda queries: [["??"] for _ in queries]
+        cache = ndkstack.SymbolCache()
+        ndkstack.symbolize_frames(self.make_crash_dump(stripped), symbolizer, cache)
+
+        symbolizer = self.make_symbolizer()
+        crash_dump = self.make_crash_dump(unstripped)
+        ndkstack.symbolize_frames(crash_dump, symbolizer, cache)
+        self.assertEqual(["func_1000"], crash_dump.frames[0].symbolizer_output)
+
+        # Replacing the file also invalidates its entries.
+        with open(unstripped, "ab") as lib:
+            lib.write(b"symbols")
+        symbolizer.symbolize.reset_mock()
+        ndkstack.symbolize_frames(crash_dump, symbolizer, cache)
+        symbolizer.symbolize.assert_called_once_with(
+            [(unstripped, "1000"), (unstripped, "2000")]
+        )
+
+    def test_symbolize_frames_missing_file(self):
+        crash_dump = self.make_crash_dump("/syms/liba.so")
+        symbolizer = self.make_symbolizer()
+        cache = ndkstack.SymbolCache()
+        ndkstack.symbolize_frames(crash_dump, symbolizer, cache)
+        self.assertEqual(0, cache.stats()["entries"])
+
+    @patch.object(ndkstack, "Symbolizer")
+    def test_apk_frames_across_runs(self, mock_symbolizer):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        symbol_dir = os.path.join(tmp_dir.name, "symbols")
+        os.mkdir(symbol_dir)
+        with zipfile.ZipFile(os.path.join(symbol_dir, "test.apk"), "w") as zip_file:
+            zip_file.writestr(
+                "lib/arm64/libfoo.so", make_build_id_elf(BUILD_ID), zipfile.ZIP_STORED
+            )
+            offset = zip_file.getinfo("lib/arm64/libfoo.so").header_offset
+        crash = [
+            "*** *** ***",
+            "  #00 pc 00001000  /data/app/test.apk!libfoo.so "
+            "(offset 0x%x) (BuildId: %s)" % (offset, BUILD_ID),
+        ]
+
+        def make_symbolizer(_cmd, json_output=False):
+            symbolizer = self.make_symbolizer()
+            symbolizer.json_output = json_output
+            return symbolizer
+
+        mock_symbolizer.side_effect = make_symbolizer
+        cache_path = os.path.join(tmp_dir.name, "cache.json")
+        # Each run extracts the library to a new temporary directory.
+        for hits in [0, 1]:
+            cache = ndkstack.SymbolCache(cache_path)
+            cache.load()
+            with ndkstack.CrashSymbolizer(
+                ["llvm-symbolizer"], symbol_dir, None, symbol_cache=cache
+            ) as crash_symbolizer:
+                crash_dump = crash_symbolizer.symbolize(crash, json_output=False)
+            self.assertEqual(["func_00001000"], crash_dump.frames[0].symbolizer_output)
+            self.assertEqual(hits, cache.hits)
+
+
+class ParallelTests(unittest.TestCase):
+    """Tests of the helpers for --jobs."""
+
+    def test_ordered_map(self):
+        items = list(range(100))
+        for jobs in [1, 4]:
+            self.assertEqual(
+                [item * 2 for item in items],
+                list(ndkstack.ordered_map(lambda item: item * 2, iter(items), jobs)),
+            )
+
+    def test_iter_input_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ["tombstone_01", "tombstone_00"]:
+                with open(os.path.join(tmp_dir, name), "w", encoding="utf-8"):
+                    pass
+            os.mkdir(os.path.join(tmp_dir, "subdir"))
+            self.assertEqual(
+                [
+                    "/fake/first",
+                    os.path.join(tmp_dir, "tombstone_00"),
+                    os.path.join(tmp_dir, "tombstone_01"),
+                ],
+                list(ndkstack.iter_input_files(["/fake/first", tmp_dir])),
+            )
+
+    @patch.object(ndkstack, "Symbolizer")
+    def test_symbolizer_pool(self, mock_symbolizer):
+        mock_symbolizer.side_effect = lambda *_: mock.MagicMock()
+        with ndkstack.SymbolizerPool(["llvm-symbolizer"], 2) as pool:
+            with pool.acquire() as first:
+                with pool.acquire() as second:
+                    self.assertIsNot(first, second)
+            with pool.acquire() as third:
+                self.assertIn(third, [first, second])
+            self.assertEqual(2, mock_symbolizer.call_count)
+        first.close.assert_called_once()
+        second.close.assert_called_once()
+
+
+class ServeTests(unittest.TestCase):
+    """Tests of serve()."""
+
+    def serve(self, crash_symbolizer, *requests):
+        responses = StringIO()
+        ndkstack.serve(
+            crash_symbolizer,
+            StringIO("".join(request + "\n" for request in requests)),
+            responses,
+        )
+        return [json.loads(line) for line in responses.getvalue().splitlines()]
+
+    def test_symbolize(self):
+        crash_dump = ndkstack.ResolvedCrashDump(items=["Abort message: 'oops'"])
+        crash_symbolizer = mock.MagicMock()
+        crash_symbolizer.symbolize_all.return_value = [crash_dump]
+        request = {
+            "jsonrpc": "2.0",
+            "id": 7,
+            "method": "symbolize",
+            "params": {"dump": "line one\nline two"},
+        }
+        self.assertEqual(
+            [
+                {
+                    "jsonrpc": "2.0",
+                    "id": 7,
+                    "result": {
+                        "text": "********** Crash dump: **********\n"
+                        "Abort message: 'oops'\n"
+                    },
+                }
+            ],
+            self.serve(crash_symbolizer, json.dumps(request)),
+        )
+        crash_symbolizer.symbolize_all.assert_called_once()
+        _, json_output = crash_symbolizer.symbolize_all.call_args.args
+        self.assertFalse(json_output)
+
+    def test_errors(self):
+        crash_symbolizer = mock.MagicMock()
+        crash_symbolizer.refresh_index.side_effect = OSError("disk on fire")
+        responses = self.serve(
+            crash_symbolizer,
+            "not json",
+            json.dumps({"jsonrpc": "2.0", "id": 1, "method": "unknown"}),
+            json.dumps({"jsonrpc": "2.0", "id": 2, "method": "symbolize"}),
+            json.dumps({"jsonrpc": "2.0", "id": 3, "method": "refresh_index"}),
+        )
+        self.assertEqual(
+            [(None, -32700), (1, -32601), (2, -32602), (3, -32603)],
+            [(r["id"], r["error"]["code"]) for r in responses],
+        )
+        self.assertEqual("disk on fire", responses[3]["error"]["message"])
+
+
 if __name__ == "__main__":
     unittest.main()